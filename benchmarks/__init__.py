@@ -0,0 +1,11 @@
+"""Benchmark suite for the SGNMT decoding core. The benchmarks use
+synthetic predictors (see ``benchmarks.predictors``) instead of real
+models, so they run on any machine without GPU, model files, or
+external libraries. Run the suite from the repository root with
+
+  python -m benchmarks.run --output report.json
+
+and compare two reports (e.g. from two commits) with
+
+  python -m benchmarks.run --output new.json --compare report.json
+"""
@@ -0,0 +1,231 @@
+"""This module contains synthetic predictors for benchmarking search
+strategies. They implement the usual predictor interfaces and produce
+score distributions with a realistic shape, but do not require any
+model files. All scores are deterministic functions of the consumed
+history, so repeated runs explore exactly the same search space.
+
+The histories are represented by integer hashes. This keeps the
+predictor states small and persistent, similarly to the states of
+neural predictors which are replaced rather than updated in place.
+"""
+
+import numpy as np
+
+from cam.sgnmt import utils
+from cam.sgnmt.predictors.core import Predictor, \
+                                      UnboundedVocabularyPredictor, \
+                                      BatchPredictor
+
+
+HASH_MODULUS = 2147483647
+"""Modulus for history hashes. History hashes are used as seeds for
+``numpy.random.RandomState`` and must be smaller than 2**32.
+"""
+
+
+def extend_hash(history_hash, word):
+    """Computes the hash of a history after consuming ``word``.
+
+    Args:
+        history_hash (int): Hash of the current history
+        word (int): Word to consume
+
+    Returns:
+        int. Hash of the extended history
+    """
+    return (history_hash * 1000003 + word + 1) % HASH_MODULUS
+
+
+class SyntheticNMTPredictor(BatchPredictor):
+    """Mimics a neural predictor with a dense posterior over the full
+    vocabulary. The logits are drawn from a normal distribution seeded
+    with the history hash. The end-of-sentence probability increases
+    once the hypothesis is longer than the source sentence.
+    """
+
+    def __init__(self, vocab_size, seed=0, temperature=2.0):
+        """Creates a new synthetic NMT predictor.
+
+        Args:
+            vocab_size (int): Size of the target vocabulary
+            seed (int): Seed which makes this predictor different from
+                        other synthetic predictors
+            temperature (float): Standard deviation of the logits.
+                                 Higher values lead to peakier
+                                 distributions
+        """
+        super(SyntheticNMTPredictor, self).__init__()
+        self.vocab_size = vocab_size
+        self.seed = seed
+        self.temperature = temperature
+
+    def initialize(self, src_sentence):
+        """Resets the history. """
+        self.src_length = len(src_sentence)
+        self.state = (extend_hash(self.seed, self.src_length), 0)
+
+    def _posterior(self, state):
+        history_hash, length = state
+        rng = np.random.RandomState(history_hash)
+        logits = self.temperature * rng.standard_normal(self.vocab_size)
+        logits[utils.EOS_ID] += 2.0 * (length - self.src_length)
+        return logits - utils.log_sum_log_semiring(logits)
+
+    def predict_next(self):
+        """Returns a dense posterior derived from the history hash. """
+        return self._posterior(self.state)
+
+    def predict_next_batch(self, states):
+        """Stacks the posteriors for all ``states``. """
+        return np.vstack([self._posterior(state) for state in states])
+
+    def get_unk_probability(self, posterior):
+        """Returns the score of the UNK token. """
+        return utils.common_get(posterior, utils.UNK_ID, utils.NEG_INF)
+
+    def consume(self, word):
+        """Extends the history hash. """
+        self.state = (extend_hash(self.state[0], word), self.state[1] + 1)
+
+    def consume_batch(self, states, words):
+        """Extends the history hashes. """
+        return [(extend_hash(h, w), l + 1) for (h, l), w in zip(states, words)]
+
+    def get_state(self):
+        """Returns the history hash and length. """
+        return self.state
+
+    def set_state(self, state):
+        """Sets the history hash and length. """
+        self.state = state
+
+    def is_equal(self, state1, state2):
+        """Compares history hashes and lengths. """
+        return state1 == state2
+
+    def has_persistent_state(self):
+        """States are immutable tuples. """
+        return True
+
+
+class SyntheticFSTPredictor(Predictor):
+    """Mimics a predictor which is constrained by a translation
+    lattice like the ``fst`` predictor. In each state, only a small
+    random subset of the vocabulary is allowed. The end-of-sentence
+    symbol is allowed once the hypothesis is at least as long as the
+    source sentence.
+    """
+
+    def __init__(self, vocab_size, branching, seed=1):
+        """Creates a new synthetic FST predictor.
+
+        Args:
+            vocab_size (int): Size of the target vocabulary
+            branching (int): Number of outgoing arcs in each state
+            seed (int): Seed which makes this predictor different from
+                        other synthetic predictors
+        """
+        super(SyntheticFSTPredictor, self).__init__()
+        self.vocab_size = vocab_size
+        self.branching = branching
+        self.seed = seed
+
+    def initialize(self, src_sentence):
+        """Resets the history. """
+        self.src_length = len(src_sentence)
+        self.state = (extend_hash(self.seed, self.src_length), 0)
+
+    def predict_next(self):
+        """Returns a dictionary with ``branching`` entries. """
+        history_hash, length = self.state
+        rng = np.random.RandomState(history_hash)
+        words = rng.randint(utils.EOS_ID + 1, self.vocab_size,
+                            size=self.branching)
+        scores = -rng.exponential(2.0, size=self.branching)
+        posterior = dict(zip(words.tolist(), scores.tolist()))
+        if length >= self.src_length:
+            posterior[utils.EOS_ID] = 0.0
+        return posterior
+
+    def get_unk_probability(self, posterior):
+        """Words outside the lattice are not allowed. """
+        return utils.NEG_INF
+
+    def consume(self, word):
+        """Extends the history hash. """
+        self.state = (extend_hash(self.state[0], word), self.state[1] + 1)
+
+    def get_state(self):
+        """Returns the history hash and length. """
+        return self.state
+
+    def set_state(self, state):
+        """Sets the history hash and length. """
+        self.state = state
+
+    def is_equal(self, state1, state2):
+        """Compares history hashes and lengths. """
+        return state1 == state2
+
+    def has_persistent_state(self):
+        """States are immutable tuples. """
+        return True
+
+
+class SyntheticNgramPredictor(UnboundedVocabularyPredictor):
+    """Mimics an n-gram language model. Scores only depend on the last
+    ``order-1`` words and are computed on demand for the requested
+    words. Words are scored with a cheap hash function to simulate a
+    lookup in a large n-gram table.
+    """
+
+    def __init__(self, order, seed=2):
+        """Creates a new synthetic n-gram predictor.
+
+        Args:
+            order (int): n-gram order
+            seed (int): Seed which makes this predictor different from
+                        other synthetic predictors
+        """
+        super(SyntheticNgramPredictor, self).__init__()
+        self.order = order
+        self.seed = seed
+
+    def initialize(self, src_sentence):
+        """Resets the history. """
+        self.history = ()
+
+    def predict_next(self, words):
+        """Scores ``words`` given the current n-gram history. """
+        history_hash = self.seed
+        for word in self.history:
+            history_hash = extend_hash(history_hash, word)
+        word_arr = np.asarray(list(words), dtype=np.int64)
+        hashes = (word_arr * 2654435761 + history_hash) % HASH_MODULUS
+        scores = -(hashes % 1000).astype(np.float64) / 100.0
+        return dict(zip(word_arr.tolist(), scores.tolist()))
+
+    def get_unk_probability(self, posterior):
+        """Constant back-off score. """
+        return -10.0
+
+    def consume(self, word):
+        """Updates the n-gram history. """
+        if self.order > 1:
+            self.history = (self.history + (word,))[-(self.order-1):]
+
+    def get_state(self):
+        """Returns the n-gram history. """
+        return self.history
+
+    def set_state(self, state):
+        """Sets the n-gram history. """
+        self.history = state
+
+    def is_equal(self, state1, state2):
+        """Compares the n-gram histories. """
+        return state1 == state2
+
+    def has_persistent_state(self):
+        """States are immutable tuples. """
+        return True
@@ -0,0 +1,359 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""This script times the SGNMT search strategies in ``cam.sgnmt.decoding``
+with synthetic predictors (see ``benchmarks.predictors``). Each
+benchmark is a combination of decoder, predictor set, beam size, and
+source sentence length. The results are written to a JSON report which
+can be compared with the report of another commit via --compare.
+
+Predictor sets are comma-separated lists of the following synthetic
+predictors:
+
+  nmt:   Dense posteriors over the full vocabulary (batch predictor)
+  fst:   Sparse dictionaries with --fst_branching entries
+  ngram: Unbounded vocabulary n-gram scorer of order --ngram_order
+
+Example:
+
+  python -m benchmarks.run --decoders beam,greedy --beam_sizes 4,12 \\
+                           --output report.json --compare old.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from cam.sgnmt import decode_utils
+from cam.sgnmt import ui
+from cam.sgnmt import utils
+from benchmarks.predictors import SyntheticNMTPredictor, \
+                                  SyntheticFSTPredictor, \
+                                  SyntheticNgramPredictor
+
+
+DEFAULT_DECODERS = "greedy,beam,dfs,astar,bucket,restarting,syncbeam,mbrbeam"
+"""Decoders which are benchmarked by default. """
+
+
+REPORT_VERSION = 1
+"""Increase if the format of the JSON report changes. """
+
+
+def get_parser():
+    """Get the parser object for the benchmark script.
+
+    Returns:
+        ArgumentParser. Parser for the benchmark options
+    """
+    parser = argparse.ArgumentParser(
+            description="Benchmarks SGNMT decoders with synthetic "
+                        "predictors.")
+    parser.add_argument("--decoders", default=DEFAULT_DECODERS,
+                        help="Comma-separated list of decoders (see "
+                        "--decoder in decode.py).")
+    parser.add_argument("--predictor_sets", default="nmt;nmt,fst;nmt,ngram",
+                        help="Semicolon-separated list of predictor sets. "
+                        "Each predictor set is a comma-separated list of "
+                        "synthetic predictors (nmt, fst, ngram).")
+    parser.add_argument("--beam_sizes", default="1,4,12",
+                        help="Comma-separated list of beam sizes.")
+    parser.add_argument("--src_lengths", default="10,30",
+                        help="Comma-separated list of source sentence "
+                        "lengths.")
+    parser.add_argument("--num_sentences", default=3, type=int,
+                        help="Number of sentences per benchmark.")
+    parser.add_argument("--repeats", default=1, type=int,
+                        help="Repeat each benchmark this many times and "
+                        "report the fastest run.")
+    parser.add_argument("--vocab_size", default=30003, type=int,
+                        help="Target vocabulary size of the synthetic "
+                        "predictors.")
+    parser.add_argument("--fst_branching", default=50, type=int,
+                        help="Number of allowed words in each state of the "
+                        "synthetic fst predictor.")
+    parser.add_argument("--ngram_order", default=4, type=int,
+                        help="Order of the synthetic ngram predictor.")
+    parser.add_argument("--max_node_expansions", default=2000, type=int,
+                        help="Passed through to decode.py. Bounds the "
+                        "search effort of dfs, restarting, bucket, and "
+                        "astar.")
+    parser.add_argument("--sgnmt_args", default="",
+                        help="Additional arguments for decode.py which are "
+                        "applied to all benchmarks, e.g. "
+                        "'--combination_scheme length_norm'.")
+    parser.add_argument("--seed", default=1, type=int,
+                        help="Seed for the synthetic source sentences.")
+    parser.add_argument("--output", default="",
+                        help="Path to the JSON report. Leave blank to only "
+                        "print the results.")
+    parser.add_argument("--compare", default="",
+                        help="Path to a JSON report to compare against.")
+    parser.add_argument("--regression_threshold", default=1.2, type=float,
+                        help="With --compare, exit with a non-zero status "
+                        "if any benchmark is slower than the reference "
+                        "by this factor.")
+    return parser
+
+
+def create_predictor(name, vocab_size, fst_branching, ngram_order):
+    """Creates a synthetic predictor.
+
+    Args:
+        name (string): One of 'nmt', 'fst', 'ngram'
+        vocab_size (int): Target vocabulary size
+        fst_branching (int): Branching factor of the fst predictor
+        ngram_order (int): Order of the ngram predictor
+
+    Returns:
+        Predictor. Synthetic predictor instance
+
+    Raises:
+        AttributeError if ``name`` is unknown
+    """
+    if name == "nmt":
+        return SyntheticNMTPredictor(vocab_size)
+    if name == "fst":
+        return SyntheticFSTPredictor(vocab_size, fst_branching)
+    if name == "ngram":
+        return SyntheticNgramPredictor(ngram_order)
+    raise AttributeError("Unknown synthetic predictor '%s'" % name)
+
+
+def create_src_sentences(n, length, vocab_size, seed):
+    """Creates random source sentences.
+
+    Args:
+        n (int): Number of sentences
+        length (int): Length of each sentence
+        vocab_size (int): Words are drawn from this range
+        seed (int): Random seed
+
+    Returns:
+        list. List of source sentences, each of them as list of ints
+    """
+    rng = np.random.RandomState(seed + length)
+    return [rng.randint(utils.EOS_ID + 1, vocab_size, size=length).tolist()
+            for _ in xrange(n)]
+
+
+def get_environment():
+    """Collects information about the benchmark environment.
+
+    Returns:
+        dict. Python and numpy versions, platform, and git revision
+    """
+    try:
+        revision = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=open("/dev/null", "w")).strip()
+    except Exception:
+        revision = "unknown"
+    return {"python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "git_revision": revision,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def create_sgnmt_args(decoder_name, beam, bench_args):
+    """Creates the SGNMT configuration for a single benchmark.
+
+    Args:
+        decoder_name (string): Decoder name as in --decoder
+        beam (int): Beam size
+        bench_args (object): Benchmark configuration
+
+    Returns:
+        object. SGNMT configuration as returned by the argument parser
+    """
+    return ui.get_parser().parse_args(
+        ["--decoder", decoder_name,
+         "--beam", str(beam),
+         "--max_node_expansions", str(bench_args.max_node_expansions),
+         "--verbosity", "error"] + bench_args.sgnmt_args.split())
+
+
+def run_benchmark(decoder_name, predictor_names, beam, src_sentences,
+                  bench_args):
+    """Runs a single benchmark. ``decode_utils.base_init()`` must have
+    been called before. We only replace ``decode_utils.args`` here
+    because ``base_init()`` wraps the standard streams on each call.
+
+    Args:
+        decoder_name (string): Decoder name as in --decoder
+        predictor_names (list): Names of the synthetic predictors
+        beam (int): Beam size
+        src_sentences (list): Source sentences to decode
+        bench_args (object): Benchmark configuration
+
+    Returns:
+        dict. Benchmark result
+    """
+    result = {"decoder": decoder_name,
+              "predictors": ",".join(predictor_names),
+              "beam": beam,
+              "src_length": len(src_sentences[0]),
+              "num_sentences": len(src_sentences)}
+    sgnmt_args = create_sgnmt_args(decoder_name, beam, bench_args)
+    ui.validate_args(sgnmt_args)
+    decode_utils.args = sgnmt_args
+    best_time = None
+    for _ in xrange(bench_args.repeats):
+        decoder = decode_utils.create_search_strategy()
+        if decoder is None:
+            result["status"] = "error: could not create decoder"
+            return result
+        for name in predictor_names:
+            decoder.add_predictor(name, create_predictor(
+                name,
+                bench_args.vocab_size,
+                bench_args.fst_branching,
+                bench_args.ngram_order))
+        expansions = 0
+        best_scores = []
+        start_time = time.time()
+        try:
+            for sen_idx, src in enumerate(src_sentences):
+                decoder.set_current_sen_id(sen_idx)
+                decoder.apply_predictors_count = 0
+                hypos = decoder.decode(src)
+                expansions += decoder.apply_predictors_count
+                best_scores.append(max(h.total_score for h in hypos)
+                                   if hypos else None)
+        except Exception as e:
+            logging.error("Benchmark %s failed: %s" % (result, e))
+            result["status"] = "error: %s" % e
+            return result
+        elapsed = time.time() - start_time
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    result.update({"status": "ok",
+                   "time": best_time,
+                   "time_per_sentence": best_time / len(src_sentences),
+                   "expansions": expansions,
+                   "expansions_per_second": expansions / best_time
+                                            if best_time > 0.0 else 0.0,
+                   "best_scores": best_scores})
+    return result
+
+
+def get_benchmark_key(result):
+    """Returns the tuple which identifies a benchmark in a report. """
+    return (result["decoder"],
+            result["predictors"],
+            result["beam"],
+            result["src_length"])
+
+
+def compare_reports(results, ref_results, threshold):
+    """Compares benchmark results with a reference report and prints
+    the relative run times.
+
+    Args:
+        results (list): New benchmark results
+        ref_results (list): Reference benchmark results
+        threshold (float): Benchmarks which are slower by this factor
+                           are reported as regressions
+
+    Returns:
+        list. Keys of the benchmarks with regressions
+    """
+    ref = dict((get_benchmark_key(r), r) for r in ref_results)
+    regressions = []
+    print("%-12s %-16s %5s %6s %10s %10s %7s" % ("decoder", "predictors",
+                                                "beam", "length",
+                                                "ref [s]", "new [s]",
+                                                "ratio"))
+    for result in results:
+        key = get_benchmark_key(result)
+        ref_result = ref.get(key)
+        if (ref_result is None or result["status"] != "ok"
+                or ref_result["status"] != "ok"):
+            continue
+        ratio = result["time"] / max(ref_result["time"], 1e-9)
+        flags = []
+        if ratio > threshold:
+            regressions.append(key)
+            flags.append("REGRESSION")
+        scores = [s if s is not None else utils.NEG_INF
+                  for s in result["best_scores"]]
+        ref_scores = [s if s is not None else utils.NEG_INF
+                      for s in ref_result["best_scores"]]
+        if len(scores) != len(ref_scores) or not np.allclose(scores,
+                                                             ref_scores):
+            flags.append("SCORES DIFFER")
+        print("%-12s %-16s %5d %6d %10.3f %10.3f %7.2f %s" % (
+                key + (ref_result["time"], result["time"], ratio,
+                       " ".join(flags))))
+    return regressions
+
+
+def main():
+    """Runs all benchmarks, writes the report, and compares it with
+    the reference report.
+    """
+    bench_args = get_parser().parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s')
+    # Decoder and beam size are set for each benchmark in run_benchmark()
+    decode_utils.base_init(create_sgnmt_args(
+        utils.split_comma(bench_args.decoders)[0],
+        int(utils.split_comma(bench_args.beam_sizes)[0]),
+        bench_args))
+    results = []
+    for decoder_name in utils.split_comma(bench_args.decoders):
+        for predictor_set in bench_args.predictor_sets.split(";"):
+            predictor_names = utils.split_comma(predictor_set)
+            for length in [int(l) for l in
+                           utils.split_comma(bench_args.src_lengths)]:
+                src_sentences = create_src_sentences(
+                    bench_args.num_sentences,
+                    length,
+                    bench_args.vocab_size,
+                    bench_args.seed)
+                for beam in [int(b) for b in
+                             utils.split_comma(bench_args.beam_sizes)]:
+                    result = run_benchmark(decoder_name,
+                                           predictor_names,
+                                           beam,
+                                           src_sentences,
+                                           bench_args)
+                    results.append(result)
+                    if result["status"] == "ok":
+                        print("%-12s %-16s beam=%-3d length=%-3d "
+                              "%8.3f s/sentence %8.1f expansions/s" % (
+                                decoder_name, result["predictors"], beam,
+                                length, result["time_per_sentence"],
+                                result["expansions_per_second"]))
+                    else:
+                        print("%-12s %-16s beam=%-3d length=%-3d %s" % (
+                                decoder_name, result["predictors"], beam,
+                                length, result["status"]))
+    report = {"version": REPORT_VERSION,
+              "environment": get_environment(),
+              "config": vars(bench_args),
+              "results": results}
+    if bench_args.output:
+        with open(bench_args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if bench_args.compare:
+        with open(bench_args.compare) as f:
+            ref_report = json.load(f)
+        regressions = compare_reports(results,
+                                      ref_report["results"],
+                                      bench_args.regression_threshold)
+        if regressions:
+            logging.error("%d benchmarks are slower than the reference by "
+                          "more than a factor of %.2f" % (
+                                len(regressions),
+                                bench_args.regression_threshold))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
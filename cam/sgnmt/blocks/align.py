@@ -32,11 +32,13 @@ for k in dir(args):
 if configuration['src_sparse_feat_map']:
     configuration['src_sparse_feat_map'] = FileBasedFeatMap(
                                         configuration['enc_embed'],
-                                        configuration['src_sparse_feat_map'])
+                                        configuration['src_sparse_feat_map'],
+                                        configuration['sparse_feat_map_lookup'])
 if configuration['trg_sparse_feat_map']:
     configuration['trg_sparse_feat_map'] = FileBasedFeatMap(
                                         configuration['dec_embed'],
-                                        configuration['trg_sparse_feat_map'])
+                                        configuration['trg_sparse_feat_map'],
+                                        configuration['sparse_feat_map_lookup'])
 logging.info("Model options:\n{}".format(pprint.pformat(configuration)))
     
 # Align
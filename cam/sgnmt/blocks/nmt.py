@@ -27,11 +27,13 @@ def _add_sparse_feat_maps_to_config(nmt_config):
     if nmt_config['src_sparse_feat_map']:
         new_config['src_sparse_feat_map'] = FileBasedFeatMap(
                                         nmt_config['enc_embed'],
-                                        nmt_config['src_sparse_feat_map'])
+                                        nmt_config['src_sparse_feat_map'],
+                                        nmt_config['sparse_feat_map_lookup'])
     if nmt_config['trg_sparse_feat_map']:
         new_config['trg_sparse_feat_map'] = FileBasedFeatMap(
                                         nmt_config['dec_embed'],
-                                        nmt_config['trg_sparse_feat_map'])
+                                        nmt_config['trg_sparse_feat_map'],
+                                        nmt_config['sparse_feat_map_lookup'])
     return new_config
 
 
@@ -68,7 +70,9 @@ def blocks_get_nmt_predictor(args, nmt_path, nmt_config):
                                                  nmt_config),
                               args.gnmt_beta,
                               args.cache_nmt_posteriors,
-                              nmt_config)
+                              nmt_config,
+                              args.nmt_cache_max_entries,
+                              int(args.nmt_cache_max_mb * 1024 * 1024))
 
 
 def blocks_get_nmt_vanilla_decoder(args, nmt_specs):
@@ -221,6 +225,9 @@ def blocks_get_default_nmt_config():
     # Mapping files for using sparse feature word representations
     config['src_sparse_feat_map'] = ""
     config['trg_sparse_feat_map'] = ""
+    
+    # Nearest neighbor lookup for sparse feature maps ('trie' or 'matrix')
+    config['sparse_feat_map_lookup'] = "trie"
 
     # Early stopping based on bleu related ------------------------------------
 
@@ -326,6 +333,11 @@ def blocks_get_nmt_config_help():
                                     "word representations on the source side"
     config['trg_sparse_feat_map'] = "Mapping files for using sparse feature " \
                                     "word representations on the target side"
+    config['sparse_feat_map_lookup'] = "Nearest neighbor search for mapping " \
+                                    "sparse features to words. 'trie': " \
+                                    "Trie based search. 'matrix': Sparse " \
+                                    "matrix product with all word vectors, " \
+                                    "supports batched lookups for the beam"
     config['normalized_bleu'] = "Length normalization IN TRAINING"
     config['bleu_script'] = "BLEU script used during training for model selection"
     config['val_set'] = "Validation set source file"
@@ -63,14 +63,22 @@ class SparseBeamSearch(BeamSearch):
                 break
 
             logprobs = self.compute_logprobs(contexts, states)
+            # Look up the n best words for all active entries at once
+            active = [i for i in xrange(len(logprobs)) if all_masks[-1,i]]
+            active_words = {}
+            if active:
+                active_words = dict(zip(
+                    active,
+                    self.trg_sparse_feat_map.dense2nwords_batch(
+                        logprobs[active], beam_size)))
             # Collect n best words
             best_words = [] # Format: (beam_idx, word, cost)
-            for i,prob in enumerate(logprobs):
+            for i in xrange(len(logprobs)):
                 base_cost = all_costs[-1,i]
                 if not all_masks[-1,i]: # This one is already finished
                     best_words.append((i, eol_symbol, base_cost))
                     continue
-                this_words = self.trg_sparse_feat_map.dense2nwords(prob, beam_size)
+                this_words = active_words[i]
                 best_words.extend([(i, w, base_cost + c) for w,c in this_words])
             chosen = sorted(best_words, key=itemgetter(2))[:beam_size]
             indexes = numpy.array([i for (i,w,c) in chosen])
@@ -443,11 +443,13 @@ logging.info("Model options:\n{}".format(pprint.pformat(configuration)))
 if configuration['src_sparse_feat_map']:
     configuration['src_sparse_feat_map'] = FileBasedFeatMap(
                                         configuration['enc_embed'],
-                                        configuration['src_sparse_feat_map'])
+                                        configuration['src_sparse_feat_map'],
+                                        configuration['sparse_feat_map_lookup'])
 if configuration['trg_sparse_feat_map']:
     configuration['trg_sparse_feat_map'] = FileBasedFeatMap(
                                         configuration['dec_embed'],
-                                        configuration['trg_sparse_feat_map'])
+                                        configuration['trg_sparse_feat_map'],
+                                        configuration['sparse_feat_map_lookup'])
 
 # Get data streams and start building the blocks main loop
 switch_controller = None
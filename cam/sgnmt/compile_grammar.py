@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""This script compiles a ruleXtract grammar into the binary format 
+used by the lrhiero predictor (see ``CompiledGrammar`` in 
+``cam.sgnmt.predictors.grammar``). The compiled grammar is a directory
+which can be passed to ``decode.py`` via --rules_path. Loading a 
+compiled grammar is much faster than parsing the textual format since
+the rule table is memory-mapped.
+
+Example:
+
+  python compile_grammar.py --rules_path rules.gz --output_path rules.bin
+"""
+
+import argparse
+import gzip
+import logging
+
+from cam.sgnmt import utils
+from cam.sgnmt.predictors.grammar import RuleSet
+
+
+parser = argparse.ArgumentParser(
+        description="Compiles a ruleXtract grammar for the lrhiero "
+                    "predictor.")
+parser.add_argument("--rules_path", required=True,
+                    help="Path to the ruleXtract rules file (can be "
+                    "gzipped).")
+parser.add_argument("--output_path", required=True,
+                    help="Directory to write the compiled grammar to.")
+parser.add_argument("--grammar_feature_weights", default='',
+                    help="Comma-separated feature weights for factorized "
+                    "rule files. The weighted sum is stored as rule cost. "
+                    "Leave blank to sum up features equally weighted.")
+parser.add_argument("--indexing_scheme", default="blocks",
+                    choices=['blocks', 'tf', 't2t'],
+                    help="Must match --indexing_scheme in decode.py since "
+                    "<oov> is mapped to the UNK ID.")
+args = parser.parse_args()
+
+logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                    level=logging.INFO)
+if args.indexing_scheme == 'tf':
+    utils.switch_to_tf_indexing()
+elif args.indexing_scheme == 't2t':
+    utils.switch_to_t2t_indexing()
+
+feature_weights = None
+if args.grammar_feature_weights:
+    feature_weights = [float(w) 
+                       for w in args.grammar_feature_weights.split(',')]
+rules = RuleSet()
+with (gzip.open(args.rules_path) if args.rules_path[-3:] == '.gz' 
+                                 else open(args.rules_path)) as f:
+    for line in f:
+        rules.parse(line, feature_weights)
+logging.info("%d rules parsed (%d discarded because not in GNF)" %
+             (rules.n_rules, rules.n_discarded))
+rules.save_compiled(args.output_path)
@@ -1,11 +1,12 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """This is the main runner script for SGNMT decoding. 
-SGNMT can run in three different modes. The standard mode 'file' reads
+SGNMT can run in different modes. The standard mode 'file' reads
 sentences to translate from a plain text file. The mode 'stdin' can be
-used to parse stdin. The last mode 'shell' enables interactive inter-
-action with SGNMT via keyboard. For detailed usage descriptions please
-visit the tutorial home page:
+used to parse stdin. The mode 'shell' enables interactive inter-
+action with SGNMT via keyboard. The mode 'server' keeps the models in
+memory and serves translation requests over HTTP. For detailed usage 
+descriptions please visit the tutorial home page:
 
 http://ucam-smt.github.io/tutorial/sgnmt 
 """
@@ -43,7 +44,7 @@ utils.load_src_wmap(args.src_wmap)
 utils.load_trg_wmap(args.trg_wmap)
 utils.load_trg_cmap(args.trg_cmap)
 decoder = decode_utils.create_decoder()
-outputs = decode_utils.create_output_handlers()
+outputs = decode_utils.create_output_handlers(decoder)
 
 if args.input_method == 'file':
     with codecs.open(args.src_test, encoding='utf-8') as f:
@@ -52,6 +53,9 @@ if args.input_method == 'file':
                                [line.strip().split() for line in f])
 elif args.input_method == 'dummy':
     decode_utils.do_decode(decoder, outputs, False)
+elif args.input_method == 'server':
+    from cam.sgnmt.server import DecodingServer
+    DecodingServer(decoder, args.server_host, args.server_port).serve()
 else: # Interactive mode: shell or stdin
     print("Start interactive mode.")
     print("PID: %d" % os.getpid())
@@ -89,9 +93,10 @@ else: # Interactive mode: shell or stdin
                     elif len(input_) >= 4:
                         key,val = (input_[2], ' '.join(input_[3:]))
                         setattr(args, key, val) # TODO: non-string args!
-                        outputs = decode_utils.create_output_handlers()
                         if not key in ['outputs', 'output_path']:
-                            decoder = decode_utils.create_decoder(args)
+                            decoder = decode_utils.create_decoder()
+                        # Profiling outputs need the new decoder
+                        outputs = decode_utils.create_output_handlers(decoder)
                     else:
                         logging.error("Could not parse SGNMT directive")
                 else:
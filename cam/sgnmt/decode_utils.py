@@ -10,6 +10,10 @@ to learn how to use this module.
 
 import logging
 import codecs
+import importlib
+import itertools
+import multiprocessing
+import Queue
 import sys
 import time
 import traceback
@@ -18,62 +22,151 @@ import uuid
 
 from cam.sgnmt import ui
 from cam.sgnmt import utils
-from cam.sgnmt.blocks.nmt import blocks_get_nmt_predictor, \
-                                 blocks_get_nmt_vanilla_decoder, \
-    blocks_get_default_nmt_config
 from cam.sgnmt.decoding import combination
-from cam.sgnmt.decoding.astar import AstarDecoder
-from cam.sgnmt.decoding.beam import BeamDecoder
-from cam.sgnmt.decoding.bigramgreedy import BigramGreedyDecoder
-from cam.sgnmt.decoding.bow import BOWDecoder
-from cam.sgnmt.decoding.bucket import BucketDecoder
 from cam.sgnmt.decoding.core import UnboundedVocabularyPredictor
 from cam.sgnmt.decoding.core import Hypothesis
-from cam.sgnmt.decoding.dfs import DFSDecoder
-from cam.sgnmt.decoding.flip import FlipDecoder
-from cam.sgnmt.decoding.greedy import GreedyDecoder
-from cam.sgnmt.decoding.heuristics import GreedyHeuristic, \
-                                         PredictorHeuristic, \
-                                         ScorePerWordHeuristic, \
-                                         StatsHeuristic, \
-                                         LastTokenHeuristic
-from cam.sgnmt.decoding.multisegbeam import MultisegBeamDecoder
-from cam.sgnmt.decoding.restarting import RestartingDecoder
-from cam.sgnmt.decoding.sepbeam import SepBeamDecoder
-from cam.sgnmt.decoding.syntaxbeam import SyntaxBeamDecoder
-from cam.sgnmt.decoding.mbrbeam import MBRBeamDecoder
-from cam.sgnmt.decoding.syncbeam import SyncBeamDecoder
-from cam.sgnmt.decoding.combibeam import CombiBeamDecoder
+from cam.sgnmt.decoding.instrumentation import DecoderInstrumentation
 from cam.sgnmt.output import TextOutputHandler, \
                              NBestOutputHandler, \
                              NgramOutputHandler, \
                              TimeCSVOutputHandler, \
                              FSTOutputHandler, \
-                             StandardFSTOutputHandler
-from cam.sgnmt.predictors.automata import FstPredictor, \
-                                         RtnPredictor, \
-                                         NondeterministicFstPredictor
-from cam.sgnmt.predictors.bow import BagOfWordsPredictor, \
-                                     BagOfWordsSearchPredictor
-from cam.sgnmt.predictors.ffnnlm import NPLMPredictor
-from cam.sgnmt.predictors.forced import ForcedPredictor, ForcedLstPredictor
-from cam.sgnmt.predictors.grammar import RuleXtractPredictor
-from cam.sgnmt.predictors.length import WordCountPredictor, NBLengthPredictor, \
-    ExternalLengthPredictor, NgramCountPredictor, UnkCountPredictor, \
-    NgramizePredictor
-from cam.sgnmt.predictors.structure import BracketPredictor, OSMPredictor, \
-                                           ForcedOSMPredictor
-from cam.sgnmt.predictors.misc import UnboundedAltsrcPredictor, AltsrcPredictor
-from cam.sgnmt.predictors.vocabulary import IdxmapPredictor, \
-                                            UnboundedIdxmapPredictor, \
-                                            UnkvocabPredictor, \
-                                            SkipvocabPredictor
-from cam.sgnmt.predictors.ngram import SRILMPredictor
-from cam.sgnmt.predictors.tf_t2t import T2TPredictor, FertilityT2TPredictor
-from cam.sgnmt.predictors.tf_nizza import NizzaPredictor, LexNizzaPredictor
-from cam.sgnmt.predictors.tokenization import Word2charPredictor, FSTTokPredictor
-from cam.sgnmt.tf.interface import tf_get_nmt_predictor, tf_get_nmt_vanilla_decoder, \
-    tf_get_rnnlm_predictor, tf_get_default_nmt_config, tf_get_rnnlm_prefix
+                             StandardFSTOutputHandler, \
+                             ProfileOutputHandler
+
+
+PREDICTOR_MODULES = {
+    "nizza": "cam.sgnmt.predictors.tf_nizza",
+    "lexnizza": "cam.sgnmt.predictors.tf_nizza",
+    "t2t": "cam.sgnmt.predictors.tf_t2t",
+    "fertt2t": "cam.sgnmt.predictors.tf_t2t",
+    "bracket": "cam.sgnmt.predictors.structure",
+    "osm": "cam.sgnmt.predictors.structure",
+    "forcedosm": "cam.sgnmt.predictors.structure",
+    "fst": "cam.sgnmt.predictors.automata",
+    "nfst": "cam.sgnmt.predictors.automata",
+    "rtn": "cam.sgnmt.predictors.automata",
+    "forced": "cam.sgnmt.predictors.forced",
+    "forcedlst": "cam.sgnmt.predictors.forced",
+    "bow": "cam.sgnmt.predictors.bow",
+    "bowsearch": "cam.sgnmt.predictors.bow",
+    "srilm": "cam.sgnmt.predictors.ngram",
+    "nplm": "cam.sgnmt.predictors.ffnnlm",
+    "rnnlm": "cam.sgnmt.tf.interface",
+    "wc": "cam.sgnmt.predictors.length",
+    "ngramc": "cam.sgnmt.predictors.length",
+    "unkc": "cam.sgnmt.predictors.length",
+    "length": "cam.sgnmt.predictors.length",
+    "extlength": "cam.sgnmt.predictors.length",
+    "lrhiero": "cam.sgnmt.predictors.grammar",
+    # Wrapper predictors
+    "idxmap": "cam.sgnmt.predictors.vocabulary",
+    "altsrc": "cam.sgnmt.predictors.misc",
+    "word2char": "cam.sgnmt.predictors.tokenization",
+    "skipvocab": "cam.sgnmt.predictors.vocabulary",
+    "fsttok": "cam.sgnmt.predictors.tokenization",
+    "ngramize": "cam.sgnmt.predictors.length",
+    "unkvocab": "cam.sgnmt.predictors.vocabulary"
+}
+"""Maps predictor names in --predictors to the modules which implement
+them. Modules are imported on first use so that we do not pay the 
+startup costs for backends (Theano, TensorFlow, SRILM...) which are not
+used.
+"""
+
+
+NMT_ENGINE_MODULES = {
+    "blocks": "cam.sgnmt.blocks.nmt",
+    "tensorflow": "cam.sgnmt.tf.interface"
+}
+"""Maps --nmt_engine to the module with the NMT factory functions. """
+
+
+DECODER_MODULES = {
+    "greedy": "cam.sgnmt.decoding.greedy",
+    "beam": "cam.sgnmt.decoding.beam",
+    "multisegbeam": "cam.sgnmt.decoding.multisegbeam",
+    "syncbeam": "cam.sgnmt.decoding.syncbeam",
+    "mbrbeam": "cam.sgnmt.decoding.mbrbeam",
+    "sepbeam": "cam.sgnmt.decoding.sepbeam",
+    "syntaxbeam": "cam.sgnmt.decoding.syntaxbeam",
+    "combibeam": "cam.sgnmt.decoding.combibeam",
+    "dfs": "cam.sgnmt.decoding.dfs",
+    "restarting": "cam.sgnmt.decoding.restarting",
+    "bow": "cam.sgnmt.decoding.bow",
+    "flip": "cam.sgnmt.decoding.flip",
+    "bigramgreedy": "cam.sgnmt.decoding.bigramgreedy",
+    "bucket": "cam.sgnmt.decoding.bucket",
+    "astar": "cam.sgnmt.decoding.astar"
+}
+"""Maps decoder names in --decoder to the modules which implement 
+them. 
+"""
+
+
+_startup_profile = []
+"""List of (category, name, seconds) tuples for --profile_startup. """
+
+
+_startup_start_time = None
+"""Time at which ``base_init()`` was called. """
+
+
+def _import_backend(module_name):
+    """Imports the module ``module_name`` if it has not been imported
+    yet, and records the import time for --profile_startup.
+    
+    Args:
+        module_name (string): Full name of the module
+    
+    Returns:
+        module. The imported module
+    
+    Raises:
+        ImportError. If the module cannot be imported
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    start_time = time.time()
+    module = importlib.import_module(module_name)
+    _startup_profile.append(("import", module_name, time.time() - start_time))
+    return module
+
+
+def _record_load_time(name, start_time, profile_pos):
+    """Adds the time for loading ``name`` to the startup profile. 
+    Imports which were triggered since ``start_time`` are not counted
+    since they are already listed separately.
+    
+    Args:
+        name (string): Name of the loaded component
+        start_time (float): Time when loading started
+        profile_pos (int): Length of ``_startup_profile`` at 
+                           ``start_time``
+    """
+    import_time = sum(secs for category, _, secs 
+                      in _startup_profile[profile_pos:] 
+                      if category == "import")
+    _startup_profile.append(("load", 
+                             name, 
+                             time.time() - start_time - import_time))
+
+
+def log_startup_profile():
+    """Logs the startup time report if --profile_startup is set. """
+    if not args.profile_startup:
+        return
+    logging.info("Startup profile:")
+    totals = {}
+    for category, name, secs in _startup_profile:
+        logging.info("  %-6s %-45s %8.3fs" % (category, name, secs))
+        totals[category] = totals.get(category, 0.0) + secs
+    for category in sorted(totals):
+        logging.info("  Total %-45s %8.3fs" % (category, totals[category]))
+    if _startup_start_time is not None:
+        logging.info("  Total startup time %.3fs" 
+                     % (time.time() - _startup_start_time))
 
 
 args = None
@@ -91,8 +184,9 @@ def base_init(new_args):
     Args:
         new_args: Configuration object from the argument parser.
     """
-    global args
+    global args, _startup_start_time
     args = new_args
+    _startup_start_time = time.time()
     # UTF-8 support
     if sys.version_info < (3, 0):
         sys.stderr = codecs.getwriter('UTF-8')(sys.stderr)
@@ -123,6 +217,7 @@ def base_init(new_args):
     # Log summation (how to compute log(exp(l1)+exp(l2)) for log values l1,l2)
     if args.log_sum == 'tropical':
         utils.log_sum = utils.log_sum_tropical_semiring
+    utils.fst_prefetching = args.fst_prefetch
     ui.validate_args(args)
 
 
@@ -211,29 +306,37 @@ def add_predictors(decoder):
                 pred_weight = float(weights[idx])
 
             # Create predictor instances for the string argument ``pred``
+            start_time = time.time()
+            profile_pos = len(_startup_profile)
+            if pred in PREDICTOR_MODULES:
+                pred_module = _import_backend(PREDICTOR_MODULES[pred])
             if pred == "nmt":
                 nmt_engine = _get_override_args("nmt_engine")
                 if nmt_engine == 'blocks':
+                    nmt = _import_backend(NMT_ENGINE_MODULES[nmt_engine])
                     nmt_config = _parse_config_param(
-                        "nmt_config", blocks_get_default_nmt_config())
-                    p = blocks_get_nmt_predictor(
+                        "nmt_config", nmt.blocks_get_default_nmt_config())
+                    p = nmt.blocks_get_nmt_predictor(
                         args, _get_override_args("nmt_path"), nmt_config)
                 elif nmt_engine == 'tensorflow':
+                    nmt = _import_backend(NMT_ENGINE_MODULES[nmt_engine])
                     nmt_config = _parse_config_param(
-                        "nmt_config", tf_get_default_nmt_config())
-                    p = tf_get_nmt_predictor(
+                        "nmt_config", nmt.tf_get_default_nmt_config())
+                    p = nmt.tf_get_nmt_predictor(
                         args, _get_override_args("nmt_path"), nmt_config)
                 elif nmt_engine != 'none':
                     logging.fatal("NMT engine %s is not supported (yet)!" % nmt_engine)
             elif pred == "nizza":
-                p = NizzaPredictor(_get_override_args("pred_src_vocab_size"),
+                p = pred_module.NizzaPredictor(
+                                   _get_override_args("pred_src_vocab_size"),
                                    _get_override_args("pred_trg_vocab_size"),
                                    _get_override_args("nizza_model"),
                                    _get_override_args("nizza_hparams_set"),
                                    _get_override_args("nizza_checkpoint_dir"),
                                    single_cpu_thread=args.single_cpu_thread)
             elif pred == "lexnizza":
-                p = LexNizzaPredictor(_get_override_args("pred_src_vocab_size"),
+                p = pred_module.LexNizzaPredictor(
+                                      _get_override_args("pred_src_vocab_size"),
                                       _get_override_args("pred_trg_vocab_size"),
                                       _get_override_args("nizza_model"),
                                       _get_override_args("nizza_hparams_set"),
@@ -253,7 +356,8 @@ def add_predictors(decoder):
                                           args.lexnizza_max_shortlist_length,
                                       min_id=args.lexnizza_min_id)
             elif pred == "t2t":
-                p = T2TPredictor(_get_override_args("pred_src_vocab_size"),
+                p = pred_module.T2TPredictor(
+                                 _get_override_args("pred_src_vocab_size"),
                                  _get_override_args("pred_trg_vocab_size"),
                                  _get_override_args("t2t_model"),
                                  _get_override_args("t2t_problem"),
@@ -262,9 +366,10 @@ def add_predictors(decoder):
                                  _get_override_args("t2t_checkpoint_dir"),
                                  single_cpu_thread=args.single_cpu_thread,
                                  max_terminal_id=args.syntax_max_terminal_id,
-                                 pop_id=args.syntax_pop_id)
+                                 pop_id=args.syntax_pop_id,
+                                 incremental=args.t2t_incremental)
             elif pred == "fertt2t":
-                p = FertilityT2TPredictor(
+                p = pred_module.FertilityT2TPredictor(
                                  _get_override_args("pred_src_vocab_size"),
                                  _get_override_args("pred_trg_vocab_size"),
                                  _get_override_args("t2t_model"),
@@ -276,30 +381,33 @@ def add_predictors(decoder):
                                  max_terminal_id=args.syntax_max_terminal_id,
                                  pop_id=args.syntax_pop_id)
             elif pred == "bracket":
-                p = BracketPredictor(args.syntax_max_terminal_id,
+                p = pred_module.BracketPredictor(
+                                     args.syntax_max_terminal_id,
                                      args.syntax_pop_id,
                                      max_depth=args.syntax_max_depth,
                                      extlength_path=args.extlength_path)
             elif pred == "osm":
-                p = OSMPredictor()
+                p = pred_module.OSMPredictor()
             elif pred == "forcedosm":
-                p = ForcedOSMPredictor(args.trg_test)
+                p = pred_module.ForcedOSMPredictor(args.trg_test)
             elif pred == "fst":
-                p = FstPredictor(_get_override_args("fst_path"),
+                p = pred_module.FstPredictor(
+                                 _get_override_args("fst_path"),
                                  args.use_fst_weights,
                                  args.normalize_fst_weights,
                                  skip_bos_weight=args.fst_skip_bos_weight,
                                  to_log=args.fst_to_log)
             elif pred == "nfst":
-                p = NondeterministicFstPredictor(_get_override_args("fst_path"),
+                p = pred_module.NondeterministicFstPredictor(
+                                                 _get_override_args("fst_path"),
                                                  args.use_fst_weights,
                                                  args.normalize_fst_weights,
                                                  args.fst_skip_bos_weight,
                                                  to_log=args.fst_to_log)
             elif pred == "forced":
-                p = ForcedPredictor(args.trg_test)
+                p = pred_module.ForcedPredictor(args.trg_test)
             elif pred == "bow":
-                p = BagOfWordsPredictor(
+                p = pred_module.BagOfWordsPredictor(
                                 args.trg_test,
                                 args.bow_accept_subsets,
                                 args.bow_accept_duplicates,
@@ -310,7 +418,7 @@ def add_predictors(decoder):
                                 args.bow_diversity_heuristic_factor,
                                 _get_override_args("pred_trg_vocab_size"))
             elif pred == "bowsearch":
-                p = BagOfWordsSearchPredictor(
+                p = pred_module.BagOfWordsSearchPredictor(
                                 decoder,
                                 args.hypo_recombination,
                                 args.trg_test,
@@ -324,54 +432,58 @@ def add_predictors(decoder):
                                 _get_override_args("pred_trg_vocab_size"))
             elif pred == "forcedlst":
                 feat_name = _get_override_args("forcedlst_sparse_feat")
-                p = ForcedLstPredictor(args.trg_test,
+                p = pred_module.ForcedLstPredictor(
+                                       args.trg_test,
                                        args.use_nbest_weights,
                                        args.forcedlst_match_unk,
                                        feat_name if feat_name else None)
             elif pred == "rtn":
-                p = RtnPredictor(args.rtn_path,
-                                 args.use_rtn_weights,
-                                 args.normalize_rtn_weights,
-                                 to_log=args.fst_to_log,
-                                 minimize_rtns=args.minimize_rtns,
-                                 rmeps=args.remove_epsilon_in_rtns)
+                p = pred_module.RtnPredictor(args.rtn_path,
+                                             args.use_rtn_weights,
+                                             args.normalize_rtn_weights,
+                                             to_log=args.fst_to_log,
+                                             minimize_rtns=args.minimize_rtns,
+                                             rmeps=args.remove_epsilon_in_rtns)
             elif pred == "srilm":
-                p = SRILMPredictor(args.srilm_path, 
-                                   args.srilm_order, 
-                                   args.srilm_convert_to_ln)
+                p = pred_module.SRILMPredictor(args.srilm_path, 
+                                               args.srilm_order, 
+                                               args.srilm_convert_to_ln)
             elif pred == "nplm":
-                p = NPLMPredictor(args.nplm_path, args.normalize_nplm_probs)
+                p = pred_module.NPLMPredictor(
+                                  args.nplm_path, args.normalize_nplm_probs)
             elif pred == "rnnlm":
-                p = tf_get_rnnlm_predictor(_get_override_args("rnnlm_path"),
+                p = pred_module.tf_get_rnnlm_predictor(
+                                           _get_override_args("rnnlm_path"),
                                            _get_override_args("rnnlm_config"),
-                                           tf_get_rnnlm_prefix())
+                                           pred_module.tf_get_rnnlm_prefix())
             elif pred == "wc":
-                p = WordCountPredictor(args.wc_word)
+                p = pred_module.WordCountPredictor(args.wc_word)
             elif pred == "ngramc":
-                p = NgramCountPredictor(_get_override_args("ngramc_path"),
+                p = pred_module.NgramCountPredictor(
+                                        _get_override_args("ngramc_path"),
                                         _get_override_args("ngramc_order"),
                                         args.ngramc_discount_factor)
             elif pred == "unkc":
-                p = UnkCountPredictor(
+                p = pred_module.UnkCountPredictor(
                          _get_override_args("pred_src_vocab_size"), 
                          [float(l) for l in args.unk_count_lambdas.split(',')])
             elif pred == "length":
                 length_model_weights = [float(w) for w in 
                                           args.length_model_weights.split(',')]
-                p = NBLengthPredictor(args.src_test_raw, 
-                                      length_model_weights, 
-                                      args.use_length_point_probs,
-                                      args.length_model_offset)
+                p = pred_module.NBLengthPredictor(args.src_test_raw, 
+                                                  length_model_weights, 
+                                                  args.use_length_point_probs,
+                                                  args.length_model_offset)
             elif pred == "extlength":
-                p = ExternalLengthPredictor(args.extlength_path)
+                p = pred_module.ExternalLengthPredictor(args.extlength_path)
             elif pred == "lrhiero":
                 fw = None
                 if args.grammar_feature_weights:
                     fw = [float(w) for w in 
                             args.grammar_feature_weights.split(',')]
-                p = RuleXtractPredictor(args.rules_path,
-                                        args.use_grammar_weights,
-                                        fw)
+                p = pred_module.RuleXtractPredictor(args.rules_path,
+                                                    args.use_grammar_weights,
+                                                    fw)
             elif pred == "vanilla":
                 continue
             else:
@@ -382,44 +494,51 @@ def add_predictors(decoder):
             for _,wrapper in enumerate(wrappers):
                 # Embed predictor ``p`` into wrapper predictors if necessary
                 # TODO: Use wrapper_weights
+                if wrapper in PREDICTOR_MODULES:
+                    wrapper_module = _import_backend(PREDICTOR_MODULES[wrapper])
                 if wrapper == "idxmap":
                     src_path = _get_override_args("src_idxmap")
                     trg_path = _get_override_args("trg_idxmap")
                     if isinstance(p, UnboundedVocabularyPredictor): 
-                        p = UnboundedIdxmapPredictor(src_path, trg_path, p, 1.0) 
+                        p = wrapper_module.UnboundedIdxmapPredictor(
+                                                     src_path, trg_path, p, 1.0) 
                     else: # idxmap predictor for bounded predictors
-                        p = IdxmapPredictor(src_path, trg_path, p, 1.0)
+                        p = wrapper_module.IdxmapPredictor(
+                                            src_path, trg_path, p, 1.0)
                 elif wrapper == "altsrc":
                     src_test = _get_override_args("altsrc_test")
                     if isinstance(p, UnboundedVocabularyPredictor): 
-                        p = UnboundedAltsrcPredictor(src_test, p)
+                        p = wrapper_module.UnboundedAltsrcPredictor(src_test, p)
                     else: # altsrc predictor for bounded predictors
-                        p = AltsrcPredictor(src_test, p)
+                        p = wrapper_module.AltsrcPredictor(src_test, p)
                 elif wrapper == "word2char":
                     map_path = _get_override_args("word2char_map")
                     # word2char always wraps unbounded predictors
-                    p = Word2charPredictor(map_path, p)
+                    p = wrapper_module.Word2charPredictor(map_path, p)
                 elif wrapper == "skipvocab":
                     # skipvocab always wraps unbounded predictors
-                    p = SkipvocabPredictor(args.skipvocab_max_id, 
+                    p = wrapper_module.SkipvocabPredictor(
+                                           args.skipvocab_max_id, 
                                            args.skipvocab_stop_size, 
                                            args.beam, 
-                                           p)
+                                           p,
+                                           args.skipvocab_cache_max_entries)
                 elif wrapper == "fsttok":
                     fsttok_path = _get_override_args("fsttok_path")
                     # fsttok always wraps unbounded predictors
-                    p = FSTTokPredictor(fsttok_path,
+                    p = wrapper_module.FSTTokPredictor(
+                                        fsttok_path,
                                         args.fst_unk_id,
                                         args.fsttok_max_pending_score,
                                         p)
                 elif wrapper == "ngramize":
                     # ngramize always wraps bounded predictors
-                    p = NgramizePredictor(args.min_ngram_order, 
-                                          args.max_ngram_order,
-                                          args.max_len_factor, p)
+                    p = wrapper_module.NgramizePredictor(args.min_ngram_order, 
+                                                         args.max_ngram_order,
+                                                         args.max_len_factor, p)
                 elif wrapper == "unkvocab":
                     # unkvocab always wraps bounded predictors
-                    p = UnkvocabPredictor(args.trg_vocab_size, p)
+                    p = wrapper_module.UnkvocabPredictor(args.trg_vocab_size, p)
                 else:
                     logging.fatal("Predictor wrapper '%s' not available. "
                                   "Please double-check --predictors for "
@@ -427,6 +546,9 @@ def add_predictors(decoder):
                     decoder.remove_predictors()
                     return
             decoder.add_predictor(pred, p, pred_weight)
+            _record_load_time("predictor %d (%s)" % (idx, pred),
+                              start_time,
+                              profile_pos)
             logging.info("Initialized predictor {} (weight: {})".format(
                              pred, pred_weight))
     except IOError as e:
@@ -436,7 +558,7 @@ def add_predictors(decoder):
     except AttributeError as e:
         logging.fatal("Invalid argument for one of the predictors: %s" % e)
         decoder.remove_predictors()
-    except NameError as e:
+    except (NameError, ImportError) as e:
         logging.fatal("Could not find external library: %s. Please make sure "
                       "that your PYTHONPATH and LD_LIBRARY_PATH contains all "
                       "paths required for the predictors. Stack trace: %s" % 
@@ -461,39 +583,79 @@ def create_decoder():
     strategy used to traverse the space spanned by the predictors. This
     method relies on the global ``args`` variable.
     
-    TODO: Refactor to avoid long argument lists
-    
     Returns:
         Decoder. Instance of the search strategy
     """
     # Create decoder instance and add predictors
+    start_time = time.time()
+    profile_pos = len(_startup_profile)
+    decoder = create_search_strategy()
+    if decoder is None:
+        sys.exit("Could not initialize decoder.")
+    _record_load_time("decoder (%s)" % args.decoder, start_time, profile_pos)
+    add_predictors(decoder)
+    # Add heuristics for search strategies like A*
+    if args.heuristics:
+        add_heuristics(decoder)
+    if _is_profiling_enabled():
+        decoder.instrument(DecoderInstrumentation())
+    log_startup_profile()
+    return decoder
+
+
+def _is_profiling_enabled():
+    """Returns true if the decoder needs to be instrumented because 
+    of --profile_decoder, --profile_prometheus_file, or the profile
+    outputs.
+    """
+    return (args.profile_decoder 
+            or args.profile_prometheus_file
+            or any(name.startswith("profile") 
+                   for name in utils.split_comma(args.outputs)))
+
+
+def create_search_strategy():
+    """Creates the ``Decoder`` instance selected with ``--decoder``
+    without adding predictors or heuristics to it. This method relies 
+    on the global ``args`` variable.
+    
+    TODO: Refactor to avoid long argument lists
+    
+    Returns:
+        Decoder. Instance of the search strategy, or None if an error
+        occurred
+    """
     decoder = None
     try:
+        if args.decoder in DECODER_MODULES:
+            decoder_module = _import_backend(DECODER_MODULES[args.decoder])
         if args.decoder == "greedy":
-            decoder = GreedyDecoder(args)
+            decoder = decoder_module.GreedyDecoder(args)
         elif args.decoder == "beam":
-            decoder = BeamDecoder(args)
+            decoder = decoder_module.BeamDecoder(args)
         elif args.decoder == "multisegbeam":
-            decoder = MultisegBeamDecoder(args,
+            decoder = decoder_module.MultisegBeamDecoder(
+                                          args,
                                           args.hypo_recombination,
                                           args.beam,
                                           args.multiseg_tokenizations,
                                           args.early_stopping,
                                           args.max_word_len)
         elif args.decoder == "syncbeam":
-            decoder = SyncBeamDecoder(args)
+            decoder = decoder_module.SyncBeamDecoder(args)
         elif args.decoder == "mbrbeam":
-            decoder = MBRBeamDecoder(args)
+            decoder = decoder_module.MBRBeamDecoder(args)
         elif args.decoder == "sepbeam":
-            decoder = SepBeamDecoder(args)
+            decoder = decoder_module.SepBeamDecoder(args)
         elif args.decoder == "syntaxbeam":
-            decoder = SyntaxBeamDecoder(args)
+            decoder = decoder_module.SyntaxBeamDecoder(args)
         elif args.decoder == "combibeam":
-            decoder = CombiBeamDecoder(args)
+            decoder = decoder_module.CombiBeamDecoder(args)
         elif args.decoder == "dfs":
-            decoder = DFSDecoder(args)
+            decoder = decoder_module.DFSDecoder(args)
         elif args.decoder == "restarting":
-            decoder = RestartingDecoder(args,
+            decoder = decoder_module.RestartingDecoder(
+                                        args,
                                         args.hypo_recombination,
                                         args.max_node_expansions,
                                         args.low_decoder_memory,
@@ -501,13 +663,14 @@ def create_decoder():
                                         args.stochastic_decoder,
                                         args.decode_always_single_step)
         elif args.decoder == "bow":
-            decoder = BOWDecoder(args)
+            decoder = decoder_module.BOWDecoder(args)
         elif args.decoder == "flip":
-            decoder = FlipDecoder(args)
+            decoder = decoder_module.FlipDecoder(args)
         elif args.decoder == "bigramgreedy":
-            decoder = BigramGreedyDecoder(args)
+            decoder = decoder_module.BigramGreedyDecoder(args)
         elif args.decoder == "bucket":
-            decoder = BucketDecoder(args,
+            decoder = decoder_module.BucketDecoder(
+                                    args,
                                     args.hypo_recombination,
                                     args.max_node_expansions,
                                     args.low_decoder_memory,
@@ -520,7 +683,7 @@ def create_decoder():
                                     args.bucket_score_strategy,
                                     args.collect_statistics)
         elif args.decoder == "astar":
-            decoder = AstarDecoder(args)
+            decoder = decoder_module.AstarDecoder(args)
         elif args.decoder == "vanilla":
             decoder = construct_nmt_vanilla_decoder()
             args.predictors = "vanilla"
@@ -532,12 +695,6 @@ def create_decoder():
                       " Stack trace: %s" % (sys.exc_info()[0],
                                             e,
                                             traceback.format_exc()))
-    if decoder is None:
-        sys.exit("Could not initialize decoder.")
-    add_predictors(decoder)
-    # Add heuristics for search strategies like A*
-    if args.heuristics:
-        add_heuristics(decoder)
     return decoder
 
 
@@ -557,11 +714,13 @@ def construct_nmt_vanilla_decoder():
         return None
     nmt_specs = []
     if args.nmt_engine == 'blocks':
-        get_default_nmt_config = blocks_get_default_nmt_config
-        get_nmt_vanilla_decoder = blocks_get_nmt_vanilla_decoder
+        nmt = _import_backend(NMT_ENGINE_MODULES[args.nmt_engine])
+        get_default_nmt_config = nmt.blocks_get_default_nmt_config
+        get_nmt_vanilla_decoder = nmt.blocks_get_nmt_vanilla_decoder
     elif args.nmt_engine == 'tensorflow':
-        get_default_nmt_config = tf_get_default_nmt_config
-        get_nmt_vanilla_decoder = tf_get_nmt_vanilla_decoder
+        nmt = _import_backend(NMT_ENGINE_MODULES[args.nmt_engine])
+        get_default_nmt_config = nmt.tf_get_default_nmt_config
+        get_nmt_vanilla_decoder = nmt.tf_get_nmt_vanilla_decoder
     for _ in xrange(n): 
         nmt_specs.append((_get_override_args("nmt_path"),
                           _parse_config_param("nmt_config",
@@ -585,31 +744,37 @@ def add_heuristics(decoder):
         h_predictors = [decoder.predictors[int(idx)]
                        for idx in utils.split_comma(args.heuristic_predictors)]
     decoder.set_heuristic_predictors(h_predictors)
+    heuristics = _import_backend("cam.sgnmt.decoding.heuristics")
     for name in utils.split_comma(args.heuristics):
         if name == 'greedy':
-            decoder.add_heuristic(GreedyHeuristic(args,
-                                                  args.cache_heuristic_estimates))
+            decoder.add_heuristic(heuristics.GreedyHeuristic(
+                                           args,
+                                           args.cache_heuristic_estimates,
+                                           args.heuristic_cache_max_entries))
         elif name == 'predictor':
-            decoder.add_heuristic(PredictorHeuristic())
+            decoder.add_heuristic(heuristics.PredictorHeuristic())
         elif name == 'stats':
-            decoder.add_heuristic(StatsHeuristic(args.heuristic_scores_file,
-                                                 args.collect_statistics))
+            decoder.add_heuristic(heuristics.StatsHeuristic(
+                                           args.heuristic_scores_file,
+                                           args.collect_statistics))
         elif name == 'scoreperword':
-            decoder.add_heuristic(ScorePerWordHeuristic())
+            decoder.add_heuristic(heuristics.ScorePerWordHeuristic())
         elif name == 'lasttoken':
-            decoder.add_heuristic(LastTokenHeuristic())
+            decoder.add_heuristic(heuristics.LastTokenHeuristic())
         else:
             logging.fatal("Heuristic %s not available. Please double-check "
                           "the --heuristics parameter." % name)
 
 
-def create_output_handlers():
+def create_output_handlers(decoder=None):
     """Creates the output handlers defined in the ``io`` module. 
     These handlers create output files in different formats from the
     decoding results.
     
     Args:
-        args: Global command line arguments.
+        decoder (Decoder): Decoder instance created with 
+                           ``create_decoder()``. This is required by
+                           the profile outputs
     
     Returns:
         list. List of output handlers according --outputs
@@ -642,9 +807,19 @@ def create_output_handlers():
         elif name == "sfst":
             outputs.append(StandardFSTOutputHandler(path,
                                                     args.fst_unk_id))
+        elif name in ["profilecsv", "profilejson"]:
+            if decoder is None or decoder.instrumentation is None:
+                logging.fatal("Output format %s requires an instrumented "
+                              "decoder." % name)
+                continue
+            outputs.append(ProfileOutputHandler(path,
+                                                decoder.instrumentation,
+                                                name[7:]))
         else:
             logging.fatal("Output format %s not available. Please double-check"
                           " the --outputs parameter." % name)
+    for output in outputs:
+        output.sync_mode = args.output_sync
     return outputs
 
 
@@ -704,14 +879,6 @@ def get_sentence_indices(range_param, src_sentences):
         yield i
 
 
-def _get_text_output_handler(output_handlers):
-    """Returns the text output handler if in output_handlers, or None."""
-    for output_handler in output_handlers:
-        if isinstance(output_handler, TextOutputHandler):
-            return output_handler
-    return None
-
-
 def _postprocess_complete_hypos(hypos):
     """This function applies the following operations on the list of
     complete hypotheses returned by the Decoder:
@@ -754,12 +921,273 @@ def _generate_dummy_hypo(predictors):
     return Hypothesis([utils.UNK_ID], 0.0, [[(0.0, w) for _, w in predictors]]) 
 
 
+def _decode_sentence(decoder, src_sentences, sen_idx):
+    """Decodes a single sentence. This is the body of the main decoding
+    loop in ``do_decode`` which is shared between the sequential and
+    the multi-process mode.
+    
+    Args:
+        decoder (Decoder):  Current decoder instance
+        src_sentences (list):  A list of source sentences (see 
+                               ``do_decode``) or False for the dummy
+                               input method
+        sen_idx (int): Index of the sentence to decode
+    
+    Returns:
+        list. Postprocessed list of complete hypotheses, or None if an
+        error occurred
+    """
+    decoder.set_current_sen_id(sen_idx)
+    if decoder.instrumentation is not None:
+        decoder.instrumentation.start_sentence()
+    try:
+        if src_sentences is False:
+            src = "0"
+            logging.info("Next sentence (ID: %d)" % (sen_idx + 1))
+        else:
+            src = src_sentences[sen_idx]
+            logging.info("Next sentence (ID: %d): %s" % (sen_idx + 1, 
+                                                         ' '.join(src)))
+        src = [int(x) for x in src]
+        start_hypo_time = time.time()
+        decoder.apply_predictors_count = 0
+        hypos = [hypo 
+                 for hypo in decoder.decode(utils.apply_src_wmap(src))
+                    if hypo.total_score > args.min_score]
+        if not hypos:
+            logging.error("No translation found for ID %d!" % (sen_idx+1))
+            logging.info("Stats (ID: %d): score=<not-found> "
+                     "num_expansions=%d "
+                     "time=%.2f" % (sen_idx+1,
+                                    decoder.apply_predictors_count,
+                                    time.time() - start_hypo_time))
+            hypos = [_generate_dummy_hypo(decoder.predictors)]
+        hypos = _postprocess_complete_hypos(hypos)
+        if utils.trg_cmap:
+            hypos = [h.convert_to_char_level(utils.trg_cmap) for h in hypos]
+        logging.info("Decoded (ID: %d): %s" % (
+                sen_idx+1,
+                utils.apply_trg_wmap(hypos[0].trgt_sentence, 
+                                     {} if utils.trg_cmap else utils.trg_wmap)))
+        logging.info("Stats (ID: %d): score=%f "
+                     "num_expansions=%d "
+                     "time=%.2f" % (sen_idx+1,
+                                    hypos[0].total_score,
+                                    decoder.apply_predictors_count,
+                                    time.time() - start_hypo_time))
+        return hypos
+    except ValueError as e:
+        logging.error("Number format error at sentence id %d: %s, "
+                      "Stack trace: %s" % (sen_idx+1, 
+                                           e,
+                                           traceback.format_exc()))
+    except AttributeError as e:
+        logging.fatal("Attribute error at sentence id %d: %s. This often "
+                      "indicates an error in the predictor configuration "
+                      "which could not be detected in initialisation. "
+                      "Stack trace: %s" 
+                      % (sen_idx+1, e, traceback.format_exc()))
+    except Exception as e:
+        logging.error("An unexpected %s error has occurred at sentence id "
+                      "%d: %s, Stack trace: %s" % (sys.exc_info()[0],
+                                                   sen_idx+1,
+                                                   e,
+                                                   traceback.format_exc()))
+    return None
+
+
+def decode_batch(decoder, src_sentences):
+    """Decodes all sentences in ``src_sentences`` and returns the 
+    n-best lists instead of passing them through to output handlers.
+    This is used by the decoding server (see ``server.py``).
+    
+    Args:
+        decoder (Decoder):  Current decoder instance
+        src_sentences (list):  A list of source sentences, each of them
+                               as list of word ID strings
+    
+    Returns:
+        list. List of n-best lists, one for each sentence in 
+        ``src_sentences``. If decoding failed for a sentence, its n-best
+        list contains a single dummy hypothesis.
+    """
+    all_hypos = []
+    for sen_idx in xrange(len(src_sentences)):
+        hypos = _decode_sentence(decoder, src_sentences, sen_idx)
+        _finish_sentence_profile(decoder)
+        if hypos is None:
+            hypos = [_generate_dummy_hypo(decoder.predictors)]
+        all_hypos.append(hypos)
+    return all_hypos
+
+
+def _finish_sentence_profile(decoder, sentence_stats=None):
+    """Adds the instrumentation statistics of the last decoded 
+    sentence to the aggregated statistics and updates 
+    --profile_prometheus_file. This does nothing if the decoder is not
+    instrumented.
+    
+    Args:
+        decoder (Decoder):  Current decoder instance
+        sentence_stats (dict): Statistics from a worker process, or
+                               None to use the statistics collected
+                               in this process
+    """
+    if decoder.instrumentation is None:
+        return
+    decoder.instrumentation.finish_sentence(sentence_stats)
+    if args.profile_prometheus_file:
+        try:
+            decoder.instrumentation.write_prometheus(
+                    args.profile_prometheus_file)
+        except IOError as e:
+            logging.error("Could not write Prometheus metrics: %s" % e)
+
+
+def _write_outputs(output_handlers, sen_idx, hypos):
+    """Passes the n-best list of a single sentence through to all
+    output handlers. """
+    try:
+        for output_handler in output_handlers:
+            output_handler.write_sentence(sen_idx, hypos)
+    except IOError as e:
+        logging.error("I/O error %s occurred when creating output files: %s"
+                    % (sys.exc_info()[0], e))
+
+
+def _decode_worker(decoder, src_sentences, task_queue, result_queue):
+    """Main loop of a worker process in multi-process decoding. Reads
+    ``(pos, sen_idx)`` tuples from ``task_queue`` until it receives 
+    None, and puts ``(pos, sen_idx, hypos, sentence_stats)`` tuples
+    to ``result_queue``. ``sentence_stats`` contains the 
+    instrumentation statistics of the sentence, or None if the 
+    decoder is not instrumented.
+    
+    Args:
+        decoder (Decoder): Decoder instance inherited from the parent
+                           process
+        src_sentences (list): Source sentences (see ``do_decode``)
+        task_queue (Queue): Queue with sentences to decode
+        result_queue (Queue): Queue for the decoding results
+    """
+    for pos, sen_idx in iter(task_queue.get, None):
+        hypos = _decode_sentence(decoder, src_sentences, sen_idx)
+        sentence_stats = None
+        if decoder.instrumentation is not None:
+            sentence_stats = decoder.instrumentation.sentence_stats
+        result_queue.put((pos, sen_idx, hypos, sentence_stats))
+
+
+def _do_decode_parallel(decoder, src_sentences, sen_idx_iter,
+                        output_handlers):
+    """Multi-process version of the main decoding loop in 
+    ``do_decode``. We fork ``args.num_workers`` worker processes which
+    share the already loaded models with the parent process 
+    copy-on-write. Sentence IDs are handed out through a queue such 
+    that not more than two sentences per worker are pending at any 
+    time. This keeps the file-based ``--range`` mode working. Results
+    are passed through to the output handlers in the original sentence
+    order. If a worker process terminates before all sentences are
+    decoded, the sentence it was working on is lost, so we stop 
+    decoding and terminate the remaining workers.
+    
+    Args:
+        decoder (Decoder):  Current decoder instance
+        src_sentences (list):  Source sentences (see ``do_decode``)
+        sen_idx_iter (iterator): Indices of the sentences to decode
+        output_handlers (list):  List of output handlers
+    """
+    task_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_decode_worker,
+                                       args=(decoder,
+                                             src_sentences,
+                                             task_queue,
+                                             result_queue))
+               for _ in xrange(args.num_workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    logging.info("Started %d decoding processes" % len(workers))
+    n_tasks = 0
+    pending = {} # Maps positions of unfinished tasks to sentence IDs
+    for sen_idx in itertools.islice(sen_idx_iter, 2*args.num_workers):
+        task_queue.put((n_tasks, sen_idx))
+        pending[n_tasks] = sen_idx
+        n_tasks += 1
+    finished = {}
+    next_pos = 0
+    while next_pos < n_tasks:
+        try:
+            pos, sen_idx, hypos, sentence_stats = result_queue.get(
+                    timeout=10)
+        except Queue.Empty:
+            exitcodes = [worker.exitcode for worker in workers
+                         if worker.exitcode is not None]
+            if exitcodes:
+                missing = [pending[p] if p in pending else finished[p][0]
+                           for p in sorted(set(pending) | set(finished))]
+                logging.fatal("%d decoding process(es) terminated before "
+                              "decoding was finished (exit codes: %s). "
+                              "Sentence IDs without output: %s" % (
+                                  len(exitcodes),
+                                  ', '.join(str(c) for c in exitcodes),
+                                  ', '.join(str(i + 1) for i in missing)))
+                for worker in workers:
+                    if worker.is_alive():
+                        worker.terminate()
+                break
+            continue
+        del pending[pos]
+        finished[pos] = (sen_idx, hypos, sentence_stats)
+        for sen_idx in itertools.islice(sen_idx_iter, 1):
+            task_queue.put((n_tasks, sen_idx))
+            pending[n_tasks] = sen_idx
+            n_tasks += 1
+        while next_pos in finished: # Flush in sentence order
+            sen_idx, hypos, sentence_stats = finished.pop(next_pos)
+            next_pos += 1
+            _finish_sentence_profile(decoder, sentence_stats)
+            if hypos is not None:
+                _write_outputs(output_handlers, sen_idx, hypos)
+    for _ in workers:
+        task_queue.put(None)
+    for worker in workers:
+        worker.join()
+
+
+def _get_resumed_sentence_indices(output_handlers, src_sentences):
+    """Implements ``--resume``. Sentences are skipped if all output
+    handlers already contain them.
+    
+    Args:
+        output_handlers (list):  List of output handlers
+        src_sentences (list):  Source sentences (see ``do_decode``)
+    
+    Returns:
+        (list, set). Indices of the sentences to decode, and indices
+        of the sentences whose outputs are kept
+    """
+    sen_indices = list(get_sentence_indices(args.range, src_sentences))
+    if not output_handlers:
+        return sen_indices, set()
+    finished = set(sen_indices)
+    for output_handler in output_handlers:
+        finished &= output_handler.get_finished_sen_indices(sen_indices)
+    logging.info("Resume decoding: %d of %d sentences are already "
+                 "finished" % (len(finished), len(sen_indices)))
+    return [idx for idx in sen_indices if not idx in finished], finished
+
+
 def do_decode(decoder, 
               output_handlers, 
               src_sentences):
     """This method contains the main decoding loop. It iterates through
     ``src_sentences`` and applies ``decoder.decode()`` to each of them.
-    At the end, it calls the output handlers to create output files.
+    The n-best lists are passed through to the output handlers as soon
+    as they are available, so memory usage does not grow with the 
+    number of sentences. If ``--num_workers`` is greater than 1, 
+    sentences are decoded in parallel by multiple processes.
     
     Args:
         decoder (Decoder):  Current decoder instance
@@ -773,84 +1201,37 @@ def do_decode(decoder,
         logging.fatal("Terminated due to an error in the "
                       "predictor configuration.")
         return
-    all_hypos = []
-    text_output_handler = _get_text_output_handler(output_handlers)
-    if text_output_handler:
-        text_output_handler.open_file()
+    if args.resume:
+        sen_indices, finished = _get_resumed_sentence_indices(
+                output_handlers, src_sentences)
+    else:
+        sen_indices = get_sentence_indices(args.range, src_sentences)
+        finished = None
+    try:
+        for output_handler in output_handlers:
+            output_handler.open_file(finished)
+    except (IOError, OSError) as e:
+        logging.fatal("Could not open output files: %s" % e)
+        return
     start_time = time.time()
     logging.info("Start time: %s" % start_time)
-    sen_indices = []
-    for sen_idx in get_sentence_indices(args.range, src_sentences):
-        decoder.set_current_sen_id(sen_idx)
-        try:
-            if src_sentences is False:
-                src = "0"
-                logging.info("Next sentence (ID: %d)" % (sen_idx + 1))
-            else:
-                src = src_sentences[sen_idx]
-                logging.info("Next sentence (ID: %d): %s" % (sen_idx + 1, 
-                                                             ' '.join(src)))
-            src = [int(x) for x in src]
-            start_hypo_time = time.time()
-            decoder.apply_predictors_count = 0
-            hypos = [hypo 
-                     for hypo in decoder.decode(utils.apply_src_wmap(src))
-                        if hypo.total_score > args.min_score]
-            if not hypos:
-                logging.error("No translation found for ID %d!" % (sen_idx+1))
-                logging.info("Stats (ID: %d): score=<not-found> "
-                         "num_expansions=%d "
-                         "time=%.2f" % (sen_idx+1,
-                                        decoder.apply_predictors_count,
-                                        time.time() - start_hypo_time))
-                hypos = [_generate_dummy_hypo(decoder.predictors)]
-            hypos = _postprocess_complete_hypos(hypos)
-            if utils.trg_cmap:
-                hypos = [h.convert_to_char_level(utils.trg_cmap) for h in hypos]
-            logging.info("Decoded (ID: %d): %s" % (
-                    sen_idx+1,
-                    utils.apply_trg_wmap(hypos[0].trgt_sentence, 
-                                         {} if utils.trg_cmap else utils.trg_wmap)))
-            logging.info("Stats (ID: %d): score=%f "
-                         "num_expansions=%d "
-                         "time=%.2f" % (sen_idx+1,
-                                        hypos[0].total_score,
-                                        decoder.apply_predictors_count,
-                                        time.time() - start_hypo_time))
-            all_hypos.append(hypos)
-            sen_indices.append(sen_idx)
-            try:
-                # Write text output as we go
-                if text_output_handler:
-                    text_output_handler.write_hypos([hypos])
-            except IOError as e:
-                logging.error("I/O error %d occurred when creating output files: %s"
-                            % (sys.exc_info()[0], e))
-        except ValueError as e:
-            logging.error("Number format error at sentence id %d: %s, "
-                          "Stack trace: %s" % (sen_idx+1, 
-                                               e,
-                                               traceback.format_exc()))
-        except AttributeError as e:
-            logging.fatal("Attribute error at sentence id %d: %s. This often "
-                          "indicates an error in the predictor configuration "
-                          "which could not be detected in initialisation. "
-                          "Stack trace: %s" 
-                          % (sen_idx+1, e, traceback.format_exc()))
-        except Exception as e:
-            logging.error("An unexpected %s error has occurred at sentence id "
-                          "%d: %s, Stack trace: %s" % (sys.exc_info()[0],
-                                                       sen_idx+1,
-                                                       e,
-                                                       traceback.format_exc()))
+    if args.num_workers > 1:
+        _do_decode_parallel(decoder,
+                            src_sentences,
+                            iter(sen_indices),
+                            output_handlers)
+    else:
+        for sen_idx in sen_indices:
+            hypos = _decode_sentence(decoder, src_sentences, sen_idx)
+            _finish_sentence_profile(decoder)
+            if hypos is not None:
+                _write_outputs(output_handlers, sen_idx, hypos)
     logging.info("Decoding finished. Time: %.2f" % (time.time() - start_time))
+    if args.profile_decoder and decoder.instrumentation is not None:
+        decoder.instrumentation.log_summary()
     try:
         for output_handler in output_handlers:
-            if output_handler == text_output_handler:
-                output_handler.close_file()
-            else:
-                output_handler.write_hypos(all_hypos, sen_indices)
+            output_handler.close_file()
     except IOError as e:
         logging.error("I/O error %s occurred when creating output files: %s"
                       % (sys.exc_info()[0], e))
-
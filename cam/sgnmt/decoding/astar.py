@@ -1,7 +1,6 @@
 """Implementation of the A* search strategy """
 
 
-import copy
 from heapq import heappush, heappop
 import logging
 
@@ -85,7 +84,8 @@ class AstarDecoder(Decoder):
                 if len(self.full_hypos) >= self.nbest: # if we have enough hypos
                     return self.get_full_hypos_sorted()
                 continue
-            self.set_predictor_states(copy.deepcopy(hypo.predictor_states))
+            self.set_predictor_states(self.copy_predictor_states(
+                            hypo.predictor_states))
             if not hypo.word_to_consume is None: # Consume if cheap expand
                 self.consume(hypo.word_to_consume)
                 hypo.word_to_consume = None
@@ -1,6 +1,5 @@
 """Implementation of the beam search strategy """
 
-import copy
 import logging
 
 from cam.sgnmt import utils
@@ -98,16 +97,73 @@ class BeamDecoder(Decoder):
         """
         if hypo.score <= self.min_score:
             return []
-        self.set_predictor_states(copy.deepcopy(hypo.predictor_states))
+        self.set_predictor_states(self.copy_predictor_states(
+                        hypo.predictor_states))
         if not hypo.word_to_consume is None: # Consume if cheap expand
             self.consume(hypo.word_to_consume)
             hypo.word_to_consume = None
         posterior, score_breakdown = self.apply_predictors(self.sub_beam_size)
         hypo.predictor_states = self.get_predictor_states()
+        return self._create_children(hypo, posterior, score_breakdown)
+
+    def _create_children(self, hypo, posterior, score_breakdown):
+        """Creates the child hypotheses of ``hypo`` from the return 
+        values of ``apply_predictors``.
+        
+        Args:
+            hypo (PartialHypothesis): Hypothesis to expand
+            posterior (dict): Combined scores
+            score_breakdown (dict): Predictor score breakdowns
+        
+        Returns:
+            list. List of child hypotheses
+        """
         return [hypo.cheap_expand(
                         trgt_word,
                         posterior[trgt_word],
                         score_breakdown[trgt_word]) for trgt_word in posterior]
+
+    def _expand_hypos_batch(self, hypos, top_n=None):
+        """Batched version of ``_expand_hypo`` which uses the batched
+        predictor API. All hypotheses with pending words are consumed
+        with a single ``consume_batch()`` call, and all hypotheses are
+        scored with a single ``apply_predictors_batch()`` call. This
+        requires ``has_batch_predictors()``. Hypotheses which end with
+        </S> are not expanded.
+        
+        Args:
+            hypos (list): List of hypotheses to expand
+            top_n (int): Number of children per hypothesis. Defaults
+                         to the sub beam size
+        
+        Returns:
+            list. For each entry in ``hypos`` the list of its child
+            hypotheses
+        """
+        if top_n is None:
+            top_n = self.sub_beam_size
+        children = [[] for _ in hypos]
+        indices = [idx for idx, hypo in enumerate(hypos)
+                   if (hypo.get_last_word() != utils.EOS_ID
+                       and hypo.score > self.min_score)]
+        if not indices:
+            return children
+        pending = [idx for idx in indices 
+                   if not hypos[idx].word_to_consume is None]
+        if pending:
+            new_states = self.consume_batch(
+                    [hypos[idx].predictor_states for idx in pending],
+                    [hypos[idx].word_to_consume for idx in pending])
+            for idx, states in zip(pending, new_states):
+                hypos[idx].predictor_states = states
+                hypos[idx].word_to_consume = None
+        rets = self.apply_predictors_batch(
+                [hypos[idx].predictor_states for idx in indices], top_n)
+        for idx, (posterior, score_breakdown) in zip(indices, rets):
+            children[idx] = self._create_children(hypos[idx],
+                                                  posterior,
+                                                  score_breakdown)
+        return children
     
     def _filter_equal_hypos(self, hypos, scores):
         """Apply hypo recombination to the hypotheses in ``hypos``.
@@ -121,25 +177,25 @@ class BeamDecoder(Decoder):
             hypotheses recombination.
         """
         new_hypos = []
+        index = self.create_recombination_index()
         for idx in reversed(np.argsort(scores)):
             candidate = hypos[idx]
-            self.set_predictor_states(copy.deepcopy(candidate.predictor_states))
+            self.set_predictor_states(self.copy_predictor_states(
+                            candidate.predictor_states))
             if not candidate.word_to_consume is None:
                 self.consume(candidate.word_to_consume)
                 candidate.word_to_consume = None
                 candidate.predictor_states = self.get_predictor_states()
             valid = True
-            for hypo in new_hypos:
-                if self.are_equal_predictor_states(
-                                                hypo.predictor_states,
-                                                candidate.predictor_states):
-                    logging.debug("Hypo recombination: %s > %s" % (
-                                                 hypo.trgt_sentence,
-                                                 candidate.trgt_sentence))
-                    valid = False
-                    break
+            for hypo in index.iter_equal_items(candidate.predictor_states):
+                logging.debug("Hypo recombination: %s > %s" % (
+                                             hypo.trgt_sentence,
+                                             candidate.trgt_sentence))
+                valid = False
+                break
             if valid:
                 new_hypos.append(candidate)
+                index.add(candidate.predictor_states, candidate)
                 if len(new_hypos) >= self.beam_size:
                     break
         return new_hypos
@@ -168,6 +224,7 @@ class BeamDecoder(Decoder):
     def decode(self, src_sentence):
         """Decodes a single source sentence using beam search. """
         self.initialize_predictors(src_sentence)
+        use_batch = self.has_batch_predictors()
         hypos = self._get_initial_hypos()
         it = 0
         while self.stop_criterion(hypos):
@@ -178,12 +235,18 @@ class BeamDecoder(Decoder):
             next_scores = []
             self.min_score = utils.NEG_INF
             self.best_scores = []
-            for hypo in hypos:
+            if use_batch:
+                all_children = self._expand_hypos_batch(hypos)
+            for idx, hypo in enumerate(hypos):
                 if hypo.get_last_word() == utils.EOS_ID:
                     next_hypos.append(hypo)
                     next_scores.append(self._get_combined_score(hypo))
                     continue 
-                for next_hypo in self._expand_hypo(hypo):
+                if use_batch:
+                    children = all_children[idx]
+                else:
+                    children = self._expand_hypo(hypo)
+                for next_hypo in children:
                     next_score = self._get_combined_score(next_hypo)
                     if next_score > self.min_score:
                         next_hypos.append(next_hypo)
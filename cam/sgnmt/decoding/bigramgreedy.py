@@ -1,6 +1,5 @@
 """Implementation of the bigram greedy search strategy """
 
-import copy
 import logging
 import operator
 
@@ -58,7 +57,8 @@ class BigramGreedyDecoder(Decoder):
         bag = dict(self.full_bag)
         while bag:
             posterior,score_breakdown = self.apply_predictors()
-            hypo.predictor_states = copy.deepcopy(self.get_predictor_states())
+            hypo.predictor_states = self.copy_predictor_states(
+                            self.get_predictor_states())
             bag_posterior = {w: posterior[w] for w in self.full_bag_with_eos}
             bag_breakdown = {w: score_breakdown[w] 
                                         for w in self.full_bag_with_eos}
@@ -75,7 +75,8 @@ class BigramGreedyDecoder(Decoder):
                                bag_posterior[best_word],
                                score_breakdown[best_word])
         posterior,score_breakdown = self.apply_predictors()
-        hypo.predictor_states = copy.deepcopy(self.get_predictor_states())
+        hypo.predictor_states = self.copy_predictor_states(
+                        self.get_predictor_states())
         bag_posterior = {w: posterior[w] for w in self.full_bag_with_eos}
         bag_breakdown = {w: score_breakdown[w] for w in self.full_bag_with_eos}
         posteriors.append(bag_posterior)
@@ -211,7 +212,8 @@ class BigramGreedyDecoder(Decoder):
                                                  start_hypo.trgt_sentence, 
                                                  start_hypo.score, 
                                                  sen))
-        self.set_predictor_states(copy.deepcopy(start_hypo.predictor_states))
+        self.set_predictor_states(self.copy_predictor_states(
+                        start_hypo.predictor_states))
         if not start_hypo.word_to_consume is None: # Consume if cheap expand
             self.consume(start_hypo.word_to_consume)
         hypos = []
@@ -221,7 +223,8 @@ class BigramGreedyDecoder(Decoder):
         cancelled = False
         for forced_w in sen[len(start_hypo.trgt_sentence):]:
             posterior,score_breakdown = self.apply_predictors()
-            hypo.predictor_states = copy.deepcopy(self.get_predictor_states())
+            hypo.predictor_states = self.copy_predictor_states(
+                            self.get_predictor_states())
             bag_posterior = {w: posterior[w] for w in self.full_bag_with_eos}
             bag_breakdown = {w: score_breakdown[w] 
                                         for w in self.full_bag_with_eos}
@@ -1,6 +1,5 @@
 """Implementation of the bow search strategy """
 
-import copy
 from heapq import heappush, heappop, heapify
 import logging
 
@@ -129,7 +128,7 @@ class BOWDecoder(Decoder):
             if not single_step:
                 del node.active_arcs[best_word]
                 if len(node.active_arcs) > 0:
-                    prev_hypo.predictor_states = copy.deepcopy(
+                    prev_hypo.predictor_states = self.copy_predictor_states(
                                                 self.get_predictor_states())
             else:
                 prev_hypo.predictor_states = self.get_predictor_states()
@@ -255,7 +254,7 @@ class BOWDecoder(Decoder):
                           ' '.join([str(w) for w in node.hypo.trgt_sentence]),
                           word))
             if node.active_arcs:
-                self.set_predictor_states(copy.deepcopy(
+                self.set_predictor_states(self.copy_predictor_states(
                                                 node.hypo.predictor_states))
             else:
                 self.set_predictor_states(node.hypo.predictor_states)
@@ -264,17 +263,13 @@ class BOWDecoder(Decoder):
             if self.hypo_recombination:
                 rest = self.max_expansions - self.apply_predictors_count
                 new_open = []
+                index = self.create_recombination_index()
                 while len(new_open) < rest and self.open_nodes:
                     c_cost,candidate = heappop(self.open_nodes)
-                    valid = True
-                    for _,el in new_open:
-                        if self.are_equal_predictor_states(
-                                            candidate[0].hypo.predictor_states,
-                                            el[0].hypo.predictor_states):
-                            valid = False
-                            break
-                    if valid:
+                    states = candidate[0].hypo.predictor_states
+                    if not index.contains(states):
                         new_open.append((c_cost, candidate))
+                        index.add(states, candidate)
                         if len(new_open) > rest:
                             break
                 self.open_nodes = new_open
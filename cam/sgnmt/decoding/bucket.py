@@ -1,6 +1,7 @@
 """Implementation of the bucket search strategy """
 
-import copy
+from bisect import bisect_right
+from heapq import heappush, heappop, heapify
 import logging
 import operator
 
@@ -10,6 +11,125 @@ from cam.sgnmt.utils import INF, NEG_INF
 import numpy as np
 
 
+class Bucket(object):
+    """Sorted container for the hypotheses in a single bucket. Entries
+    are ``(heap_score, hypo)`` tuples in ascending order of the heap
+    score, i.e. the best hypothesis comes first. Peeking at the n-th 
+    best entry and removing the best entry are O(1): Removed entries
+    are skipped with a start offset and the underlying lists are only
+    compacted if more than half of them is dead. Few new entries are 
+    inserted with binary search, many new entries are merged with 
+    a single (stable) sort. Entries with equal heap scores keep their
+    insertion order.
+    """
+    
+    def __init__(self, entries=None):
+        """Creates a new bucket.
+        
+        Args:
+            entries (list): ``(heap_score, hypo)`` tuples which are 
+                            already sorted by the heap score
+        """
+        self._set_entries(entries if entries is not None else [])
+    
+    def _set_entries(self, entries):
+        self.entries = entries
+        self.scores = [s for s,_ in entries]
+        self.start = 0
+    
+    def __len__(self):
+        return len(self.entries) - self.start
+    
+    def __getitem__(self, idx):
+        """Returns the ``idx``-th best entry (``idx`` >= 0). """
+        if idx < 0 or idx >= len(self):
+            raise IndexError("Bucket index out of range")
+        return self.entries[self.start + idx]
+    
+    def __iter__(self):
+        for idx in xrange(self.start, len(self.entries)):
+            yield self.entries[idx]
+    
+    def pop(self):
+        """Removes and returns the best entry. """
+        entry = self.entries[self.start]
+        self.entries[self.start] = None # Release hypo
+        self.start += 1
+        if self.start >= 64 and 2*self.start >= len(self.entries):
+            del self.entries[:self.start]
+            del self.scores[:self.start]
+            self.start = 0
+        return entry
+    
+    def add(self, new_entries, max_size):
+        """Adds new entries and truncates the bucket to ``max_size``.
+        
+        Args:
+            new_entries (list): ``(heap_score, hypo)`` tuples in any
+                                order
+            max_size (int): Maximum number of entries in the bucket
+        """
+        new_entries = sorted(new_entries, key=operator.itemgetter(0))
+        if 8 * len(new_entries) < len(self):
+            for entry in new_entries:
+                pos = bisect_right(self.scores, entry[0], self.start)
+                if pos - self.start >= max_size:
+                    break # All following entries are worse
+                self.scores.insert(pos, entry[0])
+                self.entries.insert(pos, entry)
+        else:
+            entries = self.entries[self.start:]
+            entries.extend(new_entries)
+            entries.sort(key=operator.itemgetter(0))
+            self._set_entries(entries)
+        end = self.start + max_size
+        if end < len(self.entries):
+            del self.entries[end:]
+            del self.scores[end:]
+
+
+class BucketScores(object):
+    """Indexed priority queue which maps bucket lengths to bucket 
+    scores. Updates are O(log n) pushes to a heap. Outdated heap 
+    entries are discarded lazily when the best bucket is looked up.
+    Among buckets with equal scores, the longest one is preferred.
+    """
+    
+    def __init__(self, n_buckets):
+        """Creates an empty index for ``n_buckets`` buckets. """
+        self.scores = [None] * n_buckets
+        self.heap = []
+    
+    def update(self, length, score):
+        """Sets the score of a bucket.
+        
+        Args:
+            length (int): Bucket length
+            score (float): New bucket score, or None if the bucket is
+                           empty
+        """
+        if self.scores[length] == score:
+            return
+        self.scores[length] = score
+        if score is not None:
+            heappush(self.heap, (score, -length))
+            if len(self.heap) > 4 * len(self.scores) + 64:
+                self.heap = [(s, -l) for l, s in enumerate(self.scores)
+                                        if s is not None]
+                heapify(self.heap)
+    
+    def get_best(self):
+        """Returns the length and score of the bucket with the lowest
+        score, or (-1, None) if all buckets are empty.
+        """
+        while self.heap:
+            score, neg_length = self.heap[0]
+            if self.scores[-neg_length] == score:
+                return -neg_length, score
+            heappop(self.heap)
+        return -1, None
+
+
 class BucketDecoder(Decoder):
     """The bucket decoder maintains separate buckets for each sentence
     length. The buckets contain partial hypotheses. In each iteration,
@@ -176,40 +296,36 @@ class BucketDecoder(Decoder):
         return -1
 
     def _get_bucket_maxscore(self):
-        """Implements the bucket selector 'maxscore' """
+        """Implements the bucket selector 'maxscore'. The threshold is
+        the lowest multiple of 5 above the best bucket score. 
+        """
+        _, best_score = self.bucket_scores.get_best()
+        if best_score is None:
+            return -1
         for max_score in range(0, 500, 5):
-            length = self._get_bucket_maxscore_helper(max_score) 
-            if length >= 0:
-                return length
+            if best_score < max_score:
+                return self._get_bucket_maxscore_helper(max_score) 
         return -1
 
     def _get_bucket_maxscore_helper(self, max_score):
         """Helper method for maxscore """
         last_length = self.last_bucket
+        scores = self.bucket_scores.scores
         for length in xrange(last_length+1, self.max_len):
-            if self.buckets[length]:
-                score = self.get_bucketscore(length)
-                if score < max_score:
-                    self.last_bucket = length
-                    return length
+            score = scores[length]
+            if score is not None and score < max_score:
+                self.last_bucket = length
+                return length
         for length in xrange(last_length+1):
-            if self.buckets[length]:
-                score = self.get_bucketscore(length)
-                if score < max_score:
-                    self.last_bucket = length
-                    return length
+            score = scores[length]
+            if score is not None and score < max_score:
+                self.last_bucket = length
+                return length
         return -1
 
     def _get_bucket_score(self):
         """Implements the bucket selector 'score' """
-        best_score = INF
-        best_length = -1
-        for length in xrange(self.max_len):
-            if self.buckets[length]:
-                score = self.get_bucketscore(length)
-                if score <= best_score:
-                    best_score = score
-                    best_length = length 
+        best_length, _ = self.bucket_scores.get_best()
         return best_length
 
     def _get_bucket_score_end(self):
@@ -220,14 +336,7 @@ class BucketDecoder(Decoder):
                 self.last_bucket = length
                 return length
         # Restart with best bucket
-        best_score = INF
-        best_length = -1
-        for length in xrange(self.max_len):
-            if self.buckets[length]:
-                score = self.get_bucketscore(length)
-                if score <= best_score:
-                    best_score = score
-                    best_length = length 
+        best_length, _ = self.bucket_scores.get_best()
         self.last_bucket = best_length
         return best_length
 
@@ -262,11 +371,11 @@ class BucketDecoder(Decoder):
                                                       src_sentence) 
         init_hypo = PartialHypothesis()
         init_hypo.predictor_states = self.get_predictor_states()
-        init_hypo.scores = []
         init_hypo.parent_hypo_array_idx = 0 # point to guardian
-        self.buckets = [[] for _ in xrange(self.max_len+1)]
-        self.expanded_hypos = [[] for _ in xrange(self.max_len+1)]
-        self.buckets[0].append((0.0, init_hypo))
+        self.buckets = [Bucket() for _ in xrange(self.max_len+1)]
+        self.expanded_hypos = [self.create_recombination_index()
+                                        for _ in xrange(self.max_len+1)]
+        self.buckets[0] = Bucket([(0.0, init_hypo)])
         self.expand_counts = [0.0] # with guardian
         self.expand_backpointers = [0] # with guardian
         self.last_bucket = 0
@@ -275,6 +384,9 @@ class BucketDecoder(Decoder):
         self.compressed = [True] * (self.max_len+1)
         self.guaranteed_optimality = True
         self.cur_iter = 0
+        # The last bucket is never expanded
+        self.bucket_scores = BucketScores(self.max_len)
+        self._update_bucket_score(0)
     
     def _activate_hypo(self, hypo, length, heap_score):
         """Prepares the decoder for expanding the given hypothesis. 
@@ -295,7 +407,8 @@ class BucketDecoder(Decoder):
                                heap_score,
                                self.apply_predictors_count,
                                ' '.join([str(w) for w in hypo.trgt_sentence])))
-        self.set_predictor_states(copy.deepcopy(hypo.predictor_states))
+        self.set_predictor_states(self.copy_predictor_states(
+                        hypo.predictor_states))
         if not hypo.word_to_consume is None: # Consume if cheap expand
             self.consume(hypo.word_to_consume)
             hypo.word_to_consume = None
@@ -318,12 +431,13 @@ class BucketDecoder(Decoder):
     def _collect_stats_best(self, hypo):
         if hypo.score > self.best_score:
             self.best_score = hypo.score
-            self.best_word_scores[:len(hypo.scores) ] = hypo.scores
+            scores = hypo.get_prefix_scores()
+            self.best_word_scores[:len(scores)] = scores
             self._update_heap_scores()
     
     def _collect_stats_full(self, hypo):
         update = False
-        for idx, score in enumerate(hypo.scores):
+        for idx, score in enumerate(hypo.get_prefix_scores()):
             if score > self.best_word_scores[idx]:
                 self.best_word_scores[idx] = score
                 update = True
@@ -358,8 +472,19 @@ class BucketDecoder(Decoder):
         """
         new_bucket = [(-self._get_combined_score(h), h) 
                                 for _,h in self.buckets[length]]
-        self.buckets[length] = new_bucket
-        self.buckets[length].sort(key=operator.itemgetter(0))
+        new_bucket.sort(key=operator.itemgetter(0))
+        self.buckets[length] = Bucket(new_bucket)
+        self._update_bucket_score(length)
+    
+    def _update_bucket_score(self, length):
+        """Updates the entry of a bucket in ``self.bucket_scores``. 
+        This needs to be called whenever the best hypothesis in the
+        bucket or ``best_word_scores`` have changed.
+        """
+        if length < self.max_len:
+            self.bucket_scores.update(length, 
+                                      self.get_bucketscore(length) 
+                                      if self.buckets[length] else None)
     
     def _get_max_bucket_size(self):
         if not self.low_memory_mode:
@@ -376,15 +501,14 @@ class BucketDecoder(Decoder):
         if (not self.hypo_recombination or
                 not self.guaranteed_optimality or 
                 max_size >= len(new_hypos) + len(self.buckets[length])):
-            self.buckets[length].extend(new_hypos)
-            self.buckets[length].sort(key=operator.itemgetter(0))
-            self.buckets[length] = self.buckets[length][:max_size]
+            self.buckets[length].add(new_hypos, max_size)
             self.compressed[length] = False
         elif self.compressed[length]: # Equivalence check only for new
             logging.debug("Add %d hypos to compressed bucket of size %d" % (
                                     len(new_hypos), len(self.buckets[length])))
             new_hypos.sort(key=operator.itemgetter(0))
             new_bucket = []
+            index = self.create_recombination_index()
             oidx = 0
             nidx = 0
             olen = len(self.buckets[length])
@@ -395,21 +519,22 @@ class BucketDecoder(Decoder):
                 if oscore == INF and nscore == INF:
                     break
                 if oscore < nscore: # Add hypos from old bucket without checks
+                    old_hypo = self.buckets[length][oidx][1]
                     new_bucket.append(self.buckets[length][oidx])
+                    index.add(old_hypo.predictor_states, old_hypo)
                     oidx += 1
                 else: # Check equivalence
                     hypo = new_hypos[nidx][1]
-                    self.set_predictor_states(copy.deepcopy(
+                    self.set_predictor_states(self.copy_predictor_states(
                                                     hypo.predictor_states))
                     if not hypo.word_to_consume is None:
                         self.consume(hypo.word_to_consume)
                         hypo.word_to_consume = None
                     hypo.predictor_states = self.get_predictor_states()
                     valid = True
-                    for other_hypo in [b for _,b in new_bucket]:
-                        if other_hypo.score >= hypo.score and self.are_equal_predictor_states(
-                                                hypo.predictor_states,
-                                                other_hypo.predictor_states):
+                    for other_hypo in index.iter_equal_items(
+                                                hypo.predictor_states):
+                        if other_hypo.score >= hypo.score:
                             valid = False
                             logging.debug("Hypo recombination: %s > %s (compress)"
                                                   % (other_hypo.trgt_sentence,
@@ -417,28 +542,29 @@ class BucketDecoder(Decoder):
                             break
                     if valid:
                         new_bucket.append((nscore, hypo))
+                        index.add(hypo.predictor_states, hypo)
                     nidx += 1
-            self.buckets[length] = new_bucket
+            self.buckets[length] = Bucket(new_bucket)
             self.compressed[length] = True
         else: # Compress from scratch
-            hypos = self.buckets[length] + new_hypos
+            hypos = list(self.buckets[length]) + new_hypos
             logging.debug("Compress bucket of size %d" % len(hypos))
-            new_hypos.sort(key=operator.itemgetter(0))
+            hypos.sort(key=operator.itemgetter(0))
             new_bucket = []
+            index = self.create_recombination_index()
             idx = 0
             while len(new_bucket) < max_size and idx < len(hypos):
                 hypo = hypos[idx][1]
-                self.set_predictor_states(copy.deepcopy(
+                self.set_predictor_states(self.copy_predictor_states(
                                                     hypo.predictor_states))
                 if not hypo.word_to_consume is None:
                     self.consume(hypo.word_to_consume)
                     hypo.word_to_consume = None
                 hypo.predictor_states = self.get_predictor_states()
                 valid = True
-                for other_hypo in [b for _,b in new_bucket]:
-                    if other_hypo.score >= hypo.score and self.are_equal_predictor_states(
-                                                hypo.predictor_states,
-                                                other_hypo.predictor_states):
+                for other_hypo in index.iter_equal_items(
+                                                hypo.predictor_states):
+                    if other_hypo.score >= hypo.score:
                         valid = False
                         logging.debug("Hypo recombination: %s > %s"
                                                   % (other_hypo.trgt_sentence,
@@ -446,9 +572,11 @@ class BucketDecoder(Decoder):
                         break
                 if valid:
                     new_bucket.append((hypos[idx][0], hypo))
+                    index.add(hypo.predictor_states, hypo)
                 idx += 1
-            self.buckets[length] = new_bucket
+            self.buckets[length] = Bucket(new_bucket)
             self.compressed[length] = True
+        self._update_bucket_score(length)
         if (self.hypo_recombination
                 and self.guaranteed_optimality 
                 and len(self.buckets[length]) >= max_size):
@@ -480,24 +608,25 @@ class BucketDecoder(Decoder):
     def _get_hypo(self, length):
         hypo = None
         while self.buckets[length] and hypo is None:
-            s,hypo = self.buckets[length].pop(0)
+            s,hypo = self.buckets[length].pop()
             if self.early_stopping and hypo.score <= self.best_score:
                 hypo = None
             else:
                 self._activate_hypo(hypo, length, s)
                 if self.hypo_recombination:
                     hypo.predictor_states = self.get_predictor_states()
-                    for other_hypo in self.expanded_hypos[length]:
-                        if other_hypo.score >= hypo.score and self.are_equal_predictor_states(
-                                                hypo.predictor_states,
-                                                other_hypo.predictor_states):
+                    expanded = self.expanded_hypos[length]
+                    for other_hypo in expanded.iter_equal_items(
+                                                hypo.predictor_states):
+                        if other_hypo.score >= hypo.score:
                             logging.debug("Hypo recombination: %s > %s (activate)"
                                                   % (other_hypo.trgt_sentence,
                                                      hypo.trgt_sentence))
                             hypo = None
                             break
                     if not hypo is None:
-                        self.expanded_hypos[length].append(hypo)
+                        expanded.add(hypo.predictor_states, hypo)
+        self._update_bucket_score(length)
         return hypo
 
     def decode(self, src_sentence):
@@ -520,7 +649,6 @@ class BucketDecoder(Decoder):
                     hypo_array_idx = self._get_next_hypo_array_idx(hypo)
                 for w,score in posterior.iteritems():
                     exp_hypo = hypo.cheap_expand(w, score, score_breakdown[w])
-                    exp_hypo.scores = hypo.scores + [hypo.score] 
                     if self.diverse_decoding:
                         exp_hypo.parent_hypo_array_idx = hypo_array_idx
                     combi_score = self._get_combined_score(exp_hypo) 
@@ -536,6 +664,6 @@ class BucketDecoder(Decoder):
                       (self.current_sen_id + 1))
         if not self.full_hypos: # Add incomplete longest hypos if no complete
             logging.warn("No complete hypotheses found for %s" % src_sentence)
-            for hypo in self.buckets[self.max_len]:
+            for _,hypo in self.buckets[self.max_len]:
                 self.add_full_hypo(hypo.generate_full_hypothesis())
         return self.get_full_hypos_sorted()
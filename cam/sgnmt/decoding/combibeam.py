@@ -5,7 +5,6 @@ each time step.
 from cam.sgnmt import utils
 from cam.sgnmt.decoding.beam import BeamDecoder
 from cam.sgnmt.decoding import combination
-import copy
 import logging
 
 
@@ -49,17 +48,38 @@ class CombiBeamDecoder(BeamDecoder):
         Returns:
             list. List of child hypotheses
         """
-        self.set_predictor_states(copy.deepcopy(hypo.predictor_states))
+        self.set_predictor_states(self.copy_predictor_states(
+                        hypo.predictor_states))
         if not hypo.word_to_consume is None: # Consume if cheap expand
             self.consume(hypo.word_to_consume)
             hypo.word_to_consume = None
         posterior, score_breakdown = self.apply_predictors()
         hypo.predictor_states = self.get_predictor_states()
+        return self._create_children(hypo, posterior, score_breakdown)
+
+    def _expand_hypos_batch(self, hypos, top_n=0):
+        """Batched version of ``_expand_hypo``. Like in 
+        ``_expand_hypo``, we do not restrict the number of children
+        before applying ``breakdown2score``.
+        """
+        return super(CombiBeamDecoder, self)._expand_hypos_batch(hypos,
+                                                                 top_n)
+
+    def _create_children(self, hypo, posterior, score_breakdown):
+        """Creates the children of ``hypo`` and applies
+        ``breakdown2score`` to them.
+        
+        Returns:
+            list. The best beam size child hypotheses
+        """
         expanded_hypos = [hypo.cheap_expand(w, s, score_breakdown[w]) 
                           for w, s in utils.common_iterable(posterior)]
         for expanded_hypo in expanded_hypos:
+            breakdowns = expanded_hypo.score_breakdown
             expanded_hypo.score = self.breakdown2score(
-                    expanded_hypo.score, expanded_hypo.score_breakdown)
+                    expanded_hypo.score, breakdowns)
+            # breakdown2score may update the last breakdown in place
+            expanded_hypo.set_last_score_breakdown(breakdowns[-1])
         expanded_hypos.sort(key=lambda x: -x.score)
         return expanded_hypos[:self.beam_size]
 
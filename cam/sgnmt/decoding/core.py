@@ -9,7 +9,11 @@ from abc import abstractmethod
 import copy
 
 from cam.sgnmt import utils
-from cam.sgnmt.predictors.core import UnboundedVocabularyPredictor
+from cam.sgnmt.predictors.core import UnboundedVocabularyPredictor, \
+                                   BatchPredictor
+from cam.sgnmt.decoding.instrumentation import PREDICTOR_METHODS, \
+                                               DECODER_METHODS, \
+                                               DECODER_COMPONENT
 from cam.sgnmt.decoding.interpolation import FixedInterpolationStrategy, \
                                              EntropyInterpolationStrategy, \
                                              MoEInterpolationStrategy
@@ -88,8 +92,25 @@ class Hypothesis:
         return chypo
 
 
-class PartialHypothesis:
-    """Represents a partial hypothesis in various decoders. """
+class PartialHypothesis(object):
+    """Represents a partial hypothesis in various decoders. The 
+    translation prefix is stored as persistent linked list of 
+    ``(word, score_breakdown, prefix_score, parent)`` tuples which is
+    shared with the parent hypothesis. Therefore, creating a new 
+    hypothesis with ``expand()`` or ``cheap_expand()`` takes constant
+    time and memory, regardless of the prefix length. The 
+    ``trgt_sentence`` and ``score_breakdown`` lists are materialized
+    on access, which is linear in the prefix length. Use 
+    ``get_last_word()``, ``get_length()``, and 
+    ``get_last_score_breakdown()`` in inner loops instead.
+    
+    Decoders can still attach their own attributes to hypotheses 
+    (e.g. ``bleu`` in the MBR beam decoder). The ``__dict__`` for them
+    is only allocated if such an attribute is set.
+    """
+    
+    __slots__ = ('predictor_states', 'score', 'word_to_consume',
+                 '_prefix', '_length', '__dict__')
     
     def __init__(self, initial_states = None):
         """Creates a new partial hypothesis with zero score and empty
@@ -99,20 +120,99 @@ class PartialHypothesis:
             initial_states: Initial predictor states
         """
         self.predictor_states = initial_states
-        self.trgt_sentence = []
         self.score = 0.0
-        self.score_breakdown = []
         self.word_to_consume = None
+        self._prefix = None
+        self._length = 0
+    
+    def _get_prefix_nodes(self):
+        """Returns the nodes of the translation prefix in sentence 
+        order.
+        """
+        nodes = []
+        node = self._prefix
+        while node is not None:
+            nodes.append(node)
+            node = node[3]
+        nodes.reverse()
+        return nodes
+    
+    @property
+    def trgt_sentence(self):
+        """List of target words in the translation prefix. """
+        return [node[0] for node in self._get_prefix_nodes()]
+    
+    @trgt_sentence.setter
+    def trgt_sentence(self, trgt_sentence):
+        """Replaces the words in the translation prefix. Score 
+        breakdowns are kept, so ``trgt_sentence`` must have the same
+        length as the current prefix.
+        
+        Raises:
+            ValueError. If the length of ``trgt_sentence`` differs from
+            the length of the current translation prefix
+        """
+        if len(trgt_sentence) != self._length:
+            raise ValueError("Cannot change the length of a partial "
+                             "hypothesis from %d to %d" 
+                             % (self._length, len(trgt_sentence)))
+        prefix = None
+        for word, node in zip(trgt_sentence, self._get_prefix_nodes()):
+            prefix = (word, node[1], node[2], prefix)
+        self._prefix = prefix
+    
+    @property
+    def score_breakdown(self):
+        """List of predictor score breakdowns, one for each word in 
+        the translation prefix.
+        """
+        return [node[1] for node in self._get_prefix_nodes()]
     
     def get_last_word(self):
         """Get the last word in the translation prefix. """
-        if not self.trgt_sentence:
+        if self._prefix is None:
+            return None
+        return self._prefix[0]
+    
+    def get_length(self):
+        """Get the length of the translation prefix. """
+        return self._length
+    
+    def get_last_score_breakdown(self):
+        """Get the score breakdown of the last word in the translation
+        prefix, or None if the prefix is empty.
+        """
+        if self._prefix is None:
             return None
-        return self.trgt_sentence[-1]
+        return self._prefix[1]
+    
+    def set_last_score_breakdown(self, score_breakdown):
+        """Replaces the score breakdown of the last word in the 
+        translation prefix. The prefix must not be empty.
+        
+        Args:
+            score_breakdown (list): New predictor score breakdown for
+                                    the last word
+        """
+        word, _, prefix_score, parent = self._prefix
+        self._prefix = (word, score_breakdown, prefix_score, parent)
+    
+    def get_prefix_scores(self):
+        """Get the scores of all proper prefixes of the translation 
+        prefix, starting with the score of the empty prefix.
+        
+        Returns:
+            list. List of length ``get_length()`` with accumulated 
+            scores
+        """
+        return [node[2] for node in self._get_prefix_nodes()]
     
     def generate_full_hypothesis(self):
         """Create a ``Hypothesis`` instance from this hypothesis. """
-        return Hypothesis(self.trgt_sentence, self.score, self.score_breakdown)
+        nodes = self._get_prefix_nodes()
+        return Hypothesis([node[0] for node in nodes], 
+                          self.score, 
+                          [node[1] for node in nodes])
     
     def expand(self, word, new_states, score, score_breakdown):
         """Creates a new partial hypothesis adding a new word to the
@@ -130,9 +230,8 @@ class PartialHypothesis:
         """
         hypo = PartialHypothesis(new_states)
         hypo.score = self.score + score
-        hypo.score_breakdown = copy.copy(self.score_breakdown)
-        hypo.trgt_sentence = self.trgt_sentence + [word]
-        hypo.score_breakdown.append(score_breakdown)
+        hypo._prefix = (word, score_breakdown, self.score, self._prefix)
+        hypo._length = self._length + 1
         return hypo
     
     def cheap_expand(self, word, score, score_breakdown):
@@ -154,10 +253,9 @@ class PartialHypothesis:
         """
         hypo = PartialHypothesis(self.predictor_states)
         hypo.score = self.score + score
-        hypo.score_breakdown = copy.copy(self.score_breakdown)
-        hypo.trgt_sentence = self.trgt_sentence + [word]
+        hypo._prefix = (word, score_breakdown, self.score, self._prefix)
+        hypo._length = self._length + 1
         hypo.word_to_consume = word
-        hypo.score_breakdown.append(score_breakdown)
         return hypo
 
 
@@ -195,6 +293,66 @@ vocabulary. Results in a valid distribution if predictor scores are
 stochastic. """
 
 
+class RecombinationIndex(object):
+    """Index for hypothesis recombination. Items (usually hypotheses)
+    are stored under their predictor states. States are grouped by the
+    recombination keys of the predictors (see 
+    ``Predictor.get_recombination_key()``), so finding equal states is
+    a dictionary lookup. ``is_equal()`` is only called within a group
+    for predictors which do not support recombination keys.
+    """
+    
+    def __init__(self, predictors):
+        """Creates an empty index.
+        
+        Args:
+            predictors (list): Tuples (predictor, weight) as in
+                               ``Decoder.predictors``
+        """
+        self.predictors = [p for p, _ in predictors]
+        self.groups = {}
+    
+    def _get_key(self, states):
+        return tuple(p.get_recombination_key(s) 
+                     for p, s in zip(self.predictors, states))
+    
+    def iter_equal_items(self, states):
+        """Iterates over all items whose predictor states are equal to
+        ``states`` according ``Decoder.are_equal_predictor_states()``.
+        
+        Args:
+            states (list): Predictor states
+        
+        Returns:
+            iterator. Items stored under equal states
+        """
+        key = self._get_key(states)
+        group = self.groups.get(key)
+        if not group:
+            return
+        unkeyed = [idx for idx, k in enumerate(key) if k is None]
+        for other_states, item in group:
+            if all(self.predictors[idx].is_equal(other_states[idx], 
+                                                 states[idx])
+                   for idx in unkeyed):
+                yield item
+    
+    def contains(self, states):
+        """Returns true if the index contains an item whose predictor
+        states are equal to ``states``.
+        """
+        return any(True for _ in self.iter_equal_items(states))
+    
+    def add(self, states, item):
+        """Adds ``item`` under the predictor states ``states``. """
+        key = self._get_key(states)
+        group = self.groups.get(key)
+        if group is None:
+            self.groups[key] = [(states, item)]
+        else:
+            group.append((states, item))
+
+
 class Heuristic(Observer):
     """A ``Heuristic`` instance can be used to estimate the future 
     costs for a given word in a given state. See the ``heuristics``
@@ -314,6 +472,7 @@ class Decoder(Observable):
         
         self.current_sen_id = -1
         self.apply_predictors_count = 0
+        self.instrumentation = None
         self.lower_bounds = []
         if decoder_args.score_lower_bounds_file:
             with open(decoder_args.score_lower_bounds_file) as f:
@@ -356,6 +515,36 @@ class Decoder(Observable):
         self.predictors.append((predictor, weight))
         self.predictor_names.append(name)
     
+    def instrument(self, instrumentation):
+        """Enables instrumentation for this decoder. All predictors
+        which have been added so far and the helper methods listed in
+        ``instrumentation.DECODER_METHODS`` are wrapped such that the
+        number of calls and their wall times are recorded in
+        ``instrumentation``. Predictors are identified by their name;
+        if the same name is used multiple times, we append a counter
+        as in the n-best output (e.g. 'nmt', 'nmt2').
+        
+        Args:
+            instrumentation (DecoderInstrumentation): Collects the 
+                                                      statistics
+        """
+        if self.instrumentation is not None:
+            logging.warn("Decoder is already instrumented.")
+            return
+        self.instrumentation = instrumentation
+        name_count = {}
+        for name, (p, _) in zip(self.predictor_names, self.predictors):
+            name_count[name] = name_count.get(name, 0) + 1
+            if name_count[name] > 1:
+                name = "%s%d" % (name, name_count[name])
+            for method in PREDICTOR_METHODS:
+                instrumentation.instrument_method(p, method, name)
+        for attr, method in DECODER_METHODS:
+            instrumentation.instrument_method(self, 
+                                              attr, 
+                                              DECODER_COMPONENT, 
+                                              method)
+    
     def remove_predictors(self):
         """Removes all predictors of this decoder. """
         self.predictors = []
@@ -501,27 +690,48 @@ class Decoder(Observable):
           A list of predictor weights.
         """
         if self.interpolation_strategies:
-            predictions = [[] for _ in pred_weights]
-            for strat, pred_indices in self.interpolation_strategies:
-                new_pred_weights = strat.find_weights(
-                        [pred_weights[idx] for idx in pred_indices],
-                        non_zero_words,
-                        [posteriors[idx] for idx in pred_indices],
-                        [unk_probs[idx] for idx in pred_indices])
+            return self.apply_interpolation_strategy_batch(
+                [pred_weights], [non_zero_words], [posteriors], [unk_probs])[0]
+        return pred_weights
+
+    def apply_interpolation_strategy_batch(
+            self, pred_weights, non_zero_words, posteriors, unk_probs):
+        """Batched version of ``apply_interpolation_strategy()``. All
+        arguments are lists with one entry for each hypothesis. Each
+        interpolation strategy is called once for the whole batch (see
+        ``InterpolationStrategy.find_weights_batch()``).
+
+        Returns:
+          A list of predictor weight lists, one for each entry.
+        """
+        if not self.interpolation_strategies:
+            return pred_weights
+        predictions = [[[] for _ in weights] for weights in pred_weights]
+        for strat, pred_indices in self.interpolation_strategies:
+            batch_pred_weights = strat.find_weights_batch(
+                    [[weights[idx] for idx in pred_indices]
+                        for weights in pred_weights],
+                    non_zero_words,
+                    [[posterior[idx] for idx in pred_indices]
+                        for posterior in posteriors],
+                    [[unk_prob[idx] for idx in pred_indices]
+                        for unk_prob in unk_probs])
+            for row, new_pred_weights in enumerate(batch_pred_weights):
                 for idx, weight in zip(pred_indices, new_pred_weights):
-                    predictions[idx].append(weight)
-            for idx, preds in enumerate(predictions):
+                    predictions[row][idx].append(weight)
+        for weights, row_predictions in zip(pred_weights, predictions):
+            for idx, preds in enumerate(row_predictions):
                 if preds:
                     if self.interpolation_mean == 'arith':
-                        pred_weights[idx] = sum(preds) / float(len(preds))
+                        weights[idx] = sum(preds) / float(len(preds))
                     else:
-                        pred_weights[idx] = reduce(mul, preds, 1)
+                        weights[idx] = reduce(mul, preds, 1)
                     if self.interpolation_mean == 'geo':
-                        pred_weights[idx] = pred_weights[idx]**(1.0/len(preds))
+                        weights[idx] = weights[idx]**(1.0/len(preds))
             if self.interpolation_mean == 'prob':
-                partition = sum(pred_weights)
-                for idx in xrange(len(pred_weights)):
-                    pred_weights[idx] /= partition
+                partition = sum(weights)
+                for idx in xrange(len(weights)):
+                    weights[idx] /= partition
         return pred_weights
     
     def apply_predictors(self, top_n=0):
@@ -546,22 +756,55 @@ class Decoder(Observable):
                                                   bounded_posteriors)
         if not non_zero_words: # Special case: no word is possible
             non_zero_words = set([utils.EOS_ID])
-        # Add unbounded predictors and unk probabilities
+        # Add unbounded predictors
         posteriors = []
-        unk_probs = []
-        pred_weights = []
         bounded_idx = 0
-        for (p, w) in self.predictors:
+        for (p, _) in self.predictors:
             if isinstance(p, UnboundedVocabularyPredictor):
                 posterior = p.predict_next(non_zero_words)
             else: # Take it from the bounded_* variables
                 posterior = bounded_posteriors[bounded_idx]
                 bounded_idx += 1
             posteriors.append(posterior)
-            unk_probs.append(p.get_unk_probability(posterior))
-            pred_weights.append(w)
+        return self._combine_and_notify(non_zero_words, posteriors, top_n)
+
+    def _combine_and_notify(self, non_zero_words, posteriors, top_n):
+        """Helper method for ``apply_predictors`` and 
+        ``apply_predictors_batch``. Applies interpolation strategies,
+        combines the posteriors of all predictors, and notifies the
+        observers of this decoder.
+        
+        Args:
+            non_zero_words (set): All words with positive probability
+            posteriors (list): Predictor posteriors, one for each
+                               predictor in ``self.predictors``
+            top_n (int): If positive, return only the best n words.
+        
+        Returns:
+            combined,score_breakdown: like in ``apply_predictors()``
+        """
+        unk_probs, pred_weights = self._get_unk_probs_and_weights(posteriors)
         pred_weights = self.apply_interpolation_strategy(
                 pred_weights, non_zero_words, posteriors, unk_probs)
+        return self._combine_weighted_and_notify(
+            non_zero_words, posteriors, unk_probs, pred_weights, top_n)
+
+    def _get_unk_probs_and_weights(self, posteriors):
+        """Returns the UNK probabilities of the predictors for the 
+        given posteriors and the (prior) predictor weights.
+        """
+        unk_probs = []
+        pred_weights = []
+        for (p, w), posterior in zip(self.predictors, posteriors):
+            unk_probs.append(p.get_unk_probability(posterior))
+            pred_weights.append(w)
+        return unk_probs, pred_weights
+
+    def _combine_weighted_and_notify(self, non_zero_words, posteriors, 
+                                     unk_probs, pred_weights, top_n):
+        """Second half of ``_combine_and_notify()`` after the 
+        predictor weights have been determined.
+        """
         ret = self.combine_posteriors(
             non_zero_words, posteriors, unk_probs, pred_weights, top_n)
         if not self.allow_unk_in_output and utils.UNK_ID in ret[0]:
@@ -573,6 +816,87 @@ class Decoder(Observable):
                    {w: ret[1][w] for w in top})
         self.notify_observers(ret, message_type = MESSAGE_TYPE_POSTERIOR)
         return ret
+
+    def has_batch_predictors(self):
+        """Returns true if all predictors of this decoder support the
+        batched predictor API, i.e. ``apply_predictors_batch()`` and
+        ``consume_batch()`` can be used instead of the corresponding
+        methods operating on the current predictor states.
+        """
+        if not self.predictors:
+            return False
+        for (p, _) in self.predictors:
+            if (not isinstance(p, BatchPredictor) 
+                    or isinstance(p, UnboundedVocabularyPredictor)):
+                return False
+        return True
+
+    def consume_batch(self, states, words):
+        """Batched version of ``consume()``. Calls ``consume_batch()``
+        on all predictors. This requires ``has_batch_predictors()``. 
+        In contrast to ``consume()``, this does not operate on the 
+        current predictor states but on ``states``, which are not 
+        modified.
+        
+        Args:
+            states (list): List of predictor states, each of them as 
+                           returned by ``get_predictor_states()``
+            words (list): Words to consume, one for each entry in 
+                          ``states``
+        
+        Returns:
+            list. New predictor states, one for each entry in 
+            ``states``
+        """
+        new_pred_states = [p.consume_batch([s[idx] for s in states], words)
+                           for idx, (p, _) in enumerate(self.predictors)]
+        return [[pred_states[row] for pred_states in new_pred_states]
+                for row in xrange(len(states))]
+    
+    def apply_predictors_batch(self, states, top_n=0):
+        """Batched version of ``apply_predictors()``. This requires 
+        ``has_batch_predictors()``. Each predictor computes the 
+        posteriors for all entries in ``states`` with a single call of
+        ``predict_next_batch()``. The resulting posterior matrices are
+        then combined row by row.
+        
+        Args:
+            states (list): List of predictor states, each of them as 
+                           returned by ``get_predictor_states()``. The
+                           states are not modified.
+            top_n (int): If positive, return only the best n words for
+                         each entry in ``states``.
+        
+        Returns:
+            list. ``(combined, score_breakdown)`` tuples like in
+            ``apply_predictors()``, one for each entry in ``states``
+        """
+        self.apply_predictors_count += len(states)
+        batch_posteriors = [p.predict_next_batch([s[idx] for s in states])
+                            for idx, (p, _) in enumerate(self.predictors)]
+        all_non_zero_words = []
+        all_posteriors = []
+        all_unk_probs = []
+        all_pred_weights = []
+        for row in xrange(len(states)):
+            posteriors = [batch[row] for batch in batch_posteriors]
+            non_zero_words = self._get_non_zero_words(self.predictors,
+                                                      posteriors)
+            if not non_zero_words: # Special case: no word is possible
+                non_zero_words = set([utils.EOS_ID])
+            unk_probs, pred_weights = self._get_unk_probs_and_weights(
+                posteriors)
+            all_non_zero_words.append(non_zero_words)
+            all_posteriors.append(posteriors)
+            all_unk_probs.append(unk_probs)
+            all_pred_weights.append(pred_weights)
+        # Run interpolation strategies (e.g. the MoE network) only once
+        all_pred_weights = self.apply_interpolation_strategy_batch(
+            all_pred_weights, all_non_zero_words, all_posteriors,
+            all_unk_probs)
+        return [self._combine_weighted_and_notify(*args + (top_n,))
+                for args in zip(all_non_zero_words, all_posteriors, 
+                                all_unk_probs, all_pred_weights)]
     
     def _combine_posteriors_norm_none(self,
                                       non_zero_words,
@@ -597,24 +921,13 @@ class Decoder(Observable):
         Returns:
             combined,score_breakdown: like in ``apply_predictors()``
         """
-        if isinstance(non_zero_words, xrange) and top_n > 0:
-            n_words = len(non_zero_words)
-            scaled_posteriors = []
-            for posterior, unk_prob, weight in zip(
-                          posteriors, unk_probs, pred_weights):
-                if isinstance(posterior, dict):
-                    arr = np.full(n_words, unk_prob)
-                    for word, score in posterior.iteritems():
-                        arr[word] = score
-                    scaled_posteriors.append(arr * weight)
-                else:
-                    n_unks = n_words - len(posterior)
-                    if n_unks:
-                        posterior = np.concatenate((
-                               posterior, np.full(n_unks, unk_prob)))
-                    scaled_posteriors.append(posterior * weight)
-            combined_scores = np.sum(scaled_posteriors, axis=0)
-            non_zero_words = utils.argmax_n(combined_scores, top_n)
+        if self._use_dense_combination(non_zero_words):
+            score_matrix, _ = self._create_score_matrix(len(non_zero_words),
+                                                        posteriors,
+                                                        unk_probs)
+            return self._combine_score_matrix(score_matrix, 
+                                              pred_weights, 
+                                              top_n)
         combined = {}
         score_breakdown = {}
         for trgt_word in non_zero_words:
@@ -651,9 +964,15 @@ class Decoder(Observable):
         """
         n_predictors = len(self.predictors)
         unk_counts = [0.0] * n_predictors
+        use_dense = self._use_dense_combination(non_zero_words)
         for idx, w in enumerate(pred_weights):
             if unk_probs[idx] >= -0.00001 or unk_probs[idx] == NEG_INF:
                 continue
+            if use_dense:
+                n_words = len(non_zero_words)
+                unk_counts[idx] = float(n_words - self._count_known_words(
+                                                    n_words, posteriors[idx]))
+                continue
             for trgt_word in non_zero_words:
                 if not utils.common_contains(posteriors[idx], trgt_word):
                     unk_counts[idx] += 1.0
@@ -662,6 +981,7 @@ class Decoder(Observable):
                           posteriors,
                           [unk_probs[idx] - np.log(max(1.0, unk_counts[idx]))
                                for idx in xrange(n_predictors)],
+                          pred_weights,
                           top_n)
     
     def _combine_posteriors_norm_exact(self,
@@ -688,6 +1008,19 @@ class Decoder(Observable):
             combined,score_breakdown: like in ``apply_predictors()``
         """
         n_predictors = len(self.predictors)
+        if self._use_dense_combination(non_zero_words):
+            n_words = len(non_zero_words)
+            score_matrix, known_counts = self._create_score_matrix(
+                    n_words, posteriors, unk_probs)
+            unk_counts = [n_words - known for known in known_counts]
+            for idx in xrange(n_predictors):
+                if unk_counts[idx] > 1:
+                    score_matrix[idx] -= np.log(
+                            1.0 
+                            + (unk_counts[idx] - 1.0) * np.exp(unk_probs[idx]))
+            return self._combine_score_matrix(score_matrix, 
+                                              pred_weights, 
+                                              top_n)
         score_breakdown_raw = {}
         unk_counts = [0] * n_predictors
         for trgt_word in non_zero_words:
@@ -732,6 +1065,15 @@ class Decoder(Observable):
             combined,score_breakdown: like in ``apply_predictors()``
         """
         n_predictors = len(self.predictors)
+        if self._use_dense_combination(non_zero_words):
+            score_matrix, _ = self._create_score_matrix(len(non_zero_words),
+                                                        posteriors,
+                                                        unk_probs)
+            for idx in xrange(n_predictors):
+                score_matrix[idx] -= utils.log_sum(score_matrix[idx])
+            return self._combine_score_matrix(score_matrix, 
+                                              pred_weights, 
+                                              top_n)
         score_breakdown_raw = {}
         for trgt_word in non_zero_words: 
             score_breakdown_raw[trgt_word] = [(utils.common_get(
@@ -744,6 +1086,88 @@ class Decoder(Observable):
                             for preds in score_breakdown_raw.itervalues()]))
         return self._combine_posteriors_with_renorm(score_breakdown_raw, sums)
     
+    def _use_dense_combination(self, non_zero_words):
+        """Returns true if the posteriors can be combined with the
+        vectorized ``_combine_score_matrix``. This is the case if the
+        set of possible words is a full range of word ids (this happens
+        if the restricting posteriors are arrays) and the predictor 
+        scores are combined with a weighted sum.
+        """
+        return (isinstance(non_zero_words, xrange)
+                and self.combi_predictor_method 
+                          == Decoder.combi_arithmetic_unnormalized)
+
+    def _count_known_words(self, n_words, posterior):
+        """Returns the number of words in ``xrange(n_words)`` which are
+        contained in ``posterior``.
+        """
+        if isinstance(posterior, dict):
+            return sum(1 for w in posterior if w < n_words)
+        return min(n_words, len(posterior))
+
+    def _create_score_matrix(self, n_words, posteriors, unk_probs):
+        """Creates a dense matrix with the scores of all predictors for
+        the words ``0`` to ``n_words-1``. Words which are not in a 
+        posterior get the UNK score of that predictor.
+        
+        Args:
+            n_words (int): Size of the vocabulary to score
+            posteriors (list): Predictor posteriors
+            unk_probs (list): UNK scores of the predictors
+        
+        Returns:
+            array,list. A ``(n_predictors, n_words)`` score matrix, and
+            the number of words which are contained in each posterior
+        """
+        score_matrix = np.empty((len(posteriors), n_words))
+        known_counts = []
+        for row, posterior, unk_prob in zip(score_matrix,
+                                            posteriors,
+                                            unk_probs):
+            if isinstance(posterior, dict):
+                row.fill(unk_prob)
+                words = np.fromiter(posterior.iterkeys(), 
+                                    dtype=np.int64,
+                                    count=len(posterior))
+                scores = np.fromiter(posterior.itervalues(), 
+                                     dtype=np.float64,
+                                     count=len(posterior))
+                in_range = words < n_words
+                row[words[in_range]] = scores[in_range]
+                known_counts.append(int(np.sum(in_range)))
+            else:
+                n_known = min(n_words, len(posterior))
+                row[:n_known] = posterior[:n_known]
+                row[n_known:] = unk_prob
+                known_counts.append(n_known)
+        return score_matrix, known_counts
+
+    def _combine_score_matrix(self, score_matrix, pred_weights, top_n=0):
+        """Combines the rows of a score matrix created with
+        ``_create_score_matrix`` with a weighted sum. Only the entries
+        for the best ``top_n`` words are converted to the dictionary
+        representation used by ``apply_predictors()``.
+        
+        Args:
+            score_matrix (array): ``(n_predictors, n_words)`` matrix
+                                  with (renormalized) predictor scores
+            pred_weights (list): Predictor weights
+            top_n (int): If positive, return only top n words
+        
+        Returns:
+            combined,score_breakdown: like in ``apply_predictors()``
+        """
+        combined_scores = np.dot(pred_weights, score_matrix)
+        if 0 < top_n < len(combined_scores):
+            words = utils.argmax_n(combined_scores, top_n)
+        else:
+            words = np.arange(len(combined_scores))
+        combined = dict(zip(words.tolist(), combined_scores[words].tolist()))
+        score_breakdown = {w: zip(scores, pred_weights) 
+                           for w, scores in zip(words.tolist(),
+                                                score_matrix[:, words].T.tolist())}
+        return combined, score_breakdown
+
     def _combine_posteriors_with_renorm(self,
                                         score_breakdown_raw,
                                         renorm_factors):
@@ -862,6 +1286,23 @@ class Decoder(Observable):
         """Calls ``get_state()`` on all predictors. """
         return [p.get_state() for (p, _) in self.predictors]
     
+    def copy_predictor_states(self, states):
+        """Copies predictor states such that they can be loaded with
+        ``set_predictor_states()`` without changing ``states``. Only 
+        the states of predictors without persistent state (see
+        ``Predictor.has_persistent_state()``) are deep-copied. All 
+        other states are shared.
+        
+        Args:
+            states (list): Predictor states as returned by
+                           ``get_predictor_states``
+        
+        Returns:
+            list. Copy of ``states``
+        """
+        return [s if p.has_persistent_state() else copy.deepcopy(s)
+                for (p, _), s in zip(self.predictors, states)]
+    
     def set_predictor_combi_method(self, method):
         """Defines how to accumulate scores over the sequence. Should
         be one of the ``combi_`` methods defined below
@@ -935,6 +1376,17 @@ class Decoder(Observable):
         """
         raise NotImplementedError
 
+    def create_recombination_index(self):
+        """Creates an empty ``RecombinationIndex`` for the predictors
+        of this decoder. This should be used instead of pairwise
+        ``are_equal_predictor_states()`` calls when searching for
+        equal states among many hypotheses.
+        
+        Returns:
+            RecombinationIndex. Empty index
+        """
+        return RecombinationIndex(self.predictors)
+
     def are_equal_predictor_states(self, states1, states2):
         """This method applies ``is_equal`` on all predictors. It 
         returns true if all predictor states are equal.
@@ -1,6 +1,5 @@
 """Implementation of the dfs search strategy """
 
-import copy
 import logging
 import operator
 
@@ -52,7 +51,7 @@ class DFSDecoder(Decoder):
                                               generated so far. 
         """
         if (partial_hypo.get_last_word() == utils.EOS_ID
-                or len(partial_hypo.trgt_sentence) > self.max_len):
+                or partial_hypo.get_length() > self.max_len):
             self.add_full_hypo(partial_hypo.generate_full_hypothesis())
             self.best_score = max(self.best_score, partial_hypo.score)
             return
@@ -66,7 +65,8 @@ class DFSDecoder(Decoder):
         else:
             children = [i for i in posterior.items()]
         if len(children) > 1: # deep copy only if necessary
-            pred_states = copy.deepcopy(self.get_predictor_states())
+            pred_states = self.copy_predictor_states(
+                            self.get_predictor_states())
         logging.debug("Expand: best_score: %f exp: %d partial_score: "
                       "%f children: %d sentence: %s" %
                       (self.best_score,
@@ -84,7 +84,8 @@ class DFSDecoder(Decoder):
             if self.early_stopping and new_hypo.score < self.best_score:
                 return
             if reload_states: # TODO: save one deepcopy (in last iteration)
-                self.set_predictor_states(copy.deepcopy(pred_states))
+                self.set_predictor_states(self.copy_predictor_states(
+                                pred_states))
             self.consume(trgt_word)
             self._dfs(new_hypo)
             reload_states = True
@@ -96,7 +96,8 @@ class FlipDecoder(Decoder):
         bag = dict(self.full_bag)
         while bag:
             posterior,score_breakdown = self.apply_predictors()
-            hypo.predictor_states = copy.deepcopy(self.get_predictor_states())
+            hypo.predictor_states = self.copy_predictor_states(
+                            self.get_predictor_states())
             hypos.append(hypo)
             posteriors.append(posterior)
             score_breakdowns.append(score_breakdown)
@@ -255,7 +256,8 @@ class FlipDecoder(Decoder):
         """
         prefix = self.hypos.get_prefix(candidate.trgt_sentence)
         hypo = self.hypos.get(prefix)
-        self.set_predictor_states(copy.deepcopy(hypo.predictor_states))
+        self.set_predictor_states(self.copy_predictor_states(
+                        hypo.predictor_states))
         for pos,score in enumerate(hypo.scores): # Update candidate scores
             candidate.scores[pos] = score
         self.consume(hypo.word_to_consume) 
@@ -266,7 +268,8 @@ class FlipDecoder(Decoder):
             if self.early_stopping and hypo.score <= self.best_score:
                 break # admissible pruning
             posterior,score_breakdown = self.apply_predictors()
-            hypo.predictor_states = copy.deepcopy(self.get_predictor_states())
+            hypo.predictor_states = self.copy_predictor_states(
+                            self.get_predictor_states())
             hypos.append(hypo)
             posteriors.append(posterior)
             score_breakdowns.append(score_breakdown)
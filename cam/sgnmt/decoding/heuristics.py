@@ -3,13 +3,12 @@ estimated look ahead costs. The ``Heuristic`` super class is defined
 in the ``core`` module. 
 """
 
-import copy
 import logging
 
 from cam.sgnmt import utils
 from cam.sgnmt.decoding.core import Heuristic, Decoder
 from cam.sgnmt.decoding.greedy import GreedyDecoder
-from cam.sgnmt.misc.trie import SimpleTrie
+from cam.sgnmt.misc.cache import LRUCache
 from cam.sgnmt.misc.unigram import FileUnigramTable, BestStatsUnigramTable, \
     FullStatsUnigramTable, AllStatsUnigramTable
 from cam.sgnmt.utils import MESSAGE_TYPE_DEFAULT
@@ -56,8 +55,9 @@ class ScorePerWordHeuristic(Heuristic):
         as partial hypothesis score. Therefore, this method returns
         ``-score/length + score``
         """
-        if len(hypo.trgt_sentence) > 0:
-            return hypo.score - hypo.score/len(hypo.trgt_sentence)
+        length = hypo.get_length()
+        if length > 0:
+            return hypo.score - hypo.score/length
         return 0.0
     
     def initialize(self, src_sentence):
@@ -76,7 +76,8 @@ class LastTokenHeuristic(Heuristic):
     
     def estimate_future_cost(self, hypo):
         """Returns the negative score of the last token in hypo."""
-        return -Decoder.combi_arithmetic_unnormalized(hypo.score_breakdown[-1])
+        return -Decoder.combi_arithmetic_unnormalized(
+                hypo.get_last_score_breakdown())
     
     def initialize(self, src_sentence):
         """Empty method."""
@@ -88,7 +89,8 @@ class GreedyHeuristic(Heuristic):
     estimates. This is expensive but can lead to very close estimates.
     """
     
-    def __init__(self, decoder_args, cache_estimates = True):
+    def __init__(self, decoder_args, cache_estimates = True,
+                 max_cache_entries = 0):
         """Creates a new ``GreedyHeuristic`` instance. The greedy 
         heuristic performs full greedy decoding from the current
         state to get accurate cost estimates. However, this can be very
@@ -100,11 +102,13 @@ class GreedyHeuristic(Heuristic):
             cache_estimates (bool): Set to true to enable a cache for
                                     predictor states which have been
                                     visited during the greedy decoding.
+            max_cache_entries (int): Maximum number of cached estimates
+                                     per sentence, or 0 for no limit
         """
         super(GreedyHeuristic, self).__init__()
         self.cache_estimates = cache_estimates
         self.decoder = GreedyDecoder(decoder_args)
-        self.cache = SimpleTrie()
+        self.cache = LRUCache(max_entries=max_cache_entries)
         
     def set_predictors(self, predictors):
         """Override ``Decoder.set_predictors`` to redirect the 
@@ -115,7 +119,8 @@ class GreedyHeuristic(Heuristic):
     
     def initialize(self, src_sentence):
         """Initialize the cache. """
-        self.cache = SimpleTrie()
+        logging.debug("Greedy heuristic cache: %s" % self.cache.get_stats())
+        self.cache.clear()
     
     def estimate_future_cost(self, hypo):
         """Estimate the future cost by full greedy decoding. If
@@ -128,13 +133,15 @@ class GreedyHeuristic(Heuristic):
     
     def estimate_future_cost_with_cache(self, hypo):
         """Enabled cache... """
-        cached_cost = self.cache.get(hypo.trgt_sentence)
+        trgt_sentence = hypo.trgt_sentence
+        cached_cost = self.cache.get(trgt_sentence)
         if not cached_cost is None:
             return cached_cost
         old_states = self.decoder.get_predictor_states()
-        self.decoder.set_predictor_states(copy.deepcopy(old_states))
+        self.decoder.set_predictor_states(
+                        self.decoder.copy_predictor_states(old_states))
         # Greedy decoding
-        trgt_word = hypo.trgt_sentence[-1]
+        trgt_word = hypo.get_last_word()
         scores = []
         words = []
         while trgt_word != utils.EOS_ID:
@@ -145,7 +152,7 @@ class GreedyHeuristic(Heuristic):
             words.append(trgt_word)
         # Update cache using scores and words
         for i in xrange(1,len(scores)):
-            self.cache.add(hypo.trgt_sentence + words[:i], -sum(scores[i:]))
+            self.cache.add(trgt_sentence + words[:i], -sum(scores[i:]))
         # Reset predictor states
         self.decoder.set_predictor_states(old_states)
         return -sum(scores)
@@ -153,9 +160,10 @@ class GreedyHeuristic(Heuristic):
     def estimate_future_cost_without_cache(self, hypo):
         """Disabled cache... """
         old_states = self.decoder.get_predictor_states()
-        self.decoder.set_predictor_states(copy.deepcopy(old_states))
+        self.decoder.set_predictor_states(
+                        self.decoder.copy_predictor_states(old_states))
         # Greedy decoding
-        trgt_word = hypo.trgt_sentence[-1]
+        trgt_word = hypo.get_last_word()
         score = 0.0
         while trgt_word != utils.EOS_ID:
             self.decoder.consume(trgt_word)
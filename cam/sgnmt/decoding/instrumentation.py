@@ -0,0 +1,205 @@
+"""This module contains the instrumentation layer for decoders. A
+``DecoderInstrumentation`` instance records the number of calls and the
+wall time spent in the predictor methods and in the expensive helper
+methods of the ``Decoder`` (see ``Decoder.instrument()``). Statistics
+are collected for each sentence separately and aggregated over all
+sentences. Instrumentation is opt-in via --profile_decoder, the
+'profilecsv' and 'profilejson' outputs, or --profile_prometheus_file.
+If it is disabled, the decoder runs without any overhead.
+"""
+
+import logging
+import os
+import time
+
+
+PREDICTOR_METHODS = ['predict_next', 'predict_next_batch',
+                     'consume', 'consume_batch',
+                     'get_state', 'set_state',
+                     'get_unk_probability', 'is_equal']
+"""Predictor methods which are timed by the instrumentation. """
+
+
+DECODER_METHODS = [('_get_non_zero_words', 'get_non_zero_words'),
+                   ('combine_posteriors', 'combination'),
+                   ('apply_interpolation_strategy', 'interpolation'),
+                   ('apply_interpolation_strategy_batch', 
+                    'interpolation_batch'),
+                   ('copy_predictor_states', 'deepcopy')]
+"""Tuples (attribute, method name) of ``Decoder`` methods which are
+timed by the instrumentation.
+"""
+
+
+DECODER_COMPONENT = "decoder"
+"""Component name for the decoder methods in ``DECODER_METHODS``. """
+
+
+def merge_stats(stats, other_stats):
+    """Adds the counters in ``other_stats`` to ``stats``.
+
+    Args:
+        stats (dict): Statistics to update, in the format of
+                      ``DecoderInstrumentation.sentence_stats``
+        other_stats (dict): Statistics to add
+    """
+    for component, methods in other_stats.iteritems():
+        component_stats = stats.setdefault(component, {})
+        for method, (calls, secs) in methods.iteritems():
+            counters = component_stats.setdefault(method, [0, 0.0])
+            counters[0] += calls
+            counters[1] += secs
+
+
+def _escape_label(value):
+    """Escapes a label value for the Prometheus text format. """
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class DecoderInstrumentation(object):
+    """Collects call counts and wall times of decoder components.
+    Statistics are stored in nested dictionaries which map the
+    component name (predictor name or 'decoder') and the method name
+    to a list ``[calls, seconds]``.
+    """
+
+    def __init__(self):
+        """Creates an instrumentation object without statistics. """
+        self.sentence_stats = {}
+        self.total_stats = {}
+        self.n_sentences = 0
+
+    def add(self, component, method, secs):
+        """Records a single call.
+
+        Args:
+            component (string): Predictor name or 'decoder'
+            method (string): Method name
+            secs (float): Wall time of the call in seconds
+        """
+        component_stats = self.sentence_stats.get(component)
+        if component_stats is None:
+            component_stats = {}
+            self.sentence_stats[component] = component_stats
+        counters = component_stats.get(method)
+        if counters is None:
+            component_stats[method] = [1, secs]
+        else:
+            counters[0] += 1
+            counters[1] += secs
+
+    def instrument_method(self, obj, attr, component, method=None):
+        """Replaces the method ``attr`` of ``obj`` with a wrapper which
+        records the wall time of each call. The wrapper is stored as
+        instance attribute, so the class of ``obj`` and its
+        ``isinstance`` relations are not changed. Nested calls of
+        instrumented methods (e.g. ``get_state()`` inside 
+        ``consume()``) are counted for both methods.
+
+        Args:
+            obj (object): Object to instrument
+            attr (string): Name of the method
+            component (string): Component name for the statistics
+            method (string): Method name for the statistics. Defaults
+                             to ``attr``
+        """
+        fn = getattr(obj, attr, None)
+        if fn is None:
+            return
+        method = method or attr
+        add = self.add
+        def timed_fn(*args, **kwargs):
+            start_time = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                add(component, method, time.time() - start_time)
+        setattr(obj, attr, timed_fn)
+
+    def start_sentence(self):
+        """Resets the statistics for the current sentence. """
+        self.sentence_stats = {}
+
+    def finish_sentence(self, sentence_stats=None):
+        """Adds the statistics of the current sentence to the
+        aggregated statistics.
+
+        Args:
+            sentence_stats (dict): If not None, use these statistics
+                                   instead of the ones collected by
+                                   this instance. This is used to
+                                   collect statistics from worker
+                                   processes
+        """
+        if sentence_stats is not None:
+            self.sentence_stats = sentence_stats
+        merge_stats(self.total_stats, self.sentence_stats)
+        self.n_sentences += 1
+
+    def iter_stats(self, stats):
+        """Iterates through statistics in sorted order.
+
+        Args:
+            stats (dict): ``sentence_stats`` or ``total_stats``
+
+        Returns:
+            iterator. Tuples (component, method, calls, seconds)
+        """
+        for component in sorted(stats):
+            for method in sorted(stats[component]):
+                calls, secs = stats[component][method]
+                yield component, method, calls, secs
+
+    def log_summary(self):
+        """Logs the aggregated statistics, sorted by time. """
+        rows = sorted(self.iter_stats(self.total_stats),
+                      key=lambda row: -row[3])
+        logging.info("Decoder profile (%d sentences):" % self.n_sentences)
+        for component, method, calls, secs in rows:
+            logging.info("  %-20s %-20s %10d calls %10.3fs" % (
+                    component, method, calls, secs))
+
+    def get_prometheus_text(self, prefix="sgnmt_decoder"):
+        """Creates a dump of the aggregated statistics in the
+        Prometheus text exposition format.
+
+        Args:
+            prefix (string): Prefix for the metric names
+
+        Returns:
+            string. Prometheus metrics
+        """
+        lines = ["# HELP %s_sentences_total Number of decoded sentences."
+                     % prefix,
+                 "# TYPE %s_sentences_total counter" % prefix,
+                 "%s_sentences_total %d" % (prefix, self.n_sentences)]
+        for metric, idx, desc in [("calls", 0, "Number of calls"),
+                                  ("seconds", 1, "Wall time in seconds")]:
+            name = "%s_%s_total" % (prefix, metric)
+            lines.append("# HELP %s %s by component and method."
+                         % (name, desc))
+            lines.append("# TYPE %s counter" % name)
+            for component, method, calls, secs in self.iter_stats(
+                    self.total_stats):
+                lines.append('%s{component="%s",method="%s"} %r' % (
+                        name,
+                        _escape_label(component),
+                        _escape_label(method),
+                        (calls, secs)[idx]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Writes ``get_prometheus_text()`` to ``path``. The file is
+        replaced atomically, so it can be scraped at any time, e.g. by
+        the node exporter textfile collector.
+
+        Args:
+            path (string): Path to the metrics file
+
+        Raises:
+            IOError. If the file cannot be written
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.get_prometheus_text())
+        os.rename(tmp_path, path)
@@ -7,21 +7,95 @@ import numpy as np
 import logging
 from abc import abstractmethod
 
-try:
-    # This is the TF backend needed for MoE interpolation
-    import tensorflow as tf
-    from tensorflow.python.training import saver
-    from tensorflow.python.training import training
-    from tensorflow.contrib.training.python.training import hparam
-    # Requires sgnmt_moe
-    from sgnmt_moe.model import MOEModel
-except ImportError:
-    pass # Deal with it in decode.py
+
+def _import_moe_backend():
+    """Imports the TF backend needed for MoE interpolation. This is not
+    done at module level since this module is always loaded by the 
+    decoder core, but TensorFlow is only needed for MoE interpolation.
+    """
+    global tf, saver, training, hparam, MOEModel
+    try:
+        import tensorflow as tf
+        from tensorflow.python.training import saver
+        from tensorflow.python.training import training
+        from tensorflow.contrib.training.python.training import hparam
+        # Requires sgnmt_moe
+        from sgnmt_moe.model import MOEModel
+    except ImportError:
+        pass # Deal with it in decode.py
+
+
+def _fill_score_matrix(scores, posteriors, unk_probs):
+    """Fills a [n_predictors, vocab_size] score matrix with the 
+    predictor posteriors. Words which are not in a posterior get the
+    UNK probability of the predictor. Dict posteriors are scattered 
+    into the matrix with a single fancy indexing operation per row.
+
+    Args:
+        scores (array): Matrix to fill (modified in place)
+        posteriors (list): Predictor posteriors
+        unk_probs (list): UNK probabilities of the predictors
+    """
+    scores[:] = np.asarray(unk_probs, dtype=scores.dtype)[:, np.newaxis]
+    for row, posterior in enumerate(posteriors):
+        if isinstance(posterior, dict):
+            if posterior:
+                n_words = len(posterior)
+                words = np.fromiter(posterior.iterkeys(), dtype=np.int64,
+                                    count=n_words)
+                scores[row, words] = np.fromiter(posterior.itervalues(),
+                                                 dtype=scores.dtype,
+                                                 count=n_words)
+        else:
+            np.maximum(-99, posterior, out=scores[row, :len(posterior)])
 
 
 class InterpolationStrategy(object):
     """Base class for interpolation strategies."""
 
+    def __init__(self):
+        """Initializes the score matrix buffer. """
+        self._score_buffer = None
+
+    def _get_score_buffer(self, shape, dtype=np.float64):
+        """Returns a preallocated array of shape ``shape``. The buffer
+        is reused across calls and only reallocated if it does not fit
+        ``shape``. If only the first dimension is smaller than the
+        buffer, a view on the first rows is returned.
+
+        Args:
+            shape (tuple): Shape of the array
+            dtype (type): Data type of the array
+
+        Returns:
+            array. Uninitialized array of shape ``shape``
+        """
+        buf = self._score_buffer
+        if (buf is None or buf.dtype != dtype 
+                or buf.shape[1:] != shape[1:] or buf.shape[0] < shape[0]):
+            buf = np.empty(shape, dtype=dtype)
+            self._score_buffer = buf
+        return buf[:shape[0]]
+
+    def find_weights_batch(self, pred_weights, non_zero_words, posteriors,
+                           unk_probs):
+        """Batched version of ``find_weights()``. All arguments are 
+        lists with one entry for each hypothesis. The default 
+        implementation calls ``find_weights()`` for each entry.
+
+        Args:
+            pred_weights (list): A prior predictor weights
+            non_zero_words (list): Sets of words with positive 
+                                   probability
+            posteriors (list): Predictor posterior distributions
+            unk_probs (list): UNK probabilities of the predictors
+
+        Returns:
+            list. Predictor weights for each entry
+        """
+        return [self.find_weights(*args) for args in zip(
+                pred_weights, non_zero_words, posteriors, unk_probs)]
+
     @abstractmethod
     def find_weights(self, pred_weights, non_zero_words, posteriors, unk_probs):
         """Find interpolation weights for the current prediction.
@@ -74,6 +148,7 @@ class MoEInterpolationStrategy(InterpolationStrategy):
             args (object): SGNMT configuration object
         """
         super(MoEInterpolationStrategy, self).__init__()
+        _import_moe_backend()
         config = dict(el.split("=", 1) for el in args.moe_config.split(";"))
         self._single_cpu_thread = args.single_cpu_thread
         self._checkpoint_dir = args.moe_checkpoint_dir
@@ -84,6 +159,8 @@ class MoEInterpolationStrategy(InterpolationStrategy):
         with moe_graph.as_default() as g:
           self.model.initialize()
           self.sess = self._create_session()
+        # Fixed batch dimension of the expert score input, or None
+        self._max_batch_size = self.model.expert_scores.get_shape()[0].value
 
     def _create_hparams(self, num_experts, config):
         """Creates self.params."""
@@ -136,16 +213,17 @@ class MoEInterpolationStrategy(InterpolationStrategy):
             raise AttributeError("Could not initialize TF session for MoE.")
 
     def _create_score_matrix(self, posteriors, unk_probs):
-        scores = np.transpose(np.tile(np.array(unk_probs, dtype=np.float32),
-                                      (self.params.vocab_size, 1)))
-        # Scores has shape [n_predictors, vocab_size], fill it
-        for row, posterior in enumerate(posteriors):
-            if isinstance(posterior, dict):
-                for  w, s in posterior.iteritems():
-                    scores[row,int(w)] = s
-            else:
-                scores[row,:len(posterior)] = np.maximum(-99, posterior)
-        return np.expand_dims(scores, axis=0)
+        """Creates the [batch_size, n_predictors, vocab_size] input of 
+        the MoE network in the preallocated buffer.
+        """
+        scores = self._get_score_buffer((len(posteriors),
+                                         len(posteriors[0]),
+                                         self.params.vocab_size),
+                                        dtype=np.float32)
+        for row_scores, row_posteriors, row_unk_probs in zip(
+                scores, posteriors, unk_probs):
+            _fill_score_matrix(row_scores, row_posteriors, row_unk_probs)
+        return scores
 
     def find_weights(self, pred_weights, non_zero_words, posteriors, unk_probs):
         """Runs the MoE model to find interpolation weights.
@@ -164,10 +242,35 @@ class MoEInterpolationStrategy(InterpolationStrategy):
         Raises:
             ``NotImplementedError``: if the method is not implemented
         """
-        scores = self._create_score_matrix(posteriors, unk_probs)
-        weights = self.sess.run(self.model.weights, 
-                                feed_dict={self.model.expert_scores: scores})
-        return weights[0,:]
+        return self.find_weights_batch([pred_weights], [non_zero_words],
+                                       [posteriors], [unk_probs])[0]
+
+    def find_weights_batch(self, pred_weights, non_zero_words, posteriors,
+                           unk_probs):
+        """Runs the MoE model on all entries with a single 
+        ``sess.run`` call (or one call per chunk if the MoE network 
+        has a fixed batch size).
+
+        Args:
+            pred_weights (list): A prior predictor weights
+            non_zero_words (list): Sets of words with positive 
+                                   probability
+            posteriors (list): Predictor posterior distributions
+            unk_probs (list): UNK probabilities of the predictors
+
+        Returns:
+            list. Predictor weights for each entry
+        """
+        chunk_size = self._max_batch_size or len(posteriors)
+        weights = []
+        for start in xrange(0, len(posteriors), chunk_size):
+            end = start + chunk_size
+            scores = self._create_score_matrix(posteriors[start:end],
+                                               unk_probs[start:end])
+            weights.extend(self.sess.run(
+                self.model.weights, 
+                feed_dict={self.model.expert_scores: scores}))
+        return weights
 
 
 class EntropyInterpolationStrategy(InterpolationStrategy):
@@ -180,29 +283,23 @@ class EntropyInterpolationStrategy(InterpolationStrategy):
     """
 
     def __init__(self, vocab_size):
+        super(EntropyInterpolationStrategy, self).__init__()
         self.vocab_size = vocab_size
 
     def _create_score_matrix(self, posteriors, unk_probs):
-        scores = np.transpose(np.tile(np.array(unk_probs),
-                                      (self.vocab_size, 1)))
-        # Scores has shape [n_predictors, vocab_size], fill it
-        for row, posterior in enumerate(posteriors):
-            if isinstance(posterior, dict):
-                for  w, s in posterior.iteritems():
-                    scores[row,int(w)] = s
-            else:
-                scores[row,:len(posterior)] = np.maximum(-99, posterior)
+        """Creates the [n_predictors, vocab_size] score matrix in the 
+        preallocated buffer.
+        """
+        scores = self._get_score_buffer((len(posteriors), self.vocab_size))
+        _fill_score_matrix(scores, posteriors, unk_probs)
         return scores
 
     def find_weights(self, pred_weights, non_zero_words, posteriors, unk_probs):
         logprobs = self._create_score_matrix(posteriors, unk_probs)
         probs = np.exp(logprobs)
-        n_preds = len(pred_weights)
-        ents = np.zeros((n_preds, n_preds))
-        for p_idx in xrange(n_preds):
-            for q_idx in xrange(n_preds):
-                ents[p_idx,q_idx] = -np.sum(probs[p_idx] * logprobs[q_idx])
-                ents[p_idx,q_idx] *= pred_weights[p_idx]
+        # ents[p,q] = -pred_weights[p] * sum_w probs[p,w] * logprobs[q,w]
+        ents = -np.dot(probs, logprobs.T)
+        ents *= np.asarray(pred_weights, dtype=ents.dtype)[:, np.newaxis]
         ent_weights = -np.sum(ents, axis=0)
         ent_weights -= np.min(ent_weights)
         ent_weights /= np.sum(ent_weights)
@@ -3,23 +3,44 @@
 
 import logging
 import numpy as np
+from scipy import sparse
 
 from cam.sgnmt import utils
 from cam.sgnmt.decoding.beam import BeamDecoder
 from cam.sgnmt.misc.trie import SimpleTrie
 
 
-def is_sublist(needle, haystack):
-    """True if needle is a sublist of haystack, False otherwise.
-    Could be more efficient with Boyer-Moore-Horspool but our needles
-    are usually ngrams (ie. short), so this is a O(nm) implementation.
+def get_longest_repeated_suffix(sentence, max_length):
+    """Returns the length of the longest suffix of ``sentence`` which
+    also occurs in ``sentence[:-1]``. If a suffix occurs in 
+    ``sentence[:-1]``, all shorter suffixes do too, so this checks the
+    suffixes of all orders in a single pass over ``sentence``.
+    
+    Args:
+        sentence (list): Sequence of words
+        max_length (int): Do not look for suffixes longer than this
+    
+    Returns:
+        int. Length of the longest repeated suffix (at most 
+        ``max_length``), or 0 if the last word does not occur before
     """
-    ln = len(needle)
-    lh = len(haystack)
-    for pos in xrange(lh - ln + 1):
-        if needle == haystack[pos:pos+ln]:
-            return True
-    return False
+    l = len(sentence)
+    if l < 2:
+        return 0
+    last_word = sentence[-1]
+    best = 0
+    for end in xrange(l-2, -1, -1):
+        if sentence[end] != last_word:
+            continue
+        n = 1
+        while (n < max_length and n <= end 
+                and sentence[end-n] == sentence[l-1-n]):
+            n += 1
+        if n > best:
+            best = n
+            if best >= max_length:
+                break
+    return best
 
 
 class MBRBeamDecoder(BeamDecoder):
@@ -80,27 +101,83 @@ class MBRBeamDecoder(BeamDecoder):
         super(MBRBeamDecoder, self).__init__(decoder_args)
         self.maintain_best_scores = False # Does not work with MBR
 
-    def _compute_bleu(self, hyp_ngrams, ref_ngrams, hyp_length, ref_length):
-        """Not the exact BLEU score, we do filter out multiple matches for
-        the same ngram.
+    def _get_ngram_ids(self, sentences):
+        """Encodes the n-grams in ``sentences`` as integers. The n-gram
+        of order n starting at a position gets the id of the (n-1)-gram
+        at this position combined with the n-th word, densified with
+        ``np.unique``. Therefore, two n-grams have the same id iff they
+        consist of the same words. As in the original string-based 
+        implementation, n-grams which start near the end of the 
+        sentence are truncated (the missing words are padded).
+        
+        Args:
+            sentences (list): List of N word sequences
+        
+        Returns:
+            list. Tuples (order, ids, valid) for all orders between 
+            ``min_order`` and ``max_order``. ``ids`` is an integer
+            matrix of shape (N, max_len), ``valid`` a boolean mask 
+            which marks start positions inside the sentences.
         """
-        precisions = []
-        for hyp_ngrams_order, ref_ngrams_order in zip(hyp_ngrams, ref_ngrams):
-            if not hyp_ngrams_order:
-                continue
-            cnt = 0
-            for hyp_ngram in hyp_ngrams_order:
-                if hyp_ngram in ref_ngrams_order:
-                    cnt += 1
-            precisions.append(float(cnt) / float(len(hyp_ngrams_order)))
-        weight = 1.0 / float(len(precisions))
-        p = 1.0
-        for precision in precisions:
-            p *= precision ** weight
-        bp = 1.0
-        if hyp_length < ref_length:
-            bp = np.exp(1.0 - float(ref_length) / float(hyp_length))
-        return bp * p
+        lengths = np.array([len(s) for s in sentences])
+        max_len = max(1, np.max(lengths))
+        # Shift by one such that 0 can be used for padding
+        words = np.zeros((len(sentences), max_len + self.max_order), 
+                         dtype=np.int64)
+        for row, sentence in enumerate(sentences):
+            words[row, :len(sentence)] = sentence
+            words[row, :len(sentence)] += 1
+        base = np.max(words) + 1
+        valid = np.arange(max_len)[np.newaxis, :] < lengths[:, np.newaxis]
+        ids = np.zeros((len(sentences), max_len), dtype=np.int64)
+        ret = []
+        for order in xrange(1, self.max_order+1):
+            keys = ids * base + words[:, order-1:order-1+max_len]
+            _, ids = np.unique(keys, return_inverse=True)
+            ids = ids.reshape(keys.shape)
+            if order >= self.min_order:
+                ret.append((order, ids, valid))
+        return ret
+
+    def _compute_bleu_matrix(self, sentences):
+        """Computes the BLEU score of each sentence in ``sentences``
+        against each other sentence. Not the exact BLEU score, we do 
+        filter out multiple matches for the same ngram. For each 
+        order, the sets of n-grams are represented by a sparse binary
+        (N x n-grams) matrix, so the match counts for all pairs are
+        given by a single sparse matrix product.
+        
+        Args:
+            sentences (list): List of N word sequences
+        
+        Returns:
+            array. N x N matrix. Entry (i,j) is the BLEU score of 
+            hypothesis i with reference j
+        """
+        n_sens = len(sentences)
+        lengths = np.array([len(s) for s in sentences], dtype=np.float64)
+        ngram_ids = self._get_ngram_ids(sentences)
+        weight = 1.0 / float(len(ngram_ids))
+        bleus = np.ones((n_sens, n_sens))
+        for _, ids, valid in ngram_ids:
+            rows = np.nonzero(valid)[0]
+            cols = ids[valid]
+            occurrences = sparse.csr_matrix(
+                (np.ones(len(rows)), (rows, cols)),
+                shape=(n_sens, np.max(ids) + 1))
+            occurrences.sum_duplicates()
+            occurrences.data[:] = 1.0 # Count each n-gram only once
+            hyp_counts = np.asarray(occurrences.sum(axis=1)).ravel()
+            matches = occurrences.dot(occurrences.T).toarray()
+            bleus *= (matches / np.maximum(1.0, hyp_counts)[:, np.newaxis]
+                     ) ** weight
+        # Brevity penalty
+        hyp_lengths = np.maximum(1.0, lengths)[:, np.newaxis]
+        ref_lengths = lengths[np.newaxis, :]
+        bleus *= np.where(hyp_lengths < ref_lengths,
+                          np.exp(1.0 - ref_lengths / hyp_lengths),
+                          1.0)
+        return bleus
 
     def _get_next_hypos_maxent(self, hypos, scores):
         """Get hypotheses of the next time step.
@@ -115,19 +192,16 @@ class MBRBeamDecoder(BeamDecoder):
         # Update self.maxent_ngram_mass
         for hypo_score, hypo in zip(scores, hypos):
             s = hypo.trgt_sentence
-            h = s[:-1]
             l = len(s)
             if l <= self.maxent_processed_length:
                 continue
-            # TODO: Could be more efficient by checking is_sublist for
-            # all orders in one pass
-            for order in xrange(min(len(s), self.max_order), 
-                                self.min_order-1,
+            max_order = min(l, self.max_order)
+            # Do not use ngrams which occur before
+            repeated_order = get_longest_repeated_suffix(s, max_order)
+            for order in xrange(max_order, 
+                                max(repeated_order, self.min_order-1),
                                 -1):
                 ngram = s[-order:]
-                # Do not use this ngram if it occurs before
-                if is_sublist(ngram, h):
-                    break # All lower order ngrams are too
                 prev_mass = self.maxent_ngram_mass.get(ngram)
                 if prev_mass is None:
                     updated_mass = hypo_score
@@ -175,20 +249,8 @@ class MBRBeamDecoder(BeamDecoder):
         lengths = [len(hypo.trgt_sentence) for hypo in hypos]
         logging.debug("%d candidates min_length=%d max_length=%d" % 
             (len(lengths), min(lengths), max(lengths)))
-        ngrams = []
-        for hypo in hypos:
-            ngram_list = []
-            for order in xrange(self.min_order, self.max_order+1):
-                ngram_list.append(set([
-                    " ".join(map(str, hypo.trgt_sentence[start:start+order]))
-                    for start in xrange(len(hypo.trgt_sentence))]))
-            ngrams.append(ngram_list)
-        exp_bleus = []
-        for hyp_ngrams, hyp_length in zip(ngrams, lengths):
-            precisions = np.array([self._compute_bleu(
-                    hyp_ngrams, ref_ngrams, hyp_length, ref_length)
-                for ref_ngrams, ref_length in zip(ngrams, lengths)])
-            exp_bleus.append(precisions * probs)
+        exp_bleus = self._compute_bleu_matrix(
+            [hypo.trgt_sentence for hypo in hypos]) * probs[np.newaxis, :]
         next_hypos = []
         if self.selection_strategy == 'oracle_bleu': 
             for _ in xrange(min(self.beam_size, len(hypos))):
@@ -198,10 +260,7 @@ class MBRBeamDecoder(BeamDecoder):
                         % (scores[idx], bleu, hypos[idx].trgt_sentence))
                 hypos[idx].bleu = -bleu
                 next_hypos.append(hypos[idx])
-                gained_bleus = exp_bleus[idx]
-                for update_idx in xrange(len(exp_bleus)):
-                    exp_bleus[update_idx] = np.maximum(exp_bleus[update_idx], 
-                                                       gained_bleus)
+                exp_bleus = np.maximum(exp_bleus, exp_bleus[idx])
         else: # selection strategy 'bleu'
             total_exp_bleus = np.sum(exp_bleus, axis=1)
             for idx in utils.argmax_n(total_exp_bleus, self.beam_size):
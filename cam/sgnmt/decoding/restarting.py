@@ -1,6 +1,5 @@
 """Implementation of the restarting search strategy """
 
-import copy
 from heapq import heappop, heappush, heapify
 import logging
 
@@ -144,12 +143,12 @@ class RestartingDecoder(Decoder):
     def greedy_decode(self, hypo):
         """Helper function for greedy decoding from a certain point in
         the search tree."""
-        best_word = hypo.trgt_sentence[-1]
+        best_word = hypo.get_last_word()
         prev_hypo = hypo
         remaining_exps = max(self.max_expansions - self.apply_predictors_count,
                              1)
         while (best_word != utils.EOS_ID 
-               and len(prev_hypo.trgt_sentence) <= self.max_len):
+               and prev_hypo.get_length() <= self.max_len):
             self.consume(best_word)
             posterior,score_breakdown = self.apply_predictors()
             if len(posterior) < 1:
@@ -177,7 +176,7 @@ class RestartingDecoder(Decoder):
                                                best_word_score, 
                                                children[0].score)
                 if node_cost <= self.max_heap_node_cost:
-                    prev_hypo.predictor_states = copy.deepcopy(
+                    prev_hypo.predictor_states = self.copy_predictor_states(
                                                 self.get_predictor_states())
                     heappush(self.open_nodes, (node_cost,
                                                RestartingNode(prev_hypo,
@@ -231,7 +230,7 @@ class RestartingDecoder(Decoder):
                                                    best_child.score, 
                                                    node.children[0].score)
                     heappush(self.open_nodes, (node_cost, node))
-                    self.set_predictor_states(copy.deepcopy(
+                    self.set_predictor_states(self.copy_predictor_states(
                                                 node.hypo.predictor_states))
                 else: # No need to copy, don't put back to heap
                     self.set_predictor_states(node.hypo.predictor_states)
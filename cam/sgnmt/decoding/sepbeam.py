@@ -52,6 +52,12 @@ class SepBeamDecoder(BeamDecoder):
             ret.append(PartialHypothesis(pred_states))
         return ret
     
+    def has_batch_predictors(self):
+        """Hypotheses are expanded with only one predictor, so we never
+        use the batched predictor API in this decoder.
+        """
+        return False
+    
     def _expand_hypo(self, hypo):
         """Expands hypothesis by calling predict_next() only on one
         single predictor.
@@ -65,7 +71,10 @@ class SepBeamDecoder(BeamDecoder):
                 break
         self.apply_predictors_count += 1
         predictor = self.predictors[pred_idx][0]
-        predictor.set_state(copy.deepcopy(hypo.predictor_states[pred_idx]))
+        state = hypo.predictor_states[pred_idx]
+        if not predictor.has_persistent_state():
+            state = copy.deepcopy(state)
+        predictor.set_state(state)
         if not hypo.word_to_consume is None: # Consume if cheap expand
             predictor.consume(hypo.word_to_consume)
             hypo.word_to_consume = None
@@ -49,6 +49,29 @@ class SyncBeamDecoder(BeamDecoder):
                 return True
         return False
     
+    def _expand_open_hypos(self, hypos):
+        """Expands all hypotheses in ``hypos`` by a single token. This
+        uses the batched predictor API if possible.
+        
+        Args:
+            hypos (list): List of hypotheses which are not closed
+        
+        Returns:
+            list. For each entry in ``hypos`` the list of its child
+            hypotheses
+        """
+        if self.has_batch_predictors():
+            return super(SyncBeamDecoder, self)._expand_hypos_batch(hypos)
+        return [super(SyncBeamDecoder, self)._expand_hypo(h) for h in hypos]
+
+    def _expand_hypos_batch(self, hypos, top_n=None):
+        """Each hypothesis is expanded until all of its children are
+        closed, so we expand them one after another. The inner
+        expansions are batched in ``_expand_open_hypos``.
+        """
+        return [self._expand_hypo(h) 
+                if h.get_last_word() != utils.EOS_ID else [] for h in hypos]
+    
     def _expand_hypo(self, hypo):
         """Expand hypo until all of the beam size best hypotheses end 
         with ``sync_symb`` or EOS.
@@ -62,7 +85,7 @@ class SyncBeamDecoder(BeamDecoder):
         # Get initial expansions
         next_hypos = []
         next_scores = []
-        for next_hypo in super(SyncBeamDecoder, self)._expand_hypo(hypo):
+        for next_hypo in self._expand_open_hypos([hypo])[0]:
             next_hypos.append(next_hypo)
             next_scores.append(self._get_combined_score(next_hypo))
         hypos = self._get_next_hypos(next_hypos, next_scores)
@@ -75,12 +98,15 @@ class SyncBeamDecoder(BeamDecoder):
             it = it + 1
             next_hypos = []
             next_scores = []
+            open_hypos = [h for h in hypos if not self._is_closed(h)]
+            # Children are in the same order as the open hypos in hypos
+            all_children = iter(self._expand_open_hypos(open_hypos))
             for h in hypos:
                 if self._is_closed(h):
                     next_hypos.append(h)
                     next_scores.append(self._get_combined_score(h))
                     continue 
-                for next_hypo in super(SyncBeamDecoder, self)._expand_hypo(h):
+                for next_hypo in next(all_children):
                     next_hypos.append(next_hypo)
                     next_scores.append(self._get_combined_score(next_hypo))
             hypos = self._get_next_hypos(next_hypos, next_scores)
@@ -1,7 +1,6 @@
 """The syntax beam secoding strategy ensures diversity in the terminals."""
 
 
-import copy
 import logging
 import numpy as np
 
@@ -55,7 +54,8 @@ class SyntaxBeamDecoder(BeamDecoder):
                 continue
             valid = True
             if self.hypo_recombination:
-                self.set_predictor_states(copy.deepcopy(candidate.predictor_states))
+                self.set_predictor_states(self.copy_predictor_states(
+                                candidate.predictor_states))
                 if not candidate.word_to_consume is None:
                     self.consume(candidate.word_to_consume)
                     candidate.word_to_consume = None
@@ -0,0 +1,127 @@
+"""This module contains ``LRUCache``, a size-bounded cache for
+predictor posteriors and states which are indexed by target histories.
+In contrast to ``SimpleTrie``, the cache never grows beyond a fixed
+number of entries or a fixed memory budget, which makes it suitable
+for long-running decoding processes.
+"""
+
+from collections import OrderedDict
+import sys
+
+import numpy as np
+
+
+def estimate_size(obj):
+    """Estimates the memory consumption of ``obj`` in bytes. Numpy
+    arrays are counted with their buffer size, containers are traversed
+    recursively. For all other objects we use ``sys.getsizeof``.
+
+    Args:
+        obj (object): Object to estimate the size of
+
+    Returns:
+        int. Estimated size of ``obj`` in bytes
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v)
+                                        for k, v in obj.iteritems())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(estimate_size(el) for el in obj)
+    return sys.getsizeof(obj)
+
+
+class LRUCache(object):
+    """Cache which maps sequences of integers (e.g. target histories)
+    to arbitrary objects. If the number of entries or their estimated
+    memory consumption exceeds the limits, the least recently used
+    entries are evicted. The cache keeps track of hits and misses.
+    """
+
+    def __init__(self, max_entries=0, max_bytes=0):
+        """Creates an empty cache.
+
+        Args:
+            max_entries (int): Maximum number of entries. Set to 0 for
+                               no limit
+            max_bytes (int): Maximum estimated memory consumption of
+                             all stored elements in bytes. Set to 0 for
+                             no limit
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, seq):
+        """Retrieve the element for a key ``seq`` and mark it as
+        recently used. This does not modify the cache if ``seq`` is
+        not present.
+
+        Args:
+            seq (list): Query key
+
+        Returns:
+            object. The element which has been added along with ``seq``
+            or ``None`` if the key does not exist.
+        """
+        key = tuple(seq)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def add(self, seq, element):
+        """Add an element to the cache for the key ``seq``. If ``seq``
+        already exists, override. Evicts least recently used entries
+        if necessary.
+
+        Args:
+            seq (list): Key
+            element (object): The object to store for key ``seq``
+        """
+        key = tuple(seq)
+        old_entry = self.entries.pop(key, None)
+        if old_entry is not None:
+            self.n_bytes -= old_entry[1]
+        size = estimate_size(element) if self.max_bytes > 0 else 0
+        self.entries[key] = (element, size)
+        self.n_bytes += size
+        while self.entries and (
+                (self.max_entries > 0
+                        and len(self.entries) > self.max_entries)
+                or (self.max_bytes > 0 and self.n_bytes > self.max_bytes)):
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.n_bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """Removes all entries. The hit and miss counters are kept. """
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_stats(self):
+        """Get a string representation of the cache statistics.
+
+        Returns:
+            string. Number of entries, memory, hits, misses, and
+            evictions
+        """
+        total = self.hits + self.misses
+        return "entries=%d bytes=%d hits=%d misses=%d hit_rate=%.3f " \
+               "evictions=%d" % (len(self.entries),
+                                 self.n_bytes,
+                                 self.hits,
+                                 self.misses,
+                                 float(self.hits) / total if total else 0.0,
+                                 self.evictions)
@@ -12,6 +12,7 @@ import copy
 import logging
 import numpy as np
 import operator
+from scipy import sparse as sp
 
 
 def sparse_euclidean2(v1, v2):
@@ -214,6 +215,20 @@ class SparseFeatMap(object):
         """
         return self.sparse2nwords(self.dense2sparse(feat), n)
     
+    def dense2nwords_batch(self, feats, n=1):
+        """Batched version of ``dense2nwords``. The default 
+        implementation calls ``dense2nwords`` for each vector.
+        
+        Args:
+            feats (list): List or matrix of dense feature vectors
+            n (int): Number of words to retrieve for each vector
+        
+        Returns:
+            list: One list of (wordid, distance) tuples for each 
+                  vector in ``feats``
+        """
+        return [self.dense2nwords(feat, n) for feat in feats]
+    
     def dense2words(self, seq):
         """Applies ``dense2word`` to a sequence. """
         return [self.dense2word(w) for w in seq]
@@ -297,28 +312,105 @@ class TrivialSparseFeatMap(SparseFeatMap):
         return [(word, 1)]
     
     
+class MatrixFeatIndex(object):
+    """Nearest neighbor index for sparse feature vectors which stores
+    all vectors as rows of a CSR matrix. Squared Euclidean distances 
+    to a batch of query vectors are computed with a single sparse
+    matrix product using precomputed squared norms:
+    ``|q-w|^2 = |q|^2 - 2*q.w + |w|^2``. The k nearest neighbors are
+    then selected with ``argpartition``. In contrast to the trie, the
+    runtime does not depend on how close the query is to a stored
+    vector, and a whole beam can be looked up at once.
+    """
+    
+    def __init__(self, dim, elements):
+        """Builds the index.
+        
+        Args:
+            dim (int): Dimensionality of the feature space
+            elements (list): List of (sparse vector, element) pairs
+        """
+        self.elements = [el for _,el in elements]
+        rows = []
+        cols = []
+        vals = []
+        for row, (feat, _) in enumerate(elements):
+            for d,v in feat:
+                rows.append(row)
+                cols.append(d)
+                vals.append(v)
+        self.vecs = sp.csr_matrix((np.array(vals, dtype=np.float32), 
+                                   (rows, cols)),
+                                  shape=(len(elements), dim))
+        self.norms = np.asarray(
+                self.vecs.multiply(self.vecs).sum(axis=1)).ravel()
+    
+    def n_nearest(self, queries, n=1):
+        """Retrieves the n nearest elements for each query.
+        
+        Args:
+            queries (array): Matrix of dense query vectors (one row per
+                             query)
+            n (int): Number of elements to retrieve
+        
+        Returns:
+            list. One list of (element,dist) pairs sorted by the 
+            squared L2 distance for each row in ``queries``
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        dists = self.vecs.dot(queries.T).T # shape: [n_queries, n_elements]
+        dists *= -2.0
+        dists += self.norms[np.newaxis, :]
+        dists += np.sum(queries * queries, axis=1)[:, np.newaxis]
+        np.maximum(dists, 0.0, out=dists) # Rounding errors
+        n = min(n, dists.shape[1])
+        if n < dists.shape[1]:
+            best = np.argpartition(dists, n-1, axis=1)[:, :n]
+        else:
+            best = np.tile(np.arange(n), (dists.shape[0], 1))
+        ret = []
+        for row, row_best in enumerate(best):
+            row_dists = dists[row, row_best]
+            order = np.argsort(row_dists, kind='mergesort')
+            ret.append([(self.elements[row_best[idx]], row_dists[idx])
+                        for idx in order])
+        return ret
+
+
 class FileBasedFeatMap(SparseFeatMap):
     """This class loads the mapping from word to sparse feature from
     a file (see ``--src_sparse_feat_map`` and ``--trg_sparse_feat_map``)
     The mapping from word to feature is a simple dictionary lookup.
     
-    The mapping from feature to word is implemented with a Trie based
-    nearest neighbor implementation and does not require an exact
-    match. However, in case of an exact match, is runs linearly in the
-    number of non-zero entries in the vector.
+    The mapping from feature to word does not require an exact match.
+    It is implemented with one of the following nearest neighbor
+    indices (see ``--sparse_feat_map_lookup``):
+    
+    * 'trie': Trie based nearest neighbor search. In case of an exact
+              match, it runs linearly in the number of non-zero 
+              entries in the vector.
+    * 'matrix': ``MatrixFeatIndex`` which computes the distances to
+                all words with a sparse matrix product. Supports 
+                batched lookups (``dense2nwords_batch``).
     """
     
-    def __init__(self, dim, path):
+    def __init__(self, dim, path, lookup='trie'):
         """Loads the feature map from the file system.
         
         Args:
             dim (int). Dimensionality of the feature space
             path (string). Path to the mapping file
+            lookup (string). Nearest neighbor index: 'trie' or 'matrix'
         
         Raises:
             IOError. If the file could not be loaded
+            AttributeError. If ``lookup`` is unknown
         """
         super(FileBasedFeatMap, self).__init__(dim)
+        if not lookup in ['trie', 'matrix']:
+            raise AttributeError("Unknown sparse feat map lookup '%s'"
+                                 % lookup)
+        self.lookup = lookup
         self.f2w = None
         self.w2f = {}
         logging.info("Loading sparse feat map from %s" % path)
@@ -334,6 +426,9 @@ class FileBasedFeatMap(SparseFeatMap):
         logging.info("Loaded %d entries from %s" % (len(self.w2f), path))
 
     def _load_f2w(self):
+        if self.lookup == 'matrix':
+            self._load_f2w_matrix()
+            return
         logging.info("Building Trie with %d elements for sparse vector lookup"
                      % len(self.w2f))
         self.f2w = SimpleTrie()
@@ -345,16 +440,51 @@ class FileBasedFeatMap(SparseFeatMap):
             # in f2w
             self.f2w.add_sparse(f, w)
     
+    def _load_f2w_matrix(self):
+        logging.info("Building matrix with %d elements for sparse vector "
+                     "lookup" % len(self.w2f))
+        # Like in the trie, keep only the smallest word ID if vector
+        # representations clash
+        elements = []
+        seen_feats = set()
+        for w,f in sorted(self.w2f.items(), key=operator.itemgetter(0)):
+            key = tuple(f)
+            if not key in seen_feats:
+                seen_feats.add(key)
+                elements.append((f, w))
+        self.f2w = MatrixFeatIndex(self.dim, elements)
+    
     def sparse2word(self, feat):
         if not self.f2w:
             self._load_f2w()
+        if self.lookup == 'matrix':
+            return self.sparse2nwords(feat)[0][0]
         w,_ = self.f2w.nearest_sparse(feat)
         return w
     
     def sparse2nwords(self, feat, n=1):
         if not self.f2w:
             self._load_f2w()
+        if self.lookup == 'matrix':
+            return self.f2w.n_nearest(self.sparse2dense(feat), n)[0]
         return self.f2w.n_nearest_sparse(feat, n)
     
+    def dense2nwords(self, feat, n=1):
+        if self.lookup == 'matrix':
+            return self.dense2nwords_batch([feat], n)[0]
+        return super(FileBasedFeatMap, self).dense2nwords(feat, n)
+    
+    def dense2nwords_batch(self, feats, n=1):
+        """Looks up all vectors in ``feats`` with a single matrix
+        product if the lookup strategy is 'matrix'. Like 
+        ``dense2nwords``, entries smaller than 0.5 are ignored.
+        """
+        if self.lookup != 'matrix':
+            return super(FileBasedFeatMap, self).dense2nwords_batch(feats, n)
+        if not self.f2w:
+            self._load_f2w()
+        feats = np.asarray(feats, dtype=np.float32)
+        return self.f2w.n_nearest(np.where(feats > 0.5, feats, 0.0), n)
+    
     def word2sparse(self, word):
         return self.w2f.get(word, None)
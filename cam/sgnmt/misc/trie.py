@@ -2,7 +2,7 @@
 implementation based on strings of integers.
 """
 
-from operator import itemgetter
+from bisect import bisect_right
 
 class SimpleNode:
     """Helper class representing a node in a ``SimpleTrie`` """
@@ -44,6 +44,21 @@ class SimpleTrie:
             cur_node = children[token_id]
         return cur_node
     
+    def _find_node(self, seq):
+        """Get the ```SimpleNode``` for the given sequence ``seq``
+        without modifying the Trie.
+        
+        Returns:
+            SimpleNode. The node for ``seq`` or None if the path for
+            ``seq`` does not exist
+        """
+        cur_node = self.root
+        for token_id in seq:
+            cur_node = cur_node.edges.get(token_id)
+            if cur_node is None:
+                return None
+        return cur_node
+    
     def add(self, seq, element):
         """Add an element to the Trie for the key ``seq``. If ``seq`` 
         already exists, override.
@@ -64,7 +79,8 @@ class SimpleTrie:
             object. The element which has been added along with ``seq``
             or ``None`` if the key does not exist. 
         """
-        return self._get_node(seq).element
+        node = self._find_node(seq)
+        return None if node is None else node.element
     
     def get_prefix(self, seq):
         """Get the key in the Trie with the longest common prefix with
@@ -160,6 +176,7 @@ class SimpleTrie:
             return [self.nearest_sparse(query)]
         self.best_dist = float("inf")
         self.best_elements = [(None, self.best_dist)] # guardian element
+        self.best_dists = [self.best_dist]
         self.n = n
         self._register_best_element = self._register_best_element_multi
         self._nearest_sparse_recursive(self._sparse2seq(query), self.root, 0.0)
@@ -170,9 +187,17 @@ class SimpleTrie:
         self.best_element = el
         
     def _register_best_element_multi(self, dist, el):
-        self.best_elements = self.best_elements[:self.n-1] + [(el, dist)]
-        self.best_elements.sort(key=itemgetter(1))
-        self.best_dist = self.best_elements[-1][1] 
+        """Inserts ``el`` into the sorted list ``best_elements`` with 
+        binary search. ``best_dists`` holds the distances in 
+        ``best_elements`` as search keys.
+        """
+        if len(self.best_elements) >= self.n:
+            del self.best_elements[self.n-1:]
+            del self.best_dists[self.n-1:]
+        pos = bisect_right(self.best_dists, dist)
+        self.best_elements.insert(pos, (el, dist))
+        self.best_dists.insert(pos, dist)
+        self.best_dist = self.best_dists[-1]
             
     def _nearest_sparse_recursive(self, seq, root, dist):
         if dist > self.best_dist:
@@ -18,9 +18,18 @@ import logging
 from cam.sgnmt import utils
 import numpy as np
 import codecs
+import json
 from collections import defaultdict
 
 
+SYNC_MODES = ['none', 'flush', 'fsync']
+"""Modes for synchronizing incremental writes with the file system.
+'none' relies on the buffering of the file object, 'flush' flushes the
+Python buffers after each sentence, and 'fsync' additionally forces the
+operating system to write the data to the disk.
+"""
+
+
 def _mkdir(path, name):
     try:
         os.makedirs(path)
@@ -32,14 +41,122 @@ def _mkdir(path, name):
                          % (name, path))
 
 
+def _sync_file(f, sync_mode):
+    """Flushes and/or fsyncs the open file ``f`` according to 
+    ``sync_mode`` (one of ``SYNC_MODES``).
+    """
+    if sync_mode != 'none':
+        f.flush()
+        if sync_mode == 'fsync':
+            os.fsync(f.fileno())
+
+
+def _truncate_lines(path, keep_line_fn):
+    """Rewrites the file ``path`` such that it only contains lines for
+    which ``keep_line_fn`` returns true. Incomplete last lines (without
+    trailing newline) from aborted runs are always removed. The file is
+    replaced atomically.
+    
+    Args:
+        path (string): Path to the text file
+        keep_line_fn (function): Gets the line number and the line as
+                                 arguments and returns a boolean
+    """
+    tmp_path = path + ".tmp"
+    with codecs.open(path, encoding='utf-8') as f_in:
+        with codecs.open(tmp_path, "w", encoding='utf-8') as f_out:
+            for line_nr, line in enumerate(f_in):
+                if line.endswith("\n") and keep_line_fn(line_nr, line):
+                    f_out.write(line)
+    os.rename(tmp_path, path)
+
+
+def _read_lines(path):
+    """Returns all complete lines (with trailing newline) in ``path``.
+    """
+    with codecs.open(path, encoding='utf-8') as f:
+        return [line for line in f if line.endswith("\n")]
+
+
+def _replace_lines(path, lines):
+    """Atomically replaces the contents of ``path`` with ``lines``. """
+    tmp_path = path + ".tmp"
+    with codecs.open(tmp_path, "w", encoding='utf-8') as f:
+        f.write("".join(lines))
+    os.rename(tmp_path, path)
+
+
+def _read_sen_ids(path):
+    """Returns the sentence indices in the ID file ``path``, or an
+    empty list if the file does not exist. ID files are written next
+    to text and n-best outputs to mark sentences as finished.
+    """
+    if not os.path.isfile(path):
+        return []
+    return [int(line) for line in _read_lines(path)]
+
+
 class OutputHandler(object):
-    """Interface for output handlers. """
+    """Interface for output handlers. Output handlers can be used in
+    two ways. Either all hypotheses are passed through at once with 
+    ``write_hypos()``, or the output is written incrementally: 
+    ``open_file()`` is called once, then ``write_sentence()`` for 
+    each sentence as soon as it is decoded, and finally 
+    ``close_file()``. The incremental mode keeps memory usage 
+    independent of the number of sentences and makes it possible to
+    resume aborted runs.
+    """
     
     def __init__(self):
-        """ Empty constructor """
+        """Sets the sync mode to the default 'flush'. """
+        self.sync_mode = 'flush'
+    
+    def open_file(self, finished_sen_indices=None):
+        """Prepares incremental writing. If ``finished_sen_indices`` is
+        None, existing outputs are overwritten. Otherwise, we resume an
+        aborted run, i.e. outputs of the sentences in 
+        ``finished_sen_indices`` are kept and everything else from
+        previous runs is discarded.
+        
+        Args:
+            finished_sen_indices (set): Sentence indices (0-indexed)
+                                        whose outputs should be kept,
+                                        or None to start from scratch
+        """
         pass
     
     @abstractmethod
+    def write_sentence(self, sen_idx, hypos):
+        """Writes the n-best list of a single sentence. 
+        ``open_file()`` must have been called before.
+        
+        Args:
+            sen_idx (int): Sentence index (0-indexed)
+            hypos (list): n-best list of hypotheses
+        
+        Raises:
+            IOError. If something goes wrong while writing to the disk
+        """
+        raise NotImplementedError
+    
+    def close_file(self):
+        """Finishes incremental writing. """
+        pass
+    
+    def get_finished_sen_indices(self, sen_indices):
+        """Returns the sentences in ``sen_indices`` for which outputs
+        from previous runs are already present. This is used to resume
+        aborted runs.
+        
+        Args:
+            sen_indices (list): List of sentence indices (0-indexed)
+                                in the order in which they are decoded
+        
+        Returns:
+            set. Subset of ``sen_indices`` which are already finished
+        """
+        return set()
+    
     def write_hypos(self, all_hypos, sen_indices=None):
         """This method writes output files to the file system. The
         configuration parameters such as output paths should already
@@ -52,39 +169,154 @@ class OutputHandler(object):
         Raises:
             IOError. If something goes wrong while writing to the disk
         """
-        raise NotImplementedError
+        if sen_indices is None:
+            sen_indices = xrange(len(all_hypos))
+        self.open_file()
+        for sen_idx, hypos in zip(sen_indices, all_hypos):
+            self.write_sentence(sen_idx, hypos)
+        self.close_file()
+
+
+class _SentenceFileOutputHandler(OutputHandler):
+    """Base class for output handlers which create one file per 
+    sentence in a directory. Files are written to a temporary path 
+    first and then renamed, so that the presence of a file indicates
+    that the sentence has been completely written.
+    """
+    
+    def __init__(self, path, file_pattern, name):
+        """Creates a new output handler writing to the directory 
+        ``path``.
+        
+        Args:
+            path (string): Path to the directory to create
+            file_pattern (string): Pattern for file names with %d for
+                                   the sentence ID (1-indexed)
+            name (string): Name of the format for log messages
+        """
+        super(_SentenceFileOutputHandler, self).__init__()
+        self.path = path
+        self.file_pattern = file_pattern
+        self.name = name
+    
+    def open_file(self, finished_sen_indices=None):
+        """Creates the output directory.
+        
+        Raises:
+            OSError. If the directory could not be created
+        """
+        _mkdir(self.path, self.name)
+    
+    def get_finished_sen_indices(self, sen_indices):
+        """Sentences are finished if their file exists. """
+        return set(idx for idx in sen_indices 
+                   if os.path.isfile(self.file_pattern % (idx+1)))
+    
+    def _write_file(self, sen_idx, write_fn):
+        """Writes the file for ``sen_idx`` atomically.
+        
+        Args:
+            sen_idx (int): Sentence index (0-indexed)
+            write_fn (function): Gets a path as argument and writes
+                                 the sentence file to it
+        """
+        path = self.file_pattern % (sen_idx+1)
+        tmp_path = path + ".tmp"
+        write_fn(tmp_path)
+        if self.sync_mode == 'fsync':
+            fd = os.open(tmp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        os.rename(tmp_path, path)
 
 
 class TextOutputHandler(OutputHandler):
-    """Writes the first best hypotheses to a plain text file """
+    """Writes the first best hypotheses to a plain text file. The 
+    sentence index of each line is recorded in ``<path>.ids`` such
+    that aborted runs can be resumed even if some sentences failed and
+    did not produce a line.
+    """
     
     def __init__(self, path, trg_wmap):
         """Creates a plain text output handler to write to ``path`` """
         super(TextOutputHandler, self).__init__()
         self.path = path
+        self.ids_path = path + ".ids"
         self.trg_wmap = trg_wmap
+        self.f = None
+        self.f_ids = None
+        self.resumed = False
         
-    def write_hypos(self, all_hypos, sen_indices=None):
-        """Writes the hypotheses in ``all_hypos`` to ``path`` """
-        if self.f is not None:
-            for hypos in all_hypos:
-                self.f.write(utils.apply_trg_wmap(hypos[0].trgt_sentence,
-                                                  self.trg_wmap))
-                self.f.write("\n")
-                self.f.flush()
-        else:
-            with codecs.open(self.path, "w", encoding='utf-8') as f:
-                for hypos in all_hypos:
-                    f.write(utils.apply_trg_wmap(hypos[0].trgt_sentence,
-                                                 self.trg_wmap))
-                    f.write("\n")
-                    self.f.flush()
+    def write_sentence(self, sen_idx, hypos):
+        """Appends the first best hypothesis in ``hypos`` to ``path``
+        and ``sen_idx`` to ``<path>.ids``. The text line is synced 
+        first, so each complete entry in the ID file has a line in the
+        text file.
+        """
+        self.f.write(utils.apply_trg_wmap(hypos[0].trgt_sentence,
+                                          self.trg_wmap))
+        self.f.write("\n")
+        _sync_file(self.f, self.sync_mode)
+        self.f_ids.write("%d\n" % sen_idx)
+        _sync_file(self.f_ids, self.sync_mode)
 
-    def open_file(self):
-        self.f = codecs.open(self.path, "w", encoding='utf-8')
+    def _read_ids(self):
+        """Returns the sentence indices in ``<path>.ids`` in the order
+        of the lines in the text file.
+        """
+        if not os.path.isfile(self.path):
+            return []
+        return _read_sen_ids(self.ids_path)[:len(_read_lines(self.path))]
+
+    def get_finished_sen_indices(self, sen_indices):
+        """Sentences are finished if their index is in the ID file. """
+        return set(sen_indices) & set(self._read_ids())
+
+    def open_file(self, finished_sen_indices=None):
+        """Opens ``path`` for writing. When resuming, we keep the lines
+        of finished sentences.
+        """
+        self.resumed = finished_sen_indices is not None \
+                       and os.path.isfile(self.path)
+        if self.resumed:
+            keep = set(line_nr for line_nr, sen_idx 
+                       in enumerate(self._read_ids())
+                       if sen_idx in finished_sen_indices)
+            keep_line_fn = lambda line_nr, _: line_nr in keep
+            _truncate_lines(self.path, keep_line_fn)
+            if os.path.isfile(self.ids_path):
+                _truncate_lines(self.ids_path, keep_line_fn)
+            self.f = codecs.open(self.path, "a", encoding='utf-8')
+            self.f_ids = open(self.ids_path, "a")
+        else:
+            self.f = codecs.open(self.path, "w", encoding='utf-8')
+            self.f_ids = open(self.ids_path, "w")
 
     def close_file(self):
+        """Closes the files. If we resumed an aborted run, sentences
+        which were decoded in this run are appended after the kept 
+        ones, so we restore the sentence order.
+        """
         self.f.close()
+        self.f_ids.close()
+        self.f = None
+        self.f_ids = None
+        if self.resumed:
+            self._sort_lines()
+
+    def _sort_lines(self):
+        """Sorts the lines in the text file and the ID file by sentence
+        index. Both files are replaced atomically.
+        """
+        ids = self._read_ids()
+        if all(ids[i] <= ids[i+1] for i in xrange(len(ids) - 1)):
+            return
+        lines = _read_lines(self.path)
+        order = sorted(xrange(len(ids)), key=lambda i: ids[i])
+        _replace_lines(self.path, [lines[i] for i in order])
+        _replace_lines(self.ids_path, ["%d\n" % ids[i] for i in order])
 
 
 class NBestOutputHandler(OutputHandler):
@@ -92,7 +324,9 @@ class NBestOutputHandler(OutputHandler):
     entry is used to store the separated unnormalized predictor scores.
     Note that the sentence IDs are shifted: Moses n-best files start 
     with the index 0, but in SGNMT and HiFST we usually refer to the 
-    first sentence with 1 (e.g. in lattice directories or --range)
+    first sentence with 1 (e.g. in lattice directories or --range).
+    The index of each sentence is written to ``<path>.ids`` after its
+    complete n-best list, such that aborted runs can be resumed.
     """
     
     def __init__(self, path, predictor_names, trg_wmap):
@@ -107,7 +341,11 @@ class NBestOutputHandler(OutputHandler):
         """
         super(NBestOutputHandler, self).__init__()
         self.path = path
+        self.ids_path = path + ".ids"
         self.trg_wmap = trg_wmap
+        self.f = None
+        self.f_ids = None
+        self.resumed = False
         self.predictor_names = []
         name_count = {}
         for name in predictor_names:
@@ -118,27 +356,85 @@ class NBestOutputHandler(OutputHandler):
                 name_count[name] += 1
                 final_name = "%s%d" % (name, name_count[name])
             self.predictor_names.append(final_name.replace("_", "0"))
+
+    def _read_sen_idx(self, line):
+        """Returns the sentence index of an n-best entry. """
+        return int(line.split("|||", 1)[0])
         
-    def write_hypos(self, all_hypos, sen_indices):
-        """Writes the hypotheses in ``all_hypos`` to ``path`` """
-        with codecs.open(self.path, "w", encoding='utf-8') as f:
-            n_predictors = len(self.predictor_names)
-            for idx, hypos in zip(sen_indices, all_hypos):
-                for hypo in hypos:
-                    f.write("%d ||| %s ||| %s ||| %f" %
-                            (idx,
-                             utils.apply_trg_wmap(hypo.trgt_sentence,
-                                                  self.trg_wmap),
-                             ' '.join("%s= %f" % (
-                                  self.predictor_names[i],
-                                  sum([s[i][0] for s in hypo.score_breakdown]))
-                                      for i in xrange(n_predictors)),
-                             hypo.total_score))
-                    f.write("\n")
-                idx += 1
-
-
-class TimeCSVOutputHandler(OutputHandler):
+    def get_finished_sen_indices(self, sen_indices):
+        """Sentences are finished if their index is in the ID file. 
+        Sentences with incomplete n-best lists are not finished.
+        """
+        if not os.path.isfile(self.path):
+            return set()
+        return set(sen_indices) & set(_read_sen_ids(self.ids_path))
+
+    def open_file(self, finished_sen_indices=None):
+        """Opens ``path`` for writing. When resuming, entries of 
+        unfinished sentences are removed from the file.
+        """
+        self.resumed = finished_sen_indices is not None \
+                       and os.path.isfile(self.path)
+        if self.resumed:
+            _truncate_lines(self.path, lambda _, line: 
+                    self._read_sen_idx(line) in finished_sen_indices)
+            if os.path.isfile(self.ids_path):
+                _truncate_lines(self.ids_path, lambda _, line:
+                        int(line) in finished_sen_indices)
+            self.f = codecs.open(self.path, "a", encoding='utf-8')
+            self.f_ids = open(self.ids_path, "a")
+        else:
+            self.f = codecs.open(self.path, "w", encoding='utf-8')
+            self.f_ids = open(self.ids_path, "w")
+
+    def close_file(self):
+        """Closes the files. If we resumed an aborted run, we restore
+        the sentence order as in ``TextOutputHandler``.
+        """
+        self.f.close()
+        self.f_ids.close()
+        self.f = None
+        self.f_ids = None
+        if self.resumed:
+            self._sort_lines()
+
+    def _sort_lines(self):
+        """Sorts the entries in the n-best file and the ID file by 
+        sentence index. The order of the entries within an n-best list
+        is preserved. Both files are replaced atomically.
+        """
+        ids = _read_sen_ids(self.ids_path)
+        if all(ids[i] <= ids[i+1] for i in xrange(len(ids) - 1)):
+            return
+        lines = _read_lines(self.path)
+        lines.sort(key=self._read_sen_idx) # Stable
+        _replace_lines(self.path, lines)
+        _replace_lines(self.ids_path, ["%d\n" % i for i in sorted(ids)])
+        
+    def write_sentence(self, sen_idx, hypos):
+        """Appends the entries for ``hypos`` to ``path``. All entries
+        of the sentence are written with a single call. ``sen_idx`` is
+        appended to ``<path>.ids`` after the entries are synced.
+        """
+        n_predictors = len(self.predictor_names)
+        lines = []
+        for hypo in hypos:
+            lines.append("%d ||| %s ||| %s ||| %f\n" %
+                    (sen_idx,
+                     utils.apply_trg_wmap(hypo.trgt_sentence,
+                                          self.trg_wmap),
+                     ' '.join("%s= %f" % (
+                          self.predictor_names[i],
+                          sum([s[i][0] for s in hypo.score_breakdown]))
+                              for i in xrange(n_predictors)),
+                     hypo.total_score))
+        self.f.write("".join(lines))
+        _sync_file(self.f, self.sync_mode)
+        self.f_ids.write("%d\n" % sen_idx)
+        _sync_file(self.f_ids, self.sync_mode)
+
+
+class TimeCSVOutputHandler(_SentenceFileOutputHandler):
     """Produces one CSV file for each sentence. The CSV files contain
     the predictor score breakdown for each translation prefix length.
     """
@@ -152,9 +448,9 @@ class TimeCSVOutputHandler(OutputHandler):
                              should be included in the score breakdown
                              in the n-best list
         """
-        super(TimeCSVOutputHandler, self).__init__()
-        self.path = path
-        self.file_pattern = path + "/%d.csv" 
+        super(TimeCSVOutputHandler, self).__init__(path,
+                                                   path + "/%d.csv",
+                                                   "TimeCSV")
         self.predictor_names = []
         name_count = {}
         for name in predictor_names:
@@ -166,48 +462,47 @@ class TimeCSVOutputHandler(OutputHandler):
                 final_name = "%s%d" % (name, name_count[name])
             self.predictor_names.append(final_name)
         
-    def write_hypos(self, all_hypos, sen_indices):
-        """Writes ngram files for each sentence in ``all_hypos``.
+    def write_sentence(self, sen_idx, hypos):
+        """Writes the CSV file for a single sentence.
         
         Args:
-            all_hypos (list): list of nbest lists of hypotheses
-            sen_indices (list): List of sentence indices (0-indexed)
+            sen_idx (int): Sentence index (0-indexed)
+            hypos (list): n-best list of hypotheses
         
         Raises:
-            OSError. If the directory could not be created
             IOError. If something goes wrong while writing to the disk
         """
-        _mkdir(self.path, "TimeCSV")
+        self._write_file(sen_idx, lambda path: self._write_csv(path, hypos))
+
+    def _write_csv(self, path, hypos):
         n_predictors = len(self.predictor_names)
         placeholder = "\t-" * (n_predictors*2)
-        for sen_idx, hypos in zip(sen_indices, all_hypos):
-            sen_idx += 1
-            with open(self.file_pattern % sen_idx, "w") as f:
-                hypo_count = len(hypos)
-                # Headers
-                f.write("Time")
-                for i in xrange(hypo_count):
-                    f.write("".join(["\t%s-%d" % (n, i+1) 
-                                       for n in self.predictor_names]))
-                    f.write("".join(["\t%s-%d_weight" % (n, i+1) 
-                                       for n in self.predictor_names]))
+        with open(path, "w") as f:
+            hypo_count = len(hypos)
+            # Headers
+            f.write("Time")
+            for i in xrange(hypo_count):
+                f.write("".join(["\t%s-%d" % (n, i+1) 
+                                   for n in self.predictor_names]))
+                f.write("".join(["\t%s-%d_weight" % (n, i+1) 
+                                   for n in self.predictor_names]))
+            f.write("\n")
+            max_len = max([len(hypo.trgt_sentence) for hypo in hypos])
+            for pos in xrange(max_len+1):
+                f.write(str(pos))
+                for hypo in hypos:
+                    if pos >= len(hypo.score_breakdown):
+                        f.write(placeholder)
+                    else:
+                        for pred_idx in xrange(n_predictors):
+                            acc_pred_score = sum([s[pred_idx][0] for s in hypo.score_breakdown[:pos+1]])
+                            f.write("\t%f" % acc_pred_score)
+                        for pred_idx in xrange(n_predictors):
+                            f.write("\t%f" % hypo.score_breakdown[pos][pred_idx][1])
                 f.write("\n")
-                max_len = max([len(hypo.trgt_sentence) for hypo in hypos])
-                for pos in xrange(max_len+1):
-                    f.write(str(pos))
-                    for hypo in hypos:
-                        if pos >= len(hypo.score_breakdown):
-                            f.write(placeholder)
-                        else:
-                            for pred_idx in xrange(n_predictors):
-                                acc_pred_score = sum([s[pred_idx][0] for s in hypo.score_breakdown[:pos+1]])
-                                f.write("\t%f" % acc_pred_score)
-                            for pred_idx in xrange(n_predictors):
-                                f.write("\t%f" % hypo.score_breakdown[pos][pred_idx][1])
-                    f.write("\n")
-
-
-class NgramOutputHandler(OutputHandler):
+
+
+class NgramOutputHandler(_SentenceFileOutputHandler):
     """This output handler extracts MBR-style ngram posteriors from the 
     hypotheses returned by the decoder. The hypothesis scores are assumed to
     be loglikelihoods, which we renormalize to make sure that we operate on a
@@ -223,45 +518,43 @@ class NgramOutputHandler(OutputHandler):
             min_order (int):  Minimum order of extracted ngrams
             max_order (int):  Maximum order of extracted ngrams
         """
-        super(NgramOutputHandler, self).__init__()
-        self.path = path
+        super(NgramOutputHandler, self).__init__(path,
+                                                 path + "/%d.txt",
+                                                 "ngram")
         self.min_order = min_order
         self.max_order = max_order
-        self.file_pattern = path + "/%d.txt" 
       
-    def write_hypos(self, all_hypos, sen_indices):
-        """Writes ngram files for each sentence in ``all_hypos``.
+    def write_sentence(self, sen_idx, hypos):
+        """Writes the ngram file for a single sentence.
         
         Args:
-            all_hypos (list): list of nbest lists of hypotheses
-            sen_indices (list): List of sentence indices (0-indexed)
+            sen_idx (int): Sentence index (0-indexed)
+            hypos (list): n-best list of hypotheses
         
         Raises:
-            OSError. If the directory could not be created
             IOError. If something goes wrong while writing to the disk
         """
-        _mkdir(self.path, "ngram")
-        for sen_idx, hypos in zip(sen_indices, all_hypos):
-            sen_idx += 1
-            total = utils.log_sum([hypo.total_score for hypo in hypos])
-            normed_scores = [hypo.total_score - total for hypo in hypos]
-            ngrams = defaultdict(dict)
-            # Collect ngrams
-            for hypo_idx, hypo in enumerate(hypos):
-                sen_eos = [utils.GO_ID] + hypo.trgt_sentence + [utils.EOS_ID]
-                for pos in xrange(1, len(sen_eos) + 1):
-                    hist = sen_eos[:pos]
-                    for order in xrange(self.min_order, self.max_order + 1):
-                        ngram = ' '.join(map(str, hist[-order:]))
-                        ngrams[ngram][hypo_idx] = True
-            with open(self.file_pattern % sen_idx, "w") as f:
+        total = utils.log_sum([hypo.total_score for hypo in hypos])
+        normed_scores = [hypo.total_score - total for hypo in hypos]
+        ngrams = defaultdict(dict)
+        # Collect ngrams
+        for hypo_idx, hypo in enumerate(hypos):
+            sen_eos = [utils.GO_ID] + hypo.trgt_sentence + [utils.EOS_ID]
+            for pos in xrange(1, len(sen_eos) + 1):
+                hist = sen_eos[:pos]
+                for order in xrange(self.min_order, self.max_order + 1):
+                    ngram = ' '.join(map(str, hist[-order:]))
+                    ngrams[ngram][hypo_idx] = True
+        def write_fn(path):
+            with open(path, "w") as f:
                 for ngram, hypo_indices in ngrams.iteritems():
                     ngram_score = np.exp(utils.log_sum(
                        [normed_scores[hypo_idx] for hypo_idx in hypo_indices]))
                     f.write("%s : %f\n" % (ngram, min(1.0, ngram_score)))
+        self._write_file(sen_idx, write_fn)
 
 
-class FSTOutputHandler(OutputHandler):
+class FSTOutputHandler(_SentenceFileOutputHandler):
     """This output handler creates FSTs with with sparse tuple arcs 
     from the n-best lists from the decoder. The predictor scores are 
     kept separately in the sparse tuples. Note that this means that 
@@ -281,10 +574,8 @@ class FSTOutputHandler(OutputHandler):
             path (string):  Path to the VECLAT directory to create
             unk_id (int): Id which should be used in the FST for UNK
         """
-        super(FSTOutputHandler, self).__init__()
-        self.path = path
+        super(FSTOutputHandler, self).__init__(path, path + "/%d.fst", "FST")
         self.unk_id = unk_id
-        self.file_pattern = path + "/%d.fst" 
       
     def write_weight(self, score_breakdown):
         """Helper method to create the weight string """
@@ -296,53 +587,49 @@ class FSTOutputHandler(OutputHandler):
             els.append(str(-score[0]))
         return ','.join(els)
 
-    def write_hypos(self, all_hypos, sen_indices):
-        """Writes FST files with sparse tuples for each sentence in 
-        ``all_hypos``. The created lattices are not optimized in any
-        way: We create a distinct path for each entry in 
-        ``all_hypos``. We advise you to determinize/minimize them if 
-        you are planning to use them for further processing.
+    def write_sentence(self, sen_idx, hypos):
+        """Writes the FST file with sparse tuples for a single 
+        sentence. The created lattices are not optimized in any
+        way: We create a distinct path for each entry in ``hypos``. 
+        We advise you to determinize/minimize them if you are planning
+        to use them for further processing.
         
         Args:
-            all_hypos (list): list of nbest lists of hypotheses
-            sen_indices (list): List of sentence indices (0-indexed)
+            sen_idx (int): Sentence index (0-indexed)
+            hypos (list): n-best list of hypotheses
         
         Raises:
-            OSError. If the directory could not be created
             IOError. If something goes wrong while writing to the disk
         """
-        _mkdir(self.path, "FST")
-        for fst_idx, hypos in zip(sen_indices, all_hypos):
-            fst_idx += 1
-            c = fst.Compiler(arc_type="tropicalsparsetuple")
-            # state ID 0 is start, 1 is final state
-            next_free_id = 2
-            for hypo in hypos:
-                syms = hypo.trgt_sentence
-                # Connect with start node
-                c.write("0\t%d\t%d\t%d\n" % (next_free_id,
-                                             utils.GO_ID,
-                                             utils.GO_ID))
+        c = fst.Compiler(arc_type="tropicalsparsetuple")
+        # state ID 0 is start, 1 is final state
+        next_free_id = 2
+        for hypo in hypos:
+            syms = hypo.trgt_sentence
+            # Connect with start node
+            c.write("0\t%d\t%d\t%d\n" % (next_free_id,
+                                         utils.GO_ID,
+                                         utils.GO_ID))
+            next_free_id += 1
+            for pos in xrange(len(hypo.score_breakdown)-1):
+                c.write("%d\t%d\t%d\t%d\t%s\n" % (
+                        next_free_id-1, # last state id
+                        next_free_id, # next state id 
+                        syms[pos], syms[pos], # arc labels
+                        self.write_weight(hypo.score_breakdown[pos])))
                 next_free_id += 1
-                for pos in xrange(len(hypo.score_breakdown)-1):
-                    c.write("%d\t%d\t%d\t%d\t%s\n" % (
-                            next_free_id-1, # last state id
-                            next_free_id, # next state id 
-                            syms[pos], syms[pos], # arc labels
-                            self.write_weight(hypo.score_breakdown[pos])))
-                    next_free_id += 1
-                # Connect with final node
-                c.write("%d\t1\t%d\t%d\t%s\n" % (
-                                next_free_id-1,
-                                utils.EOS_ID,
-                                utils.EOS_ID,
-                                self.write_weight(hypo.score_breakdown[-1])))
-            c.write("1\n") # Add final node
-            f = c.compile()
-            f.write(self.file_pattern % fst_idx)
-
-
-class StandardFSTOutputHandler(OutputHandler):
+            # Connect with final node
+            c.write("%d\t1\t%d\t%d\t%s\n" % (
+                            next_free_id-1,
+                            utils.EOS_ID,
+                            utils.EOS_ID,
+                            self.write_weight(hypo.score_breakdown[-1])))
+        c.write("1\n") # Add final node
+        f = c.compile()
+        self._write_file(sen_idx, f.write)
+
+
+class StandardFSTOutputHandler(_SentenceFileOutputHandler):
     """This output handler creates FSTs with standard arcs. In contrast
     to ``FSTOutputHandler``, predictor scores are combined using 
     ``--combination_scheme``.
@@ -358,51 +645,133 @@ class StandardFSTOutputHandler(OutputHandler):
             path (string):  Path to the fst directory to create
             unk_id (int): Id which should be used in the FST for UNK
         """
-        super(StandardFSTOutputHandler, self).__init__()
-        self.path = path
+        super(StandardFSTOutputHandler, self).__init__(path,
+                                                       path + "/%d.fst",
+                                                       "FST")
         self.unk_id = unk_id
-        self.file_pattern = path + "/%d.fst" 
       
-    def write_hypos(self, all_hypos, sen_indices):
-        """Writes FST files with standard arcs for each
-        sentence in ``all_hypos``. The created lattices are not 
-        optimized in any way: We create a distinct path for each entry 
-        in ``all_hypos``. We advise you to determinize/minimize them if
-        you are planning to use them for further processing. 
+    def write_sentence(self, sen_idx, hypos):
+        """Writes the FST file with standard arcs for a single 
+        sentence. The created lattices are not optimized in any way:
+        We create a distinct path for each entry in ``hypos``. We 
+        advise you to determinize/minimize them if you are planning to
+        use them for further processing. 
         
         Args:
-            all_hypos (list): list of nbest lists of hypotheses
-            sen_indices (list): List of sentence indices (0-indexed)
+            sen_idx (int): Sentence index (0-indexed)
+            hypos (list): n-best list of hypotheses
         
         Raises:
-            OSError. If the directory could not be created
             IOError. If something goes wrong while writing to the disk
         """
-        _mkdir(self.path, "FST")
-        for fst_idx, hypos in zip(sen_indices, all_hypos):
-            fst_idx += 1
-            c = fst.Compiler()
-            # state ID 0 is start, 1 is final state
-            next_free_id = 2
-            for hypo in hypos:
-                # Connect with start node
-                c.write("0\t%d\t%d\t%d\t%f\n" % (next_free_id,
-                                                 utils.GO_ID,
-                                                 utils.GO_ID,
-                                                 -hypo.total_score))
+        c = fst.Compiler()
+        # state ID 0 is start, 1 is final state
+        next_free_id = 2
+        for hypo in hypos:
+            # Connect with start node
+            c.write("0\t%d\t%d\t%d\t%f\n" % (next_free_id,
+                                             utils.GO_ID,
+                                             utils.GO_ID,
+                                             -hypo.total_score))
+            next_free_id += 1
+            for sym in hypo.trgt_sentence:
+                c.write("%d\t%d\t%d\t%d\n" % (next_free_id-1,
+                                              next_free_id,
+                                              sym, sym))
                 next_free_id += 1
-                for sym in hypo.trgt_sentence:
-                    c.write("%d\t%d\t%d\t%d\n" % (next_free_id-1,
-                                                  next_free_id,
-                                                  sym, sym))
-                    next_free_id += 1
-                # Connect with final node
-                c.write("%d\t1\t%d\t%d\n" % (next_free_id-1,
-                                             utils.EOS_ID,
-                                             utils.EOS_ID))
-            c.write("1\n")
-            f = c.compile()
-            f.write(self.file_pattern % fst_idx)
+            # Connect with final node
+            c.write("%d\t1\t%d\t%d\n" % (next_free_id-1,
+                                         utils.EOS_ID,
+                                         utils.EOS_ID))
+        c.write("1\n")
+        f = c.compile()
+        self._write_file(sen_idx, f.write)
+
+
+class ProfileOutputHandler(OutputHandler):
+    """Writes the decoder instrumentation statistics (see 
+    ``cam.sgnmt.decoding.instrumentation``) of each sentence to a 
+    single file. The 'csv' format contains a header and one line for
+    each sentence, component, and method with the columns
+    ``sentence,component,method,calls,seconds``. The 'json' format 
+    contains one JSON object per sentence and line. In both formats, 
+    sentence IDs are 1-indexed, and the aggregated statistics over all
+    sentences are appended with the sentence ID 'total' when the file
+    is closed.
+    """
+    
+    def __init__(self, path, instrumentation, fmt):
+        """Creates a profile output handler.
+        
+        Args:
+            path (string): Path to the file to write
+            instrumentation (DecoderInstrumentation): Instrumentation
+                                    of the decoder
+            fmt (string): Output format, 'csv' or 'json'
+        """
+        super(ProfileOutputHandler, self).__init__()
+        self.path = path
+        self.instrumentation = instrumentation
+        self.fmt = fmt
+        self.f = None
+
+    def _read_sen_idx(self, line):
+        """Returns the sentence index (0-indexed) of a line, or None
+        for the header and the aggregated statistics.
+        """
+        try:
+            if self.fmt == 'json':
+                return int(json.loads(line)["sentence"]) - 1
+            return int(line.split(",", 1)[0]) - 1
+        except ValueError:
+            return None
+
+    def get_finished_sen_indices(self, sen_indices):
+        """Sentences are finished if they have an entry in the file. """
+        if not os.path.isfile(self.path):
+            return set()
+        present = set()
+        with open(self.path) as f:
+            for line in f:
+                if line.endswith("\n"):
+                    present.add(self._read_sen_idx(line))
+        return set(sen_indices) & present
+
+    def open_file(self, finished_sen_indices=None):
+        """Opens ``path`` for writing. When resuming, entries of 
+        unfinished sentences and the aggregated statistics of the 
+        previous run are removed from the file.
+        """
+        if finished_sen_indices is not None and os.path.isfile(self.path):
+            _truncate_lines(self.path, lambda line_nr, line: 
+                    (line_nr == 0 and self.fmt == 'csv')
+                    or self._read_sen_idx(line) in finished_sen_indices)
+            self.f = open(self.path, "a")
+        else:
+            self.f = open(self.path, "w")
+            if self.fmt == 'csv':
+                self.f.write("sentence,component,method,calls,seconds\n")
+
+    def close_file(self):
+        """Appends the aggregated statistics and closes the file. """
+        self._write_stats("total", self.instrumentation.total_stats)
+        self.f.close()
+        self.f = None
+
+    def write_sentence(self, sen_idx, hypos):
+        """Writes the statistics of the last decoded sentence. """
+        self._write_stats(sen_idx + 1, self.instrumentation.sentence_stats)
+
+    def _write_stats(self, sen_id, stats):
+        if self.fmt == 'json':
+            self.f.write("%s\n" % json.dumps({"sentence": sen_id,
+                                              "stats": stats},
+                                             sort_keys=True))
+        else:
+            self.f.write("".join(
+                    "%s,%s,%s,%d,%f\n" % ((sen_id,) + row) for row in 
+                    self.instrumentation.iter_stats(stats)))
+        _sync_file(self.f, self.sync_mode)
 
 
 class AlignmentOutputHandler(object):
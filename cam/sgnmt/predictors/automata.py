@@ -24,6 +24,7 @@ import sys
 from cam.sgnmt import utils
 from cam.sgnmt.predictors.core import Predictor
 from cam.sgnmt.utils import w2f, load_fst
+import numpy as np
 import pywrapfst as fst
 
 
@@ -31,6 +32,78 @@ EPS_ID = 0
 """OpenFST's reserved ID for epsilon arcs. """
 
 
+class NodeArcs(object):
+    """Outgoing arcs of a single FST node in array form. Arc weights
+    are converted to floats with ``w2f`` only once.
+    """
+    
+    def __init__(self, arcs):
+        """Creates the arrays for the given arcs.
+        
+        Args:
+            arcs (iterable): Outgoing arcs of the node
+        """
+        self.arcs = list(arcs)
+        self.labels = np.array([arc.olabel for arc in self.arcs], 
+                               dtype=np.int64)
+        self.weights = np.array([w2f(arc.weight) for arc in self.arcs],
+                                dtype=np.float64)
+        self.nextstates = np.array([arc.nextstate for arc in self.arcs],
+                                   dtype=np.int64)
+        self.label2arcs = {}
+        for idx, label in enumerate(self.labels.tolist()):
+            self.label2arcs.setdefault(label, []).append(idx)
+    
+    def get_arcs(self, label):
+        """Get the positions of all arcs labelled with ``label``.
+        
+        Args:
+            label (int): Output label
+        
+        Returns:
+            list. Positions of the arcs with ``label`` in the arrays
+        """
+        return self.label2arcs.get(label, [])
+    
+    def has_noneps(self):
+        """Returns true if this node has at least one non-epsilon arc.
+        """
+        return len(self.get_arcs(EPS_ID)) < len(self.arcs)
+
+
+class ArcIndex(object):
+    """Index for looking up outgoing arcs of an FST by node and label.
+    There is one index for each lattice. Nodes are indexed when they 
+    are accessed the first time, so that the index does not cost 
+    anything for nodes which are never reached during decoding. The
+    index is only valid as long as the FST is not modified.
+    """
+    
+    def __init__(self, f):
+        """Creates an empty index for ``f``.
+        
+        Args:
+            f (Fst): FST to index
+        """
+        self.fst = f
+        self.nodes = {}
+    
+    def get(self, node):
+        """Get the ``NodeArcs`` for ``node``.
+        
+        Args:
+            node (int): Node ID
+        
+        Returns:
+            NodeArcs. Outgoing arcs of ``node``
+        """
+        node_arcs = self.nodes.get(node)
+        if node_arcs is None:
+            node_arcs = NodeArcs(self.fst.arcs(node))
+            self.nodes[node] = node_arcs
+        return node_arcs
+
+
 class FstPredictor(Predictor):
     """This predictor can read determinized translation lattices. The
     predictor state consists of the current node. This is unique as the
@@ -93,8 +166,9 @@ class FstPredictor(Predictor):
         """
         if self.cur_node < 0:
             return {}
-        scores = {arc.olabel: self.weight_factor*w2f(arc.weight)
-                for arc in self.cur_fst.arcs(self.cur_node)}
+        node_arcs = self.arc_index.get(self.cur_node)
+        scores = dict(zip(node_arcs.labels.tolist(),
+                          (self.weight_factor*node_arcs.weights).tolist()))
         if utils.EOS_ID in scores and self.add_bos_to_eos_score:
             scores[utils.EOS_ID] += self.bos_score
         return self.finalize_posterior(scores,
@@ -107,8 +181,10 @@ class FstPredictor(Predictor):
         Args:
             src_sentence (list):  Not used
         """
-        self.cur_fst = load_fst(utils.get_path(self.fst_path,
-                                               self.current_sen_id+1))
+        self.cur_fst = load_fst(
+                utils.get_path(self.fst_path, self.current_sen_id+1),
+                utils.get_path(self.fst_path, self.current_sen_id+2))
+        self.arc_index = ArcIndex(self.cur_fst)
         self.cur_node = self.cur_fst.start() if self.cur_fst else None
         self.bos_score = self.consume(utils.GO_ID)
         if not self.bos_score: # Override None
@@ -136,12 +212,12 @@ class FstPredictor(Predictor):
         """
         if self.cur_node < 0:
             return
-        from_state = self.cur_node
+        node_arcs = self.arc_index.get(self.cur_node)
         self.cur_node = None
-        for arc in self.cur_fst.arcs(from_state):
-            if arc.olabel == word:
-                self.cur_node = arc.nextstate
-                return self.weight_factor*w2f(arc.weight)
+        arc_idxs = node_arcs.get_arcs(word)
+        if arc_idxs:
+            self.cur_node = int(node_arcs.nextstates[arc_idxs[0]])
+            return self.weight_factor*float(node_arcs.weights[arc_idxs[0]])
     
     def get_state(self):
         """Returns the current node. """
@@ -160,15 +236,23 @@ class FstPredictor(Predictor):
         use the shortest path in the fst as future cost estimator. """
         if not self.cur_node:
             return 0.0
-        last_word = hypo.trgt_sentence[-1]
-        for arc in self.cur_fst.arcs(self.cur_node):
-            if arc.olabel == last_word:
-                return w2f(self.distances[arc.nextstate])
+        node_arcs = self.arc_index.get(self.cur_node)
+        arc_idxs = node_arcs.get_arcs(hypo.get_last_word())
+        if arc_idxs:
+            return w2f(self.distances[int(node_arcs.nextstates[arc_idxs[0]])])
         return 0.0
     
     def is_equal(self, state1, state2):
         """Returns true if the current node is the same """
         return state1 == state2
+    
+    def get_recombination_key(self, state):
+        """The node ID is the key """
+        return state
+    
+    def has_persistent_state(self):
+        """The state is a node ID. """
+        return True
 
 
 class NondeterministicFstPredictor(Predictor):
@@ -235,14 +319,16 @@ class NondeterministicFstPredictor(Predictor):
         """
         scores = {}
         for weight,node in self.cur_nodes:
-            for arc in self.cur_fst.arcs(node): 
-                if arc.olabel != EPS_ID:
-                    score = weight + self.weight_factor*w2f(arc.weight) 
-                    if arc.olabel in scores:
-                        scores[arc.olabel] = self.score_max_func(
-                                        scores[arc.olabel], score)
+            node_arcs = self.arc_index.get(node)
+            node_scores = weight + self.weight_factor*node_arcs.weights
+            for label, score in zip(node_arcs.labels.tolist(), 
+                                    node_scores.tolist()):
+                if label != EPS_ID:
+                    if label in scores:
+                        scores[label] = self.score_max_func(scores[label],
+                                                            score)
                     else:
-                        scores[arc.olabel] = score 
+                        scores[label] = score
         return self.finalize_posterior(scores,
                 self.use_weights, self.normalize_scores)
     
@@ -253,8 +339,10 @@ class NondeterministicFstPredictor(Predictor):
         Args:
             src_sentence (list):  Not used
         """
-        self.cur_fst = load_fst(utils.get_path(self.fst_path,
-                                               self.current_sen_id+1))
+        self.cur_fst = load_fst(
+                utils.get_path(self.fst_path, self.current_sen_id+1),
+                utils.get_path(self.fst_path, self.current_sen_id+2))
+        self.arc_index = ArcIndex(self.cur_fst)
         self.cur_nodes = []
         if self.cur_fst:
             self.cur_nodes = self._follow_eps({self.cur_fst.start(): 0.0})
@@ -279,12 +367,13 @@ class NondeterministicFstPredictor(Predictor):
         d_unconsumed = {}
         # Collect distances to nodes reachable by word
         for weight,node in self.cur_nodes:
-            for arc in self.cur_fst.arcs(node):
-                if arc.olabel == word:
-                    next_node = arc.nextstate
-                    next_score = weight + self.weight_factor*w2f(arc.weight)
-                    if d_unconsumed.get(next_node, utils.NEG_INF) < next_score:
-                        d_unconsumed[next_node] = next_score
+            node_arcs = self.arc_index.get(node)
+            for arc_idx in node_arcs.get_arcs(word):
+                next_node = int(node_arcs.nextstates[arc_idx])
+                next_score = weight + self.weight_factor*float(
+                                                node_arcs.weights[arc_idx])
+                if d_unconsumed.get(next_node, utils.NEG_INF) < next_score:
+                    d_unconsumed[next_node] = next_score
         # Subtract the word score from the last predict_next 
         consumed_score = self.score_max_func(d_unconsumed.itervalues()) \
              if (word != utils.GO_ID or self.skip_bos_weight) else 0.0
@@ -307,17 +396,15 @@ class NondeterministicFstPredictor(Predictor):
         while open_nodes:
             next_open = {}
             for node,score in open_nodes.iteritems():
-                has_noneps = False
-                for arc in self.cur_fst.arcs(node):
-                    if arc.olabel == EPS_ID:
-                        next_node = arc.nextstate
-                        next_score = score + self.weight_factor*w2f(arc.weight)
-                        if visited.get(next_node, utils.NEG_INF) < next_score:
-                            visited[next_node] = next_score
-                            next_open[next_node] = next_score
-                    else:
-                        has_noneps = True
-                if has_noneps:
+                node_arcs = self.arc_index.get(node)
+                for arc_idx in node_arcs.get_arcs(EPS_ID):
+                    next_node = int(node_arcs.nextstates[arc_idx])
+                    next_score = score + self.weight_factor*float(
+                                                node_arcs.weights[arc_idx])
+                    if visited.get(next_node, utils.NEG_INF) < next_score:
+                        visited[next_node] = next_score
+                        next_open[next_node] = next_score
+                if node_arcs.has_noneps():
                     d[node] = score
             open_nodes = next_open
         return [(weight, node) for node, weight in d.iteritems()]
@@ -337,18 +424,27 @@ class NondeterministicFstPredictor(Predictor):
     def estimate_future_cost(self, hypo):
         """The FST predictor comes with its own heuristic function. We
         use the shortest path in the fst as future cost estimator. """
-        last_word = hypo.trgt_sentence[-1]
+        last_word = hypo.get_last_word()
         dists = []
-        for n in self.cur_nodes:
-            for arc in self.cur_fst[n].arcs:
-                if arc.olabel == last_word:
-                    dists.append(w2f(self.distances[arc.nextstate]))
-                    break
+        for _,n in self.cur_nodes:
+            node_arcs = self.arc_index.get(n)
+            arc_idxs = node_arcs.get_arcs(last_word)
+            if arc_idxs:
+                dists.append(w2f(self.distances[int(
+                                        node_arcs.nextstates[arc_idxs[0]])]))
         return 0.0 if not dists else min(dists)
     
     def is_equal(self, state1, state2):
         """Returns true if the current nodes are the same """
         return sorted([n for _,n in state1]) == sorted([n for _,n in state2])
+    
+    def get_recombination_key(self, state):
+        """The sorted list of current nodes is the key """
+        return tuple(sorted([n for _,n in state]))
+    
+    def has_persistent_state(self):
+        """``consume()`` creates a new list of current nodes. """
+        return True
 
 
 class RtnPredictor(Predictor):
@@ -454,6 +550,8 @@ class RtnPredictor(Predictor):
         finally:
             self.cur_history = []
             self.sub_fsts = {}
+            self.arc_index = ArcIndex(self.cur_fst)
+            self.cur_fst_optimized = False
         self.consume(utils.GO_ID)
     
     def expand_rtn(self, func):
@@ -469,7 +567,6 @@ class RtnPredictor(Predictor):
             updated = False
             label_fst_map = {}
             self.visited_nodes = {}
-            self.cur_fst.arcsort(sort_type="olabel")
             self.add_to_label_fst_map_recursive(label_fst_map,
                                                 {},
                                                 self.cur_fst.start(), 
@@ -486,13 +583,19 @@ class RtnPredictor(Predictor):
                             for (nt_label, f) in label_fst_map.iteritems()],
                         epsilon_on_replace=True)
                 self.cur_fst = replaced_fst
+                self.arc_index = ArcIndex(self.cur_fst)
+                self.cur_fst_optimized = False
                 updated = True
+        if self.cur_fst_optimized:
+            return # FST has not changed since last optimization
         if self.rmeps or self.minimize_rtns:
             self.cur_fst.rmepsilon()
         if self.minimize_rtns:
             tmp = fst.determinize(self.cur_fst.determinize)
             self.cur_fst = tmp
             self.cur_fst.minimize()
+        self.arc_index = ArcIndex(self.cur_fst)
+        self.cur_fst_optimized = True
     
     def add_to_label_fst_map_recursive(self, 
                                        label_fst_map, 
@@ -512,8 +615,16 @@ class RtnPredictor(Predictor):
             # this error should not be significant
             return
         visited_nodes[root_node] = True
-        for arc in self.cur_fst.arcs(root_node):
-            arc_acc_weight = acc_weight + self.weight_factor*w2f(arc.weight)
+        node_arcs = self.arc_index.get(root_node)
+        if history: # Only epsilon arcs and arcs with history[0] are relevant
+            arc_idxs = node_arcs.get_arcs(EPS_ID) \
+                       + node_arcs.get_arcs(history[0])
+        else:
+            arc_idxs = xrange(len(node_arcs.arcs))
+        for arc_idx in arc_idxs:
+            arc = node_arcs.arcs[arc_idx]
+            arc_acc_weight = acc_weight + self.weight_factor*float(
+                                                node_arcs.weights[arc_idx])
             if arc.olabel == EPS_ID: # Follow epsilon edges
                 self.add_to_label_fst_map_recursive(label_fst_map,
                                                     visited_nodes,
@@ -530,15 +641,13 @@ class RtnPredictor(Predictor):
                     arc.olabel = replace_label
                 else: # This is a regular arc and we have no history left
                     func(arc.nextstate, arc.olabel, arc_acc_weight) # apply func
-            elif arc.olabel == history[0]: # history is not empty
+            else: # history is not empty and arc.olabel == history[0]
                 self.add_to_label_fst_map_recursive(label_fst_map,
                                                     {},
                                                     arc.nextstate,
                                                     arc_acc_weight,
                                                     history[1:],
                                                     func)
-            elif arc.olabel > history[0]: # FST is arc sorted, we can stop here
-                break
         
     
     def is_nt_label(self, label):
@@ -585,7 +694,7 @@ class RtnPredictor(Predictor):
     
     def consume(self, word):
         """Adds ``word`` to the current history. """
-        self.cur_history.append(word)
+        self.cur_history = self.cur_history + [word]
     
     def get_state(self):
         """Returns the current history. """
@@ -594,4 +703,8 @@ class RtnPredictor(Predictor):
     def set_state(self, state):
         """Sets the current history. """
         self.cur_history = state
+    
+    def has_persistent_state(self):
+        """The history is replaced in ``consume()``. """
+        return True
 
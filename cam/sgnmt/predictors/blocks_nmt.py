@@ -10,6 +10,7 @@ original NMT decoding because search cannot be parallelized. However,
 it is much more flexible as it can be combined with other predictors.
 """
 
+from collections import OrderedDict
 import copy
 import logging
 
@@ -19,9 +20,10 @@ from cam.sgnmt import utils
 from cam.sgnmt.blocks.model  import LoadNMTUtils, NMTModel
 from cam.sgnmt.blocks.sparse_search import SparseBeamSearch
 from cam.sgnmt.misc import sparse
+from cam.sgnmt.misc.cache import LRUCache
 from cam.sgnmt.misc.sparse import FlatSparseFeatMap
-from cam.sgnmt.misc.trie import SimpleTrie
-from cam.sgnmt.predictors.core import Predictor, UnboundedVocabularyPredictor
+from cam.sgnmt.predictors.core import UnboundedVocabularyPredictor, \
+                                     BatchPredictor
 import numpy as np
 
 
@@ -50,16 +52,21 @@ class MyopticSparseSearch(SparseBeamSearch):
         super(MyopticSparseSearch, self).__init__(samples, trg_sparse_feat_map)
 
 
-class BlocksNMTPredictor(Predictor):
+class BlocksNMTPredictor(BatchPredictor):
     """This is the neural machine translation predictor. The predicted
     posteriors are equal to the distribution generated by the decoder
     network in NMT. This predictor heavily relies on the NMT example in
     blocks. Note that this predictor cannot be used in combination with
     a target side sparse feature map. See 
     ``BlocksUnboundedNMTPredictor`` for that case.
+    
+    This predictor supports the batched predictor API. In batch mode,
+    the decoder network runs on all hypotheses in the beam at once. The
+    posterior and state caches are not used in batch mode.
     """
     
-    def __init__(self, nmt_model_path, gnmt_beta, enable_cache, config):
+    def __init__(self, nmt_model_path, gnmt_beta, enable_cache, config,
+                 cache_max_entries=0, cache_max_bytes=0):
         """Creates a new NMT predictor.
         
         Args:
@@ -74,6 +81,11 @@ class BlocksNMTPredictor(Predictor):
                                   predictor states for hypotheses which
                                   differ only by NMT OOV words.
             config (dict): NMT configuration
+            cache_max_entries (int): Maximum number of entries in the
+                                     posterior and state caches (0 for
+                                     no limit)
+            cache_max_bytes (int): Memory cap for each of the caches
+                                   in bytes (0 for no limit)
         
         Raises:
             ValueError. If a target sparse feature map is defined
@@ -83,6 +95,8 @@ class BlocksNMTPredictor(Predictor):
         self.add_gnmt_coverage_term = gnmt_beta > 0.0
         self.config = copy.deepcopy(config)
         self.enable_cache = enable_cache
+        self.posterior_cache = LRUCache(cache_max_entries, cache_max_bytes)
+        self.states_cache = LRUCache(cache_max_entries, cache_max_bytes)
         self.set_up_predictor(nmt_model_path)
         self.src_eos = self.src_sparse_feat_map.word2dense(utils.EOS_ID)
     
@@ -121,8 +135,13 @@ class BlocksNMTPredictor(Predictor):
         """
         self.contexts = None
         self.states = None 
-        self.posterior_cache = SimpleTrie()
-        self.states_cache = SimpleTrie()
+        if self.enable_cache:
+            logging.debug("NMT posterior cache: %s" 
+                          % self.posterior_cache.get_stats())
+            logging.debug("NMT states cache: %s" 
+                          % self.states_cache.get_stats())
+        self.posterior_cache.clear()
+        self.states_cache.clear()
         self.consumed = []
         seq = self.src_sparse_feat_map.words2dense(
                     utils.oov_to_unk(src_sentence,
@@ -136,6 +155,7 @@ class BlocksNMTPredictor(Predictor):
         self.contexts, self.states, _ = self.search_algorithm.compute_initial_states_and_contexts(
             input_values)
         self.attention_records = (1 + len(src_sentence)) * [0.0]
+        self.batch_contexts = {}
     
     def is_history_cachable(self):
         """Returns true if cache is enabled and history contains UNK """
@@ -169,14 +189,17 @@ class BlocksNMTPredictor(Predictor):
             self.posterior_cache.add(self.consumed, posterior)
         return self._add_gnmt_beta(posterior)
     
-    def _add_gnmt_beta(self, posterior):
+    def _add_gnmt_beta(self, posterior, attention_records=None):
         """Adds the GNMT coverage penalization term to EOS in 
-        ``posterior``
+        ``posterior``. If ``attention_records`` is not set, use the
+        attention records of the current predictor state.
         """
+        if attention_records is None:
+            attention_records = self.attention_records
         if self.add_gnmt_coverage_term:
             posterior[utils.EOS_ID] += self.gnmt_beta * sum([np.log(max(0.0001,
                                                                         p)) 
-                                for p in self.attention_records if p < 1.0])
+                                for p in attention_records if p < 1.0])
         return posterior
         
     def get_unk_probability(self, posterior):
@@ -190,7 +213,7 @@ class BlocksNMTPredictor(Predictor):
         """
         if word >= self.trgt_vocab_size:
             word = utils.UNK_ID
-        self.consumed.append(word)
+        self.consumed = self.consumed + [word]
         use_cache = self.is_history_cachable()
         if use_cache:
             s = self.states_cache.get(self.consumed)
@@ -199,13 +222,88 @@ class BlocksNMTPredictor(Predictor):
                                     self.consumed)
                 self.states = copy.deepcopy(s)
                 return
+        self.states = OrderedDict(self.states)
         self.states.update(self.search_algorithm.compute_next_states(
                 self.contexts, self.states, [word]))
         if use_cache:
             self.states_cache.add(self.consumed, copy.deepcopy(self.states))
         if self.add_gnmt_coverage_term: # Keep track of attentions
-            for pos,att in enumerate(self.states['weights'][0]):
-                self.attention_records[pos] += att
+            self.attention_records = [rec + att for rec, att in zip(
+                                                self.attention_records,
+                                                self.states['weights'][0])]
+    
+    def _get_batch_contexts(self, batch_size):
+        """Returns the source annotations tiled to ``batch_size``. The
+        batch axis of all contexts (attended and attended_mask) is the
+        second one. Tiled contexts are reused until ``initialize()``
+        is called again.
+        """
+        if not batch_size in self.batch_contexts:
+            self.batch_contexts[batch_size] = OrderedDict(
+                    (var, np.repeat(val, batch_size, axis=1))
+                    for var, val in self.contexts.iteritems())
+        return self.batch_contexts[batch_size]
+    
+    def _stack_decoder_states(self, states):
+        """Concatenates the decoder network states in the predictor
+        states ``states`` along the batch axis.
+        """
+        dec_states = [s[0] for s in states]
+        return OrderedDict((name, np.concatenate([d[name] 
+                                                  for d in dec_states]))
+                           for name in dec_states[0])
+    
+    def predict_next_batch(self, states):
+        """Runs the decoder network once for all ``states``.
+        
+        Args:
+            states (list): List of predictor states
+        
+        Returns:
+            list. Full distributions over the NMT vocabulary for each
+            entry in ``states``
+        """
+        logprobs = self.search_algorithm.compute_logprobs(
+                self._get_batch_contexts(len(states)),
+                self._stack_decoder_states(states))
+        posteriors = np.multiply(logprobs, -1.0)
+        if not self.add_gnmt_coverage_term:
+            return posteriors
+        return [self._add_gnmt_beta(posterior, attention_records)
+                for posterior, (_, _, attention_records) in zip(posteriors,
+                                                                states)]
+    
+    def consume_batch(self, states, words):
+        """Feeds back ``words`` to the decoder network in a single
+        batch. The states in ``states`` are not modified.
+        
+        Args:
+            states (list): List of predictor states
+            words (list): Words to consume
+        
+        Returns:
+            list. New predictor states
+        """
+        words = [w if w < self.trgt_vocab_size else utils.UNK_ID 
+                 for w in words]
+        next_states = self.search_algorithm.compute_next_states(
+                self._get_batch_contexts(len(states)),
+                self._stack_decoder_states(states),
+                words)
+        new_states = []
+        for row, (dec_states, consumed, attention_records) in enumerate(
+                                                                    states):
+            new_dec_states = OrderedDict(dec_states)
+            for name, val in next_states.iteritems():
+                new_dec_states[name] = val[row:row+1]
+            if self.add_gnmt_coverage_term: # Keep track of attentions
+                attention_records = [rec + att for rec, att in zip(
+                                                 attention_records,
+                                                 new_dec_states['weights'][0])]
+            new_states.append((new_dec_states,
+                               consumed + [words[row]],
+                               attention_records))
+        return new_states
     
     def get_state(self):
         """The NMT predictor state consists of the decoder network 
@@ -223,6 +321,12 @@ class BlocksNMTPredictor(Predictor):
         _,consumed2,_ = state2
         return consumed1 == consumed2
     
+    def has_persistent_state(self):
+        """``consume()`` creates new state objects instead of updating
+        them in place.
+        """
+        return True
+    
 
 class BlocksUnboundedNMTPredictor(BlocksNMTPredictor,
                                   UnboundedVocabularyPredictor):
@@ -303,7 +407,8 @@ class BlocksUnboundedNMTPredictor(BlocksNMTPredictor,
         """
         if word >= self.trgt_vocab_size:
             word = utils.UNK_ID
-        self.consumed.append(word)
+        self.consumed = self.consumed + [word]
+        self.states = OrderedDict(self.states)
         self.states.update(self.search_algorithm.compute_next_states(
                                 self.contexts,
                                 self.states,
@@ -148,6 +148,7 @@ class BagOfWordsPredictor(Predictor):
         if not word in self.bag:
             logging.warn("Consuming word which is not in bag-of-words!")
             return
+        self.bag = dict(self.bag)
         cnt = self.bag.pop(word)
         if cnt > 1 and not self.accept_duplicates:
             self.bag[word] = cnt - 1
@@ -159,6 +160,10 @@ class BagOfWordsPredictor(Predictor):
     def set_state(self, state):
         """State of this predictor is the current bag """
         self.bag = state
+    
+    def has_persistent_state(self):
+        """The bag is copied in ``consume()`` before it is modified. """
+        return True
 
     def initialize_heuristic(self, src_sentence):
         """Calls ``reset`` of the used unigram table with estimates
@@ -230,6 +235,10 @@ class BagOfWordsPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Returns true if the bag is the same """
         return self._get_unk_bag(state1) == self._get_unk_bag(state2) 
+    
+    def get_recombination_key(self, state):
+        """The bag signature is the key """
+        return frozenset(self._get_unk_bag(state).iteritems())
 
 
 class BagOfWordsSearchPredictor(BagOfWordsPredictor):
@@ -389,6 +398,7 @@ class BagOfWordsSearchPredictor(BagOfWordsPredictor):
                  and word == self.skeleton[self.skeleton_pos]):
             self.skeleton_pos += 1
         elif word in self.missing:
+            self.missing = dict(self.missing)
             self.missing[word] -= 1
             if self.missing[word] <= 0:
                 del self.missing[word]
@@ -417,4 +427,12 @@ class BagOfWordsSearchPredictor(BagOfWordsPredictor):
                                                                    state2)
         return super(BagOfWordsSearchPredictor, self).is_equal(state1[0], 
                                                                state2[0])
+    
+    def get_recombination_key(self, state):
+        """The bag signature is the key """
+        if self.pre_mode:
+            return super(BagOfWordsSearchPredictor, 
+                         self).get_recombination_key(state)
+        return super(BagOfWordsSearchPredictor, 
+                     self).get_recombination_key(state[0])
         
@@ -83,7 +83,9 @@ class Predictor(Observer):
         ``get_state()``. Note that this does not copy the argument but
         just references the given state. If ``state`` is going to be
         used in the future to return to that point again, you should
-        copy the state with ``copy.deepcopy()`` before.
+        copy the state with ``copy.deepcopy()`` before unless the 
+        predictor has a persistent state (see 
+        ``has_persistent_state()``).
         
         Args:
            state (object): Predictor state as returned by 
@@ -91,6 +93,20 @@ class Predictor(Observer):
         """
         raise NotImplementedError
     
+    def has_persistent_state(self):
+        """Returns true if the predictor state is persistent, i.e. the
+        objects returned by ``get_state()`` are never changed in place.
+        Predictors with persistent states replace their state objects
+        in ``predict_next()`` and ``consume()`` rather than modifying
+        them. Therefore, decoders can share persistent states between
+        hypotheses without copying them. Otherwise, decoders fall back
+        to ``copy.deepcopy()``.
+        
+        Returns:
+            bool. True if states do not need to be copied
+        """
+        return False
+    
     def estimate_future_cost(self, hypo):
         """Predictors can implement their own look-ahead cost functions.
         They are used in A* if the --heuristics parameter is set to 
@@ -185,6 +201,25 @@ class Predictor(Observer):
         """
         return False
     
+    def get_recombination_key(self, state):
+        """Returns a hashable key for ``state`` which can be used for
+        hypothesis recombination instead of ``is_equal()``. If keys 
+        are implemented, two keys must be equal if and only if 
+        ``is_equal()`` returns true for the corresponding states. This
+        allows decoders to find equal states with a dictionary lookup
+        rather than pairwise comparisons (see 
+        ``Decoder.create_recombination_index()``).
+        
+        Args:
+            state (object): Predictor state
+        
+        Returns:
+            object. Hashable key, or None if this predictor does not
+            support recombination keys. In this case, decoders fall
+            back to ``is_equal()``
+        """
+        return None
+    
     def notify(self, message, message_type = MESSAGE_TYPE_DEFAULT):
         """We implement the ``notify`` method from the ``Observer``
         super class with an empty method here s.t. predictors do not
@@ -233,3 +268,60 @@ class UnboundedVocabularyPredictor(Predictor):
             does not have to score all of them
         """
         raise NotImplementedError
+
+
+class BatchPredictor(Predictor):
+    """Predictors under this class can score several predictor states
+    at once. This is useful for neural predictors which are much more 
+    efficient when the decoder network runs on a batch of histories 
+    rather than on a single one. Decoders like ``BeamDecoder`` use the
+    batched methods if all predictors are instances of this class.
+    
+    In contrast to ``predict_next()`` and ``consume()``, the batched
+    methods do not operate on the internal predictor state. Instead,
+    states are passed through explicitly and must be treated as 
+    immutable, i.e. ``consume_batch()`` returns new state objects and
+    must not change the states in its argument. This makes it possible
+    for the decoder to share states between hypotheses without copying
+    them. The batched methods are only used with bounded vocabulary
+    predictors. Note that ``get_unk_probability()`` is called without
+    loading the corresponding state first, so it must only depend on 
+    its ``posterior`` argument.
+    """
+
+    def __init__(self):
+        """ Initializes ``current_sen_id`` with 0. """
+        super(BatchPredictor, self).__init__()
+
+    @abstractmethod
+    def predict_next_batch(self, states):
+        """Batched version of ``predict_next()``. Computes the 
+        posteriors for all predictor states in ``states``. This method
+        must not change any of the states.
+        
+        Args:
+            states (list): List of predictor states as returned by
+                           ``get_state()`` or ``consume_batch()``
+        
+        Returns:
+            list,array. Posteriors for each entry in ``states``. This 
+            can be a list of dictionaries, arrays, or lists, or a 2D
+            array with one row for each state.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def consume_batch(self, states, words):
+        """Batched version of ``consume()``. Expands the histories in
+        ``states`` by the corresponding entries in ``words``.
+        
+        Args:
+            states (list): List of predictor states
+            words (list): List of words to consume, one for each entry
+                          in ``states``
+        
+        Returns:
+            list. New predictor states. The states in ``states`` are 
+            not modified.
+        """
+        raise NotImplementedError
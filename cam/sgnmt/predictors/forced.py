@@ -7,6 +7,7 @@ multiple references in form of a n-best list (forcedlst
 import logging
 
 from cam.sgnmt import utils
+from cam.sgnmt.misc.trie import SimpleTrie
 from cam.sgnmt.predictors.core import Predictor
 from cam.sgnmt.utils import NEG_INF
 
@@ -92,6 +93,11 @@ class ForcedPredictor(Predictor):
         n1,s1 = state1
         n2,s2 = state2
         return n1 == n2 and s1 == s2
+    
+    def has_persistent_state(self):
+        """The target sentence is replaced, not modified on mismatch. 
+        """
+        return True
 
 
 class ForcedLstPredictor(Predictor):
@@ -105,11 +111,16 @@ class ForcedLstPredictor(Predictor):
     Second column: Hypothesis in integer format
     Last column: score
     
+    The n-best list entries for each sentence are stored in a 
+    ``SimpleTrie``. The predictor state is the tuple of trie nodes which
+    match the current history. Without ``match_unk`` this tuple 
+    contains at most one node. With ``match_unk``, UNK edges in the 
+    trie act as wildcards, so multiple nodes can match the history.
+    The elements stored at the trie nodes are tuples (entry_idx, score)
+    where entry_idx is the position of the entry in the n-best list.
+    
     Note: Behavior is undefined if you have duplicates in the n-best
     list
-    
-    TODO: Would be much more efficient to use Tries for 
-    cur_trgt_sentences instead of a flat list.
     """
     
     def __init__(self, 
@@ -137,6 +148,7 @@ class ForcedLstPredictor(Predictor):
         self.trg_sentences = []
         self.match_unk = match_unk
         score = 0.0
+        entry_idx = 0
         with open(trg_test_file) as f:
             for line in f:
                 parts = line.split("|||")
@@ -149,13 +161,14 @@ class ForcedLstPredictor(Predictor):
                         score = self._get_score(parts, feat_name)
                     sen_id = int(parts[0].strip())
                     while len(self.trg_sentences) <= sen_id:
-                        self.trg_sentences.append([])
+                        self.trg_sentences.append(SimpleTrie())
                     sen = [int(w) for w in parts[1].strip().split()]
                     if sen and sen[0] == utils.GO_ID:
                         sen  = sen[1:]
                     if sen and sen[-1] == utils.EOS_ID:
                         sen = sen[:-1]
-                    self.trg_sentences[sen_id].append((score, sen))
+                    self.trg_sentences[sen_id].add(sen, (entry_idx, score))
+                    entry_idx += 1
         
     def _get_score(self, parts, feat_name):
         """Get the score for a hypothesis.
@@ -186,33 +199,20 @@ class ForcedLstPredictor(Predictor):
     
     def predict_next(self):
         """Outputs 0.0 (i.e. prob=1) for all words for which there is 
-        an entry ``in cur_trg_sentences``, and the score in 
-        ``cur_trg_sentences`` if the current history is by itself equal
-        to an entry in ``cur_trg_sentences``.
-        
-        TODO: The implementation here is fairly inefficient as it scans 
-        through all target sentences linearly. Would be better to 
-        organize the target sentences in a Trie
+        an entry in ``cur_trg_sentences`` which continues the current 
+        history, and the score of the n-best entry if the current 
+        history is by itself equal to an entry in ``cur_trg_sentences``.
+        This only looks at the outgoing edges of the current trie nodes.
         """
         scores = {}
-        hist_len = len(self.history)
-        for sen_score,trg_sentence in self.cur_trg_sentences:
-            sen_len = len(trg_sentence)
-            if sen_len < hist_len:
-                continue
-            if self.match_unk:
-                hist = [self.history[i] 
-                      if trg_sentence[i] != utils.UNK_ID else utils.UNK_ID
-                      for i in xrange(hist_len)]
-            else:
-                hist = self.history 
-            if trg_sentence[:hist_len] == hist:
-                if sen_len == hist_len:
-                    scores[utils.EOS_ID] = sen_score
-                else:
-                    scores[trg_sentence[hist_len]] = 0.0
-        if not utils.EOS_ID in scores:
-            scores[utils.EOS_ID] = NEG_INF
+        eos_entry = None
+        for node in self.cur_nodes:
+            for word in node.edges:
+                scores[word] = 0.0
+            if node.element is not None and (eos_entry is None 
+                                             or node.element > eos_entry):
+                eos_entry = node.element # Later entries take precedence
+        scores[utils.EOS_ID] = NEG_INF if eos_entry is None else eos_entry[1]
         return scores
     
     def initialize(self, src_sentence):
@@ -223,22 +223,42 @@ class ForcedLstPredictor(Predictor):
             src_sentence (list): Not used
         """
         self.cur_trg_sentences = self.trg_sentences[self.current_sen_id] 
-        self.history = []
+        self.cur_nodes = (self.cur_trg_sentences.root,)
     
     def consume(self, word):
-        """Extends the current history by ``word``. """
-        self.history.append(word)
+        """Follows the edges labelled with ``word`` from the current 
+        trie nodes. If ``match_unk`` is true, also follow UNK edges.
+        """
+        next_nodes = []
+        for node in self.cur_nodes:
+            next_node = node.edges.get(word)
+            if next_node is not None:
+                next_nodes.append(next_node)
+            if self.match_unk and word != utils.UNK_ID:
+                next_node = node.edges.get(utils.UNK_ID)
+                if next_node is not None:
+                    next_nodes.append(next_node)
+        self.cur_nodes = tuple(next_nodes)
     
     def get_state(self):
-        """Returns the current history. """
-        return self.history
+        """Returns the tuple of current trie nodes. """
+        return self.cur_nodes
     
     def set_state(self, state):
-        """Sets the current history. """
-        self.history = state
+        """Sets the tuple of current trie nodes. """
+        self.cur_nodes = state
 
     def is_equal(self, state1, state2):
-        """Returns true if the history is the same """
-        return state1 == state2
+        """Returns true if both states point to the same trie nodes, 
+        i.e. if the possible continuations of both histories are the
+        same.
+        """
+        return set(id(n) for n in state1) == set(id(n) for n in state2)
+    
+    def has_persistent_state(self):
+        """Trie nodes are not modified after construction, and 
+        ``consume()`` creates a new tuple of nodes.
+        """
+        return True
 
 
@@ -17,6 +17,11 @@ b) work with ruleXtract
 c) allow spurious ambiguity
 
 ATTENTION: This implementation is experimental!!
+
+Large grammars can be compiled offline into a binary format with
+``compile_grammar.py``. The compiled grammar is a directory with numpy
+arrays which are memory-mapped at load time, which avoids parsing the
+textual grammar and creating Python objects for each rule.
 """
 
 from cam.sgnmt.predictors.core import Predictor
@@ -24,6 +29,9 @@ from cam.sgnmt import utils
 import logging
 import re
 import gzip
+import json
+import os
+import numpy as np
 
 class Cell:
     """Comparable to a CYK cell: A set of hypotheses. If duplicates are
@@ -218,6 +226,132 @@ class Trie:
                                              nt_span_lens + [span_len])
         
 
+class CompiledGrammar:
+    """Memory-mapped rule table and prefix index created by 
+    ``RuleSet.save_compiled``. The grammar directory contains the 
+    following numpy arrays:
+    
+    * Rule table: ``src_offsets``/``src_symbols``, 
+      ``trgt_offsets``/``trgt_symbols``, and 
+      ``map_offsets``/``map_symbols`` store the source sides, target 
+      sides, and target-source NT maps of all rules as flat integer
+      arrays (rule i spans ``offsets[i]:offsets[i+1]``). NTs are 
+      marked with negative IDs. ``costs`` is the rule cost column.
+    * Prefix index: One trie per non-terminal over source sides with
+      flat node arrays. The outgoing terminal edges of node n are 
+      ``term_labels[term_offsets[n]:term_offsets[n+1]]`` (sorted) with
+      target nodes in ``term_children``. ``nt_offsets``, 
+      ``nt_labels``, and ``nt_children`` store non-terminal edges, and
+      ``node_rule_offsets`` and ``node_rules`` the rules at each node.
+    
+    Additionally, ``grammar.json`` stores the NT names, the trie roots,
+    and the span length ranges. ``Rule`` objects are only created for
+    rules which match the current source sentence.
+    """
+    
+    ARRAYS = ['src_offsets', 'src_symbols', 'trgt_offsets', 'trgt_symbols',
+              'map_offsets', 'map_symbols', 'costs',
+              'term_offsets', 'term_labels', 'term_children', 
+              'nt_offsets', 'nt_labels', 'nt_children',
+              'node_rule_offsets', 'node_rules']
+    
+    def __init__(self, path):
+        """Memory-maps the compiled grammar in ``path``.
+        
+        Args:
+            path (string): Path to the compiled grammar directory
+        
+        Raises:
+            IOError. If the grammar files cannot be read
+        """
+        with open(os.path.join(path, "grammar.json")) as f:
+            self.meta = json.load(f)
+        for name in CompiledGrammar.ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, "%s.npy" % name),
+                                        mmap_mode='r'))
+        self.rule_cache = {}
+    
+    def get_rule(self, rule_id):
+        """Get the ``Rule`` object for a rule index. Rule objects are
+        cached until ``clear_cache()`` is called.
+        """
+        rule = self.rule_cache.get(rule_id)
+        if rule is None:
+            rule = Rule(
+              self.src_symbols[self.src_offsets[rule_id]:
+                               self.src_offsets[rule_id+1]].tolist(),
+              self.trgt_symbols[self.trgt_offsets[rule_id]:
+                                self.trgt_offsets[rule_id+1]].tolist(),
+              self.map_symbols[self.map_offsets[rule_id]:
+                               self.map_offsets[rule_id+1]].tolist(),
+              float(self.costs[rule_id]),
+              rule_id)
+            self.rule_cache[rule_id] = rule
+        return rule
+    
+    def clear_cache(self):
+        """Removes all materialized ``Rule`` objects. """
+        self.rule_cache = {}
+
+
+class CompiledTrie:
+    """Read-only counterpart of ``Trie`` which operates on the prefix
+    index of a ``CompiledGrammar``. 
+    """
+    
+    def __init__(self, grammar, root, span_len_range):
+        """Creates a trie view on ``grammar``.
+        
+        Args:
+            grammar (CompiledGrammar): Compiled grammar
+            root (int): Root node of this trie, or -1 if there are no
+                        rules for this non-terminal
+            span_len_range (list): Minimum and maximum span lengths
+                                   for non-terminal symbols
+        """
+        self.grammar = grammar
+        self.root = root
+        self.span_len_range = span_len_range
+    
+    def get_elements(self, src_seq):
+        """Same as ``Trie.get_elements``. """
+        self.matching_elements = {}
+        self.matching_nt_span_lens = {}
+        if self.root >= 0:
+            self._get_elements_recursive(self.root, src_seq, [])
+        return (self.matching_elements, self.matching_nt_span_lens)
+    
+    def _get_elements_recursive(self, node, src_seq, nt_span_lens):
+        """Recursive helper function for ``get_elements``. """
+        g = self.grammar
+        if not src_seq:
+            for idx in xrange(g.node_rule_offsets[node],
+                              g.node_rule_offsets[node+1]):
+                rule_id = int(g.node_rules[idx])
+                if not rule_id in self.matching_elements:
+                    self.matching_elements[rule_id] = g.get_rule(rule_id)
+                    self.matching_nt_span_lens[rule_id] = []
+                self.matching_nt_span_lens[rule_id].append(nt_span_lens)
+            return
+        token_id = src_seq[0]
+        lo, hi = g.term_offsets[node], g.term_offsets[node+1]
+        if lo < hi: # Exact matches
+            pos = lo + int(np.searchsorted(g.term_labels[lo:hi], token_id))
+            if pos < hi and g.term_labels[pos] == token_id:
+                self._get_elements_recursive(int(g.term_children[pos]),
+                                             src_seq[1:],
+                                             nt_span_lens)
+        for idx in xrange(g.nt_offsets[node], g.nt_offsets[node+1]):
+            nt_id = int(g.nt_labels[idx])
+            child = int(g.nt_children[idx])
+            (min_span_len, max_span_len) = self.span_len_range[nt_id]
+            max_span_len = min(len(src_seq), max_span_len)
+            for span_len in xrange(min_span_len, max_span_len + 1):
+                self._get_elements_recursive(child,
+                                             src_seq[span_len:],
+                                             nt_span_lens + [span_len])
+
+
 class Span:
     """Span is defined by the start and end position and the 
     corresponding sequence of terminal and non-terminal symbols p. 
@@ -298,7 +432,7 @@ class Rule:
     
     last_id = 0 # Used for assigning unique rule indices
     
-    def __init__(self, rhs_src, rhs_trgt, trgt_src_map, cost):
+    def __init__(self, rhs_src, rhs_trgt, trgt_src_map, cost, rule_id=None):
         """Creates a new rule.
         
         Args:
@@ -306,13 +440,17 @@ class Rule:
             rhs_trgt (list): Target on the right hand side of the rule
             trgt_src_map (dict): Defines which NT on the target side
                                  belongs to which NT on the source side
+            rule_id (int): Rule index. If None, assign a new unique
+                           index
         """
         self.rhs_src = rhs_src
         self.rhs_trgt = rhs_trgt
         self.trgt_src_map = trgt_src_map
         self.cost = cost
-        Rule.last_id += 1
-        self.id = Rule.last_id 
+        if rule_id is None:
+            Rule.last_id += 1
+            rule_id = Rule.last_id
+        self.id = rule_id
     
     def __repr__(self):
         """Returns a string representation of the rule. """
@@ -346,6 +484,7 @@ class RuleSet:
         # Number of parsed but discarded rules (because not in GNF)
         self.n_discarded = 0 
         self.n_rules = 0 # Number of rules
+        self.compiled_grammar = None # Set by load_compiled()
     
     def update_span_len_range(self):
         """This method updates the ``span_len_range`` variable by 
@@ -761,6 +900,105 @@ class RuleSet:
             self.n_rules = self.n_rules + 1
             self.tries[self._get_nt_id(parts[0])].add(rule.rhs_src, rule)
             self.span_len_range_updated = False
+
+    def save_compiled(self, path):
+        """Writes the rule set in the binary format described in
+        ``CompiledGrammar`` to the directory ``path``. Source and 
+        target sides, NT maps, and costs are stored as flat arrays. The
+        tries are flattened in breadth-first order such that node IDs
+        are consecutive integers.
+        
+        Args:
+            path (string): Output directory
+        
+        Raises:
+            IOError. If the files cannot be written
+        """
+        if not self.span_len_range_updated:
+            self.update_span_len_range()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        arrs = dict((name, []) for name in CompiledGrammar.ARRAYS)
+        for name in ['src_offsets', 'trgt_offsets', 'map_offsets', 
+                     'term_offsets', 'nt_offsets', 'node_rule_offsets']:
+            arrs[name].append(0)
+        rule_ids = {}
+        nodes = [trie.root for trie in self.tries[1:]]
+        roots = [-1] + range(len(nodes))
+        node_id = 0
+        while node_id < len(nodes):
+            node = nodes[node_id]
+            for label in sorted(node.terminal_edges):
+                arrs['term_labels'].append(label)
+                arrs['term_children'].append(len(nodes))
+                nodes.append(node.terminal_edges[label])
+            for label in sorted(node.nonterminal_edges):
+                arrs['nt_labels'].append(label)
+                arrs['nt_children'].append(len(nodes))
+                nodes.append(node.nonterminal_edges[label])
+            for rule in node.elements:
+                if not rule.id in rule_ids:
+                    rule_ids[rule.id] = len(rule_ids)
+                    arrs['src_symbols'].extend(rule.rhs_src)
+                    arrs['src_offsets'].append(len(arrs['src_symbols']))
+                    arrs['trgt_symbols'].extend(rule.rhs_trgt)
+                    arrs['trgt_offsets'].append(len(arrs['trgt_symbols']))
+                    arrs['map_symbols'].extend(rule.trgt_src_map)
+                    arrs['map_offsets'].append(len(arrs['map_symbols']))
+                    arrs['costs'].append(rule.cost)
+                arrs['node_rules'].append(rule_ids[rule.id])
+            arrs['term_offsets'].append(len(arrs['term_labels']))
+            arrs['nt_offsets'].append(len(arrs['nt_labels']))
+            arrs['node_rule_offsets'].append(len(arrs['node_rules']))
+            node_id += 1
+        for name, values in arrs.iteritems():
+            if name == 'costs':
+                dtype = np.float64
+            elif name.endswith('_offsets'):
+                dtype = np.int64
+            else:
+                dtype = np.int32
+            np.save(os.path.join(path, "%s.npy" % name),
+                    np.array(values, dtype=dtype))
+        with open(os.path.join(path, "grammar.json"), "w") as f:
+            json.dump({"nt2id": self.nt2id,
+                       "roots": roots,
+                       "span_len_range": self.span_len_range,
+                       "n_rules": len(rule_ids),
+                       "n_discarded": self.n_discarded}, f)
+        logging.info("Wrote compiled grammar with %d rules and %d trie "
+                     "nodes to %s" % (len(rule_ids), len(nodes), path))
+
+    def load_compiled(self, path):
+        """Loads a grammar which has been compiled with 
+        ``save_compiled``. The rule table and the prefix index are 
+        memory-mapped, and the tries are replaced by ``CompiledTrie``
+        instances.
+        
+        Args:
+            path (string): Path to the compiled grammar directory
+        
+        Raises:
+            IOError. If the grammar files cannot be read
+        """
+        grammar = CompiledGrammar(path)
+        self.compiled_grammar = grammar
+        self.nt2id = dict((str(name), nt_id) 
+                          for name, nt_id in grammar.meta["nt2id"].iteritems())
+        self.span_len_range[:] = [tuple(r) 
+                                  for r in grammar.meta["span_len_range"]]
+        self.tries = [CompiledTrie(grammar, root, self.span_len_range)
+                      for root in grammar.meta["roots"]]
+        self.n_rules = grammar.meta["n_rules"]
+        self.n_discarded = grammar.meta["n_discarded"]
+        self.span_len_range_updated = True
+
+    def clear_cache(self):
+        """Removes all ``Rule`` objects which have been created for a
+        compiled grammar. This has no effect for textual grammars. 
+        """
+        if self.compiled_grammar is not None:
+            self.compiled_grammar.clear_cache()
         
 
 class RuleXtractPredictor(Predictor):
@@ -797,7 +1035,9 @@ class RuleXtractPredictor(Predictor):
         """Creates a new hiero predictor.
         
         Args:
-            ruleXtract_path (string): Path to the rules file
+            ruleXtract_path (string): Path to the rules file, or to a
+                                      grammar directory created with
+                                      ``compile_grammar.py``
             use_weights (bool): If false, set all hypothesis scores 
                                 uniformly to 0 (= log 1). If true,
                                 use the rule weights to compute
@@ -809,11 +1049,18 @@ class RuleXtractPredictor(Predictor):
         super(RuleXtractPredictor, self).__init__()
         self.use_weights = use_weights
         self.rules = RuleSet()
-        with (gzip.open(ruleXtract_path) if ruleXtract_path[-3:] == '.gz' 
-                                         else open(ruleXtract_path)) as f:
-            for line in f:
-                self.rules.parse(line, feature_weights)
-        self.rules.update_span_len_range()
+        if os.path.isdir(ruleXtract_path):
+            if feature_weights:
+                logging.warn("Feature weights are ignored for compiled "
+                             "grammars. Specify them when compiling.")
+            self.rules.load_compiled(ruleXtract_path)
+        else:
+            with (gzip.open(ruleXtract_path) 
+                    if ruleXtract_path[-3:] == '.gz' 
+                    else open(ruleXtract_path)) as f:
+                for line in f:
+                    self.rules.parse(line, feature_weights)
+            self.rules.update_span_len_range()
         logging.info("%d rules loaded (%d discarded because not in GNF)" %
             (self.rules.n_rules, self.rules.n_discarded))
         if not 'S' in self.rules.nt2id:
@@ -882,6 +1129,7 @@ class RuleXtractPredictor(Predictor):
     
     def initialize(self, src_sentence):
         """Delete all bins and add the initial cell to the first bin """
+        self.rules.clear_cache()
         self.stacks = []
         self.n_consumed = 0
         self.src_seq = [utils.GO_ID] + src_sentence + [utils.EOS_ID]
@@ -14,7 +14,9 @@ from scipy.special import gammaln
 
 from cam.sgnmt import utils
 from cam.sgnmt.misc.trie import SimpleTrie
-from cam.sgnmt.predictors.core import Predictor, UnboundedVocabularyPredictor
+from cam.sgnmt.predictors.core import Predictor, \
+                                     UnboundedVocabularyPredictor, \
+                                     BatchPredictor
 import numpy as np
 
 
@@ -156,11 +158,11 @@ class NBLengthPredictor(Predictor):
         if self.use_point_probs:
             return eos_point_prob - self.max_eos_prob
         if not self.prev_eos_probs:
-            self.prev_eos_probs.append(eos_point_prob)
+            self.prev_eos_probs = [eos_point_prob]
             return eos_point_prob
         # bypass utils.log_sum because we always want to use logsumexp here 
         prev_sum = logsumexp(np.asarray([p for p in self.prev_eos_probs])) 
-        self.prev_eos_probs.append(eos_point_prob)
+        self.prev_eos_probs = self.prev_eos_probs + [eos_point_prob]
         # Desired prob is eos_point_prob / (1-last_eos_probs_sum)
         return eos_point_prob - np.log(1.0-np.exp(prev_sum))
     
@@ -226,9 +228,19 @@ class NBLengthPredictor(Predictor):
         n1,_ = state1
         n2,_ = state2
         return n1 == n2
+    
+    def get_recombination_key(self, state):
+        """The number of consumed words is the key """
+        return state[0]
+    
+    def has_persistent_state(self):
+        """The EOS probability accumulator is replaced rather than 
+        extended in place, so the state does not need to be copied.
+        """
+        return True
 
 
-class WordCountPredictor(Predictor):
+class WordCountPredictor(BatchPredictor):
     """This predictor adds the (negative) number of words as feature. """
     
     def __init__(self, word = -1):
@@ -253,6 +265,14 @@ class WordCountPredictor(Predictor):
     def predict_next(self):
         """Set score for EOS to the number of consumed words """
         return self.posterior
+
+    def predict_next_batch(self, states):
+        """The posterior does not depend on the state. """
+        return [self.posterior] * len(states)
+
+    def consume_batch(self, states, words):
+        """The state does not change. """
+        return states
     
     def initialize(self, src_sentence):
         """Empty
@@ -275,6 +295,14 @@ class WordCountPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Returns true """
         return True
+    
+    def get_recombination_key(self, state):
+        """All states are equal """
+        return 0
+    
+    def has_persistent_state(self):
+        """The state is a constant. """
+        return True
 
 
 class ExternalLengthPredictor(Predictor):
@@ -343,6 +371,14 @@ class ExternalLengthPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Returns true if the number of consumed words is the same """
         return state1 == state2
+    
+    def get_recombination_key(self, state):
+        """The number of consumed words is the key """
+        return state
+    
+    def has_persistent_state(self):
+        """The state is an integer. """
+        return True
 
 
 class NgramCountPredictor(Predictor):
@@ -431,7 +467,7 @@ class NgramCountPredictor(Predictor):
         Args:
             word (int): Word to add to the history.
         """
-        self.cur_history.append(word)
+        self.cur_history = self.cur_history + [word]
         if len(self.cur_history) > self.max_history_len:
             self.cur_history = self.cur_history[-self.max_history_len:]
         if self.discount_factor >= 0.0:
@@ -479,6 +515,25 @@ class NgramCountPredictor(Predictor):
             if self.ngrams.get(hist_long[-n:]):
                 return False
         return True
+    
+    def get_recombination_key(self, state):
+        """Two histories are equal iff they agree on all suffixes
+        which are in ``self.ngrams``. Therefore, the set of these
+        suffixes is the key. Returns None if discounting is enabled
+        because then ``is_equal()`` is always false.
+        """
+        if self.discount_factor >= 0.0:
+            return None
+        hist = state[0]
+        return tuple(tuple(hist[-n:]) for n in xrange(1, len(hist)+1)
+                     if self.ngrams.get(hist[-n:]))
+    
+    def has_persistent_state(self):
+        """The history is replaced in ``consume()``, but the discount
+        trie is updated in place. Therefore, the state is only 
+        persistent if discounting is disabled.
+        """
+        return self.discount_factor < 0.0
 
 
 class UnkCountPredictor(Predictor):
@@ -568,6 +623,14 @@ class UnkCountPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Returns true if the state is the same"""
         return state1 == state2
+    
+    def get_recombination_key(self, state):
+        """The state is the key """
+        return state
+    
+    def has_persistent_state(self):
+        """The state is a tuple of numbers. """
+        return True
 
     
 class NgramizePredictor(Predictor):
@@ -582,11 +645,18 @@ class NgramizePredictor(Predictor):
     history in the recorded slave predictor posteriors to form the
     n-gram scores returned by this predictor.
 
+    The recorded posteriors are stored in a single (T, V) matrix,
+    where T is the number of recorded time steps. Posteriors in dict
+    form are densified once in `initialize()` by filling in the UNK
+    score of the respective time step. For each history prefix, the
+    accumulated history scores at all positions are kept in the
+    predictor state and updated in `consume()`, so that
+    `predict_next()` only needs a few array operations per n-gram
+    order.
+
     Note that this wrapper does not work correctly if the slave
     predictor feeds back the selected token in the history, ie. depends
     on the particular token which is provided via `consume()`.
-
-    TODO: Make this wrapper work with slaves which return dicts.
     """
     
     def __init__(self, min_order, max_order, max_len_factor, slave_predictor):
@@ -620,22 +690,62 @@ class NgramizePredictor(Predictor):
         self.scores and self.unk_scores, resets the history.
         """
         self.slave_predictor.initialize(src_sentence)
-        self.scores = []
-        self.unk_scores = []
+        posteriors = []
+        unk_scores = []
         trg_word = -1
         max_len = self.max_len_factor * len(src_sentence)
         l = 0
         while trg_word != utils.EOS_ID and l <= max_len:
             posterior = self.slave_predictor.predict_next()
             trg_word = utils.argmax(posterior)
-            self.scores.append(posterior)
-            self.unk_scores.append(self.slave_predictor.get_unk_probability(
+            posteriors.append(posterior)
+            unk_scores.append(self.slave_predictor.get_unk_probability(
                 posterior))
             self.slave_predictor.consume(utils.UNK_ID)
             l += 1
         logging.debug("ngramize uses %d time steps." % l)
-        self.history = []
+        self.unk_scores = np.array(unk_scores, dtype=np.float64)
+        self.scores = self._densify(posteriors, self.unk_scores)
+        self.history = ()
+        self.accs = (np.zeros(len(posteriors)),)
         self.cur_unk_score = utils.NEG_INF
+
+    def _densify(self, posteriors, unk_scores):
+        """Converts the recorded slave posteriors to a single matrix.
+        Entries which are not defined by a posterior (missing dict
+        keys or indices beyond the length of the array) are set to the
+        UNK score of the time step.
+
+        Args:
+            posteriors (list): List of slave posteriors (dicts or 
+                               arrays)
+            unk_scores (array): UNK scores of the time steps
+
+        Returns:
+            array. (T, V) matrix with the recorded posteriors
+        """
+        vocab_size = 0
+        for posterior in posteriors:
+            if isinstance(posterior, dict):
+                if posterior:
+                    vocab_size = max(vocab_size, max(posterior) + 1)
+            else:
+                vocab_size = max(vocab_size, len(posterior))
+        scores = np.empty((len(posteriors), vocab_size), dtype=np.float64)
+        scores[:] = unk_scores[:, np.newaxis]
+        for pos, posterior in enumerate(posteriors):
+            if isinstance(posterior, dict):
+                if posterior:
+                    scores[pos, posterior.keys()] = posterior.values()
+            else:
+                scores[pos, :len(posterior)] = posterior
+        return scores
+
+    def _get_word_scores(self, word):
+        """Returns the scores of ``word`` at all time steps. """
+        if word < self.scores.shape[1]:
+            return self.scores[:, word]
+        return self.unk_scores
     
     def initialize_heuristic(self, src_sentence):
         """Pass through to slave predictor """
@@ -643,31 +753,23 @@ class NgramizePredictor(Predictor):
         self.slave_predictor.initialize_heuristic(src_sentence)
     
     def predict_next(self):
-        """Looks up ngram scores via self.scores. """
-        cur_hist_length = len(self.history)
-        this_scores = [[] for _ in xrange(cur_hist_length+1)]
-        this_unk_scores = [[] for _ in xrange(cur_hist_length+1)]
-        for pos in xrange(len(self.scores)):
-            this_scores[0].append(self.scores[pos])
-            this_unk_scores[0].append(self.unk_scores[pos])
-            acc = 0.0
-            for order, word in enumerate(self.history):
-                if pos + order + 1 >= len(self.scores):
-                    break
-                acc += utils.common_get(
-                    self.scores[pos + order], word, 
-                    self.unk_scores[pos + order])
-                this_scores[order+1].append(acc + self.scores[pos + order + 1])
-                this_unk_scores[order+1].append(
-                    acc + self.unk_scores[pos + order + 1])
+        """Looks up ngram scores via self.scores. The k-th entry in
+        ``self.accs`` contains the accumulated scores of the first k
+        history words at all starting positions, so the scores for
+        order k+1 are given by adding the recorded posteriors k time
+        steps later.
+        """
+        n_steps = self.scores.shape[0]
         combined_scores = []
         combined_unk_scores = []
-        for order, (scores, unk_scores) in enumerate(zip(this_scores, 
-                                                         this_unk_scores)):
-            if scores and order + 1 >= self.min_order:
-                score_matrix = np.vstack(scores)
-                combined_scores.append(logsumexp(score_matrix, axis=0))
-                combined_unk_scores.append(utils.log_sum(unk_scores))
+        for order in xrange(self.min_order - 1, len(self.accs)):
+            acc = self.accs[order]
+            if n_steps - order <= 0:
+                break
+            combined_scores.append(logsumexp(
+                acc[:, np.newaxis] + self.scores[order:], axis=0))
+            combined_unk_scores.append(utils.log_sum(
+                acc + self.unk_scores[order:]))
         if not combined_scores:
             self.cur_unk_score = 0.0
             return {}
@@ -678,18 +780,39 @@ class NgramizePredictor(Predictor):
         return self.cur_unk_score
     
     def consume(self, word):
-        """Pass through to slave predictor """
-        if self.max_history_length > 0:
-            self.history.append(word)
-            self.history = self.history[-self.max_history_length:]
+        """Updates the history and the accumulated history scores. If
+        the history is full, the accumulated scores are rebuilt from
+        the recorded posteriors since the first history word changes.
+        """
+        if self.max_history_length <= 0:
+            return
+        n_steps = self.scores.shape[0]
+        if len(self.history) < self.max_history_length:
+            self.history = self.history + (word,)
+            order = len(self.accs) - 1
+            if n_steps - order - 1 > 0:
+                self.accs = self.accs + (
+                    self.accs[order][:n_steps-order-1]
+                    + self._get_word_scores(word)[order:n_steps-1],)
+            return
+        self.history = self.history[1:] + (word,)
+        accs = [self.accs[0]]
+        for order, w in enumerate(self.history):
+            if n_steps - order - 1 <= 0:
+                break
+            accs.append(accs[order][:n_steps-order-1]
+                        + self._get_word_scores(w)[order:n_steps-1])
+        self.accs = tuple(accs)
     
     def get_state(self):
-        """State is the current n-gram history. """
-        return self.history, self.cur_unk_score
+        """State is the current n-gram history and the accumulated
+        history scores. """
+        return self.history, self.accs, self.cur_unk_score
     
     def set_state(self, state):
-        """State is the current n-gram history. """
-        self.history, self.cur_unk_score = state
+        """State is the current n-gram history and the accumulated
+        history scores. """
+        self.history, self.accs, self.cur_unk_score = state
 
     def set_current_sen_id(self, cur_sen_id):
         """We need to override this method to propagate current\_
@@ -699,7 +822,15 @@ class NgramizePredictor(Predictor):
         self.slave_predictor.set_current_sen_id(cur_sen_id)
     
     def is_equal(self, state1, state2):
-        """Pass through to slave predictor """
-        return state1 == state2
+        """Compares the n-gram histories and UNK scores. The
+        accumulated scores are fully determined by the history.
+        """
+        return state1[0] == state2[0] and state1[2] == state2[2]
+
+    def has_persistent_state(self):
+        """The state tuple and its arrays are replaced rather than
+        modified in ``consume()``.
+        """
+        return True
         
 
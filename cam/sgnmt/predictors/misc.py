@@ -65,6 +65,10 @@ class AltsrcPredictor(Predictor):
     def set_state(self, state):
         """Pass through to slave predictor """
         self.slave_predictor.set_state(state)
+    
+    def has_persistent_state(self):
+        """Pass through to slave predictor """
+        return self.slave_predictor.has_persistent_state()
 
     def estimate_future_cost(self, hypo):
         """Pass through to slave predictor """
@@ -80,6 +84,10 @@ class AltsrcPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Pass through to slave predictor """
         return self.slave_predictor.is_equal(state1, state2)
+    
+    def get_recombination_key(self, state):
+        """Pass through to slave predictor """
+        return self.slave_predictor.get_recombination_key(state)
         
 
 class UnboundedAltsrcPredictor(AltsrcPredictor,UnboundedVocabularyPredictor):
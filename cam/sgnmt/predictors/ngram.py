@@ -85,8 +85,9 @@ class SRILMPredictor(UnboundedVocabularyPredictor):
     def consume(self, word):
         """Extends the current history by ``word`` """
         if len(self.history) >= self.history_len:
-            self.history = self.history[1:]
-        self.history.append(str(word))
+            self.history = self.history[1:] + [str(word)]
+        else:
+            self.history = self.history + [str(word)]
     
     def get_state(self):
         """Returns the current n-gram history """
@@ -103,3 +104,11 @@ class SRILMPredictor(UnboundedVocabularyPredictor):
         """Returns true if the ngram history is the same"""
         return self._replace_unks(state1) == self._replace_unks(state2)
     
+    def get_recombination_key(self, state):
+        """The ngram history with UNK replacement is the key """
+        return tuple(self._replace_unks(state))
+    
+    def has_persistent_state(self):
+        """The history is replaced in ``consume()``. """
+        return True
+    
@@ -4,6 +4,8 @@ balanced bracket expressions, and the OSM predictor prevents any sequence
 of operations which cannot be compiled to a string.
 """
 
+from bisect import bisect_left, bisect_right
+
 from cam.sgnmt import utils
 from cam.sgnmt.predictors.core import Predictor, UnboundedVocabularyPredictor
 
@@ -135,6 +137,13 @@ class ForcedOSMPredictor(Predictor):
     the current history. It allows terminal symbols which are 
     consistent with the reference. The end-of-sentence symbol is
     supressed until all words in the reference have been consumed.
+    
+    The terminals in the compiled string need to be aligned 
+    monotonically to the reference. Rather than enumerating all 
+    alignments, we keep track of the leftmost (``forward``) and the
+    rightmost (``backward``) reference position each terminal can be
+    aligned to. These frontiers determine the possible words in the 
+    gaps and are updated incrementally in ``consume()``.
     """
     
     def __init__(self, trg_test_file):
@@ -162,6 +171,12 @@ class ForcedOSMPredictor(Predictor):
         self.compiled = ["X"]
         self.head = 0
         self.cur_trg_sentence = self.trg_sentences[self.current_sen_id] 
+        self.trg_positions = {}
+        for pos, word in enumerate(self.cur_trg_sentence):
+            self.trg_positions.setdefault(word, []).append(pos)
+        # forward[0] and backward[-1] are sentinels
+        self.forward = [-1]
+        self.backward = [len(self.cur_trg_sentence)]
 
     def _is_complete(self):
         """Returns true if the compiled sentence contains the right
@@ -170,47 +185,96 @@ class ForcedOSMPredictor(Predictor):
         n_terminals = len([s for s in self.compiled if s != "X"])
         return n_terminals == len(self.cur_trg_sentence)
 
-    def _generate_alignments(self, align_stub=[], compiled_start_pos=0, 
-                             sentence_start_pos=0):
-        for pos in xrange(compiled_start_pos, len(self.compiled)):
-            if self.compiled[pos] != 'X':
-                word = int(self.compiled[pos])
-                for sen_pos in xrange(sentence_start_pos, 
-                                      len(self.cur_trg_sentence)):
-                    if self.cur_trg_sentence[sen_pos] == word:
-                        self._generate_alignments(
-                            align_stub + [(pos, sen_pos)],
-                            pos+1,
-                            sen_pos+1)
-                return
-        self.alignments.append(align_stub)
+    def _next_trg_pos(self, word, pos):
+        """Returns the first position of ``word`` in the reference 
+        after ``pos``, or None if there is no such position.
+        """
+        positions = self.trg_positions.get(word, [])
+        idx = bisect_right(positions, pos)
+        return positions[idx] if idx < len(positions) else None
+
+    def _prev_trg_pos(self, word, pos):
+        """Returns the last position of ``word`` in the reference 
+        before ``pos``, or None if there is no such position.
+        """
+        positions = self.trg_positions.get(word, [])
+        idx = bisect_left(positions, pos)
+        return positions[idx-1] if idx > 0 else None
+
+    def _insert_terminal(self, idx, word):
+        """Updates ``forward`` and ``backward`` after inserting the 
+        terminal ``word`` such that it becomes the ``idx``-th terminal
+        in the compiled string. Frontiers are only recomputed until 
+        they match their previous values.
+        
+        Args:
+            idx (int): Index of the new terminal among all terminals
+            word (int): The inserted word
+        """
+        words = [int(s) for s in self.compiled if s != "X"]
+        # forward[t+1]: Leftmost alignment of the t-th terminal
+        forward = self.forward[:idx+1]
+        old_forward = self.forward
+        for t in xrange(idx, len(words)):
+            prev = forward[t]
+            pos = None if prev is None else self._next_trg_pos(words[t], prev)
+            if t > idx and pos == old_forward[t]:
+                forward.extend(old_forward[t:])
+                break
+            forward.append(pos)
+        # backward[t]: Rightmost alignment of the t-th terminal
+        backward = self.backward[idx:]
+        old_backward = self.backward
+        prefix = []
+        for t in xrange(idx, -1, -1):
+            nxt = prefix[-1] if prefix else backward[0]
+            pos = None if nxt is None else self._prev_trg_pos(words[t], nxt)
+            if t < idx and pos == old_backward[t]:
+                prefix.extend(reversed(old_backward[:t+1]))
+                break
+            prefix.append(pos)
+        prefix.reverse()
+        self.forward = forward
+        self.backward = prefix + backward
 
     def _align(self):
+        """Returns the set of possible words at each position of the
+        compiled string which is consistent with any monotone 
+        alignment of the terminals to the reference. Consider a section
+        of gaps between two adjacent terminals (or the sentence 
+        boundaries) which can be aligned to reference positions ``a``
+        and ``b``. The first gap in the section can be filled with the
+        word at ``a+1``, the other gaps with any word between ``a`` and
+        ``b``. The possible ``a`` values are all positions of the left
+        terminal from its leftmost alignment on, the possible ``b``
+        values are bounded by the rightmost alignment of the right
+        terminal.
+        """
+        sen = self.cur_trg_sentence
         possible_words = [set() for _ in xrange(len(self.compiled))]
-        self.alignments = []
-        self._generate_alignments(align_stub=[])
-        for alignment in self.alignments:
-            alignment.append((len(self.compiled), len(self.cur_trg_sentence)))
-            prev_compiled_pos = -1
-            prev_sentence_pos = -1
-            for compiled_pos, sentence_pos in alignment:
-               section_words = set(
-                   self.cur_trg_sentence[prev_sentence_pos+1:sentence_pos])
-               if section_words:
-                   seen_gap = False
-                   for section_pos in xrange(prev_compiled_pos+1, 
-                                             compiled_pos):
-                       if self.compiled[section_pos] == "X":
-                           if seen_gap:
-                               possible_words[section_pos] |= section_words
-                           else:
-                               possible_words[section_pos].add(
-                                   self.cur_trg_sentence[prev_sentence_pos 
-                                                         + section_pos 
-                                                         - prev_compiled_pos])
-                               seen_gap = True
-               prev_compiled_pos = compiled_pos
-               prev_sentence_pos = sentence_pos
+        section = 0 # Number of terminals left of the current position
+        first_gap = True
+        for pos, symbol in enumerate(self.compiled):
+            if symbol != "X":
+                section += 1
+                first_gap = True
+                continue
+            is_first_gap = first_gap
+            first_gap = False
+            start = self.forward[section]
+            end = self.backward[section]
+            if start is None or end is None or end <= start + 1:
+                continue
+            if not is_first_gap:
+                possible_words[pos] = set(sen[start+1:end])
+            elif section == 0:
+                possible_words[pos].add(sen[0])
+            else:
+                positions = self.trg_positions[int(self.compiled[pos-1])]
+                for left_pos in positions[bisect_left(positions, start):]:
+                    if left_pos + 1 >= end:
+                        break
+                    possible_words[pos].add(sen[left_pos+1])
         return possible_words
             
 
@@ -296,6 +360,9 @@ class ForcedOSMPredictor(Predictor):
     def _insert_op(self, op):
         self.compiled = self.compiled[:self.head] + [op] + \
                         self.compiled[self.head:]
+        if op != "X":
+            idx = len([s for s in self.compiled[:self.head] if s != "X"])
+            self._insert_terminal(idx, int(op))
         self.head += 1
     
     def consume(self, word):
@@ -310,10 +377,10 @@ class ForcedOSMPredictor(Predictor):
             self._insert_op(str(word))
     
     def get_state(self):
-        return self.compiled, self.head
+        return self.compiled, self.head, self.forward, self.backward
     
     def set_state(self, state):
-        self.compiled, self.head = state
+        self.compiled, self.head, self.forward, self.backward = state
 
     def is_equal(self, state1, state2):
         """Trivial implementation"""
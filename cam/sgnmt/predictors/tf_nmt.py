@@ -6,7 +6,7 @@ import copy
 import logging
 import numpy as np
 
-from cam.sgnmt.misc.trie import SimpleTrie
+from cam.sgnmt.misc.cache import LRUCache
 from tensorflow.models.rnn.translate.utils import data_utils as tf_data_utils
 from tensorflow.models.rnn.translate.utils import model_utils as tf_model_utils
 
@@ -14,7 +14,8 @@ NEG_INF = float("-inf")
 
 class TensorFlowNMTPredictor(Predictor):
   '''Neural MT predictor'''
-  def __init__(self, enable_cache, config, session):
+  def __init__(self, enable_cache, config, session, cache_max_entries=0,
+               cache_max_bytes=0):
       super(TensorFlowNMTPredictor, self).__init__()
       self.config = config
       self.session = session
@@ -46,6 +47,8 @@ class TensorFlowNMTPredictor(Predictor):
         logging.info("PAD_ID=%d" % tf_data_utils.PAD_ID)
 
       self.enable_cache = enable_cache
+      self.posterior_cache = LRUCache(cache_max_entries, cache_max_bytes)
+      self.states_cache = LRUCache(cache_max_entries, cache_max_bytes)
       if self.enable_cache:
         logging.info("Cache enabled..")
 
@@ -56,8 +59,12 @@ class TensorFlowNMTPredictor(Predictor):
     self.dec_state = {}
     self.word_count = 0
     self.consumed = []
-    self.posterior_cache = SimpleTrie()
-    self.states_cache = SimpleTrie()
+    if self.enable_cache:
+      logging.debug("NMT posterior cache: %s"
+                    % self.posterior_cache.get_stats())
+      logging.debug("NMT states cache: %s" % self.states_cache.get_stats())
+    self.posterior_cache.clear()
+    self.states_cache.clear()
 
     src_sentence = [w if w < self.config['src_vocab_size'] else tf_data_utils.UNK_ID
                     for w in src_sentence]
@@ -15,6 +15,8 @@ sequence models.
 import logging
 import os
 
+import numpy as np
+
 from cam.sgnmt import utils
 from cam.sgnmt.predictors.core import Predictor
 
@@ -29,6 +31,8 @@ try:
     from tensor2tensor.utils import devices
     from tensor2tensor.data_generators.text_encoder import TextEncoder
     from tensor2tensor.data_generators import text_encoder
+    from tensor2tensor.layers import common_attention
+    from tensor2tensor.layers import common_layers
     import tensorflow as tf
     from tensorflow.python.training import saver
     from tensorflow.python.training import training
@@ -176,11 +180,20 @@ def expand_input_dims_for_t2t(t):
 
 
 class T2TPredictor(_BaseTensor2TensorPredictor):
-    """This predictor implements scoring with Tensor2Tensor models. We
-    follow the decoder implementation in T2T and do not reuse network
-    states in decoding. We rather compute the full forward pass along
-    the current history. Therefore, the decoder state is simply the
-    the full history of consumed words.
+    """This predictor implements scoring with Tensor2Tensor models. By
+    default, we follow the decoder implementation in T2T and do not 
+    reuse network states in decoding. We rather compute the full 
+    forward pass along the current history. Therefore, the decoder 
+    state is simply the the full history of consumed words.
+    
+    In incremental mode, we follow T2T's fast decoding instead. The
+    source sentence is encoded once in ``initialize()``, and the 
+    predictor state additionally contains the attention keys and values
+    of all decoder layers for the consumed words. ``consume()`` runs a
+    single decoder step which extends them by one position and computes
+    the posterior for the next position. This requires a model which
+    implements ``encode()`` and ``decode()`` with a cache argument like
+    the transformer.
     """
 
     def __init__(self,
@@ -194,7 +207,8 @@ class T2TPredictor(_BaseTensor2TensorPredictor):
                  t2t_unk_id=None,
                  single_cpu_thread=False,
                  max_terminal_id=-1,
-                 pop_id=-1):
+                 pop_id=-1,
+                 incremental=False):
         """Creates a new T2T predictor. The constructor prepares the
         TensorFlow session for predict_next() calls. This includes:
         - Load hyper parameters from the given set (hparams)
@@ -223,6 +237,8 @@ class T2TPredictor(_BaseTensor2TensorPredictor):
                 be set for syntax-based T2T models.
             pop_id (int): If positive, ID of the POP or closing bracket symbol.
                 Needs to be set for syntax-based T2T models.
+            incremental (bool): If true, use incremental decoding with
+                                cached decoder layer states.
         """
         super(T2TPredictor, self).__init__(t2t_usr_dir, 
                                            checkpoint_dir, 
@@ -241,6 +257,7 @@ class T2TPredictor(_BaseTensor2TensorPredictor):
                          "Reset to -1")
             self.pop_id = -1
         self.max_terminal_id = max_terminal_id 
+        self.incremental = incremental
         self.src_vocab_size = src_vocab_size
         self.trg_vocab_size = trg_vocab_size
         predictor_graph = tf.Graph()
@@ -266,11 +283,118 @@ class T2TPredictor(_BaseTensor2TensorPredictor):
             with translate_model._var_store.as_default():
                 translate_model.prepare_features_for_infer(features)
                 translate_model._fill_problem_hparams_features(features)
-                logits, _ = translate_model(features)
-                logits = tf.squeeze(logits, [0, 1, 2, 3])
-                self._log_probs = log_prob_from_logits(logits)
+                if self.incremental:
+                    self._build_incremental_graph(
+                        translate_model, features, hparams)
+                else:
+                    logits, _ = translate_model(features)
+                    logits = tf.squeeze(logits, [0, 1, 2, 3])
+                    self._log_probs = log_prob_from_logits(logits)
             self.mon_sess = self.create_session()
 
+    def _build_incremental_graph(self, translate_model, features, hparams):
+        """Creates the computation graphs for incremental decoding. 
+        This corresponds to ``_fast_decode()`` in T2T's transformer
+        implementation, but the decoder layer cache is passed in and
+        out through placeholders and fetches such that it can be kept
+        in the predictor state. Sets up the following members:
+        
+        - ``_encoder_output`` and ``_enc_dec_bias``: Encoder graph
+        - ``_step_*_var``: Placeholders for a single decoder step
+        - ``_cache_vars``: Cache placeholders for all decoder layers
+        - ``_next_cache``: Updated cache tensors after the step
+        - ``_log_probs``: Posterior after the step
+        
+        Args:
+            translate_model (T2TModel): T2T model with ``encode()`` 
+                                        and ``decode()`` methods
+            features (dict): Model features with ``inputs``
+            hparams (Hparams): Model hyper parameters
+        """
+        dp = translate_model._data_parallelism
+        input_modality = \
+            translate_model._problem_hparams.input_modality["inputs"]
+        target_modality = translate_model._problem_hparams.target_modality
+        num_layers = getattr(hparams, "num_decoder_layers", 0) \
+                     or hparams.num_hidden_layers
+        key_channels = hparams.attention_key_channels or hparams.hidden_size
+        value_channels = (hparams.attention_value_channels 
+                          or hparams.hidden_size)
+        with tf.variable_scope(translate_model.name):
+            # _shard_features called to ensure that the variable names
+            # match, and inputs are embedded with the input modality
+            inputs = translate_model._shard_features(
+                {"inputs": features["inputs"]})["inputs"]
+            with tf.variable_scope(input_modality.name):
+                inputs = input_modality.bottom_sharded(inputs, dp)
+            with tf.variable_scope("body"):
+                encoder_output, enc_dec_bias = dp(
+                    translate_model.encode,
+                    inputs,
+                    features["target_space_id"],
+                    hparams,
+                    features=features)
+            self._encoder_output = encoder_output[0]
+            self._enc_dec_bias = enc_dec_bias[0]
+            self._step_enc_output_var = tf.placeholder(
+                dtype=tf.float32, shape=[1, None, hparams.hidden_size],
+                name="sgnmt_encoder_output")
+            self._step_enc_dec_bias_var = tf.placeholder(
+                dtype=tf.float32, shape=[1, 1, 1, None],
+                name="sgnmt_encoder_decoder_attention_bias")
+            self._step_word_var = tf.placeholder(dtype=tf.int32, shape=[],
+                                                 name="sgnmt_step_word")
+            self._step_pos_var = tf.placeholder(dtype=tf.int32, shape=[],
+                                                name="sgnmt_step_pos")
+            self._cache_vars = {}
+            cache = {}
+            for layer in xrange(num_layers):
+                layer_name = "layer_%d" % layer
+                self._cache_vars[layer_name] = {
+                    "k": tf.placeholder(dtype=tf.float32, 
+                                        shape=[1, None, key_channels]),
+                    "v": tf.placeholder(dtype=tf.float32,
+                                        shape=[1, None, value_channels])}
+                cache[layer_name] = dict(self._cache_vars[layer_name])
+            self._empty_cache = {
+                layer_name: {"k": np.zeros((1, 0, key_channels)),
+                             "v": np.zeros((1, 0, value_channels))}
+                for layer_name in self._cache_vars}
+            targets = tf.reshape(self._step_word_var, [1, 1, 1, 1])
+            targets = translate_model._shard_features(
+                {"targets": targets})["targets"]
+            with tf.variable_scope(target_modality.name):
+                targets = target_modality.targets_bottom_sharded(
+                    targets, dp)[0]
+            targets = common_layers.flatten4d3d(targets)
+            # Targets are shifted right, i.e. the first input is zero
+            targets = tf.cond(tf.equal(self._step_pos_var, 0),
+                              lambda: tf.zeros_like(targets),
+                              lambda: targets)
+            if hparams.pos == "timing":
+                timing_signal = common_attention.get_timing_signal_1d(
+                    self._step_pos_var + 1, hparams.hidden_size)
+                targets += timing_signal[:, self._step_pos_var:
+                                            self._step_pos_var + 1]
+            # The single query position can attend to all previous ones
+            self_attention_bias = tf.zeros([1, 1, 1, self._step_pos_var + 1])
+            with tf.variable_scope("body"):
+                body_outputs = dp(
+                    translate_model.decode,
+                    targets,
+                    self._step_enc_output_var,
+                    self._step_enc_dec_bias_var,
+                    self_attention_bias,
+                    hparams,
+                    cache)
+            with tf.variable_scope(target_modality.name):
+                logits = target_modality.top_sharded(
+                    body_outputs, None, dp)[0]
+            # decode() replaces the entries in cache with extended tensors
+            self._next_cache = cache
+            self._log_probs = log_prob_from_logits(
+                tf.squeeze(logits, [0, 1, 2, 3]))
+
     def _add_problem_hparams(
             self, hparams, src_vocab_size, trg_vocab_size, problem_name):
         """Add problem hparams for the problems. 
@@ -315,7 +439,12 @@ class T2TPredictor(_BaseTensor2TensorPredictor):
         return hparams
                 
     def predict_next(self):
-        """Call the T2T model in self.mon_sess."""
+        """Call the T2T model in self.mon_sess. In incremental mode, 
+        the posterior has already been computed by the last decoder 
+        step.
+        """
+        if self.incremental:
+            return self.log_probs
         log_probs = self.mon_sess.run(self._log_probs,
             {self._inputs_var: self.src_sentence,
              self._targets_var: utils.oov_to_unk(
@@ -323,29 +452,76 @@ class T2TPredictor(_BaseTensor2TensorPredictor):
                  self.trg_vocab_size)})
         log_probs[text_encoder.PAD_ID] = utils.NEG_INF
         return log_probs
+
+    def _decoder_step(self, word):
+        """Runs a single decoder step in incremental mode. Feeds 
+        ``word`` at position ``len(self.consumed)`` and updates 
+        ``self.cache`` and ``self.log_probs``.
+        
+        Args:
+            word (int): Input word of the decoder step
+        """
+        feed_dict = {
+            self._step_enc_output_var: self.encoder_output,
+            self._step_enc_dec_bias_var: self.enc_dec_bias,
+            self._step_word_var: utils.oov_to_unk([word],
+                                                  self.trg_vocab_size)[0],
+            self._step_pos_var: len(self.consumed)}
+        for layer_name, layer_vars in self._cache_vars.iteritems():
+            for key, var in layer_vars.iteritems():
+                feed_dict[var] = self.cache[layer_name][key]
+        self.log_probs, self.cache = self.mon_sess.run(
+            (self._log_probs, self._next_cache), feed_dict)
+        self.log_probs[text_encoder.PAD_ID] = utils.NEG_INF
     
     def initialize(self, src_sentence):
-        """Set src_sentence, reset consumed."""
+        """Set src_sentence, reset consumed. In incremental mode, also
+        encode the source sentence and run the first decoder step.
+        """
         self.consumed = []
         self.src_sentence = utils.oov_to_unk(
             src_sentence + [text_encoder.EOS_ID], 
             self.src_vocab_size)
+        if self.incremental:
+            self.encoder_output, self.enc_dec_bias = self.mon_sess.run(
+                (self._encoder_output, self._enc_dec_bias),
+                {self._inputs_var: self.src_sentence})
+            self.cache = self._empty_cache
+            self._decoder_step(text_encoder.PAD_ID)
    
     def consume(self, word):
-        """Append ``word`` to the current history."""
-        self.consumed.append(word)
+        """Append ``word`` to the current history. In incremental 
+        mode, run the decoder for ``word``.
+        """
+        self.consumed = self.consumed + [word]
+        if self.incremental:
+            self._decoder_step(word)
     
     def get_state(self):
-        """The predictor state is the complete history."""
+        """The predictor state is the complete history. In incremental
+        mode, it also contains the decoder layer cache and the 
+        posterior for the next word.
+        """
+        if self.incremental:
+            return self.consumed, self.cache, self.log_probs
         return self.consumed
     
     def set_state(self, state):
         """The predictor state is the complete history."""
-        self.consumed = state
+        if self.incremental:
+            self.consumed, self.cache, self.log_probs = state
+        else:
+            self.consumed = state
 
     def is_equal(self, state1, state2):
         """Returns true if the history is the same """
+        if self.incremental:
+            return state1[0] == state2[0]
         return state1 == state2
+    
+    def has_persistent_state(self):
+        """``consume()`` creates new state objects. """
+        return True
 
 
 class FertilityT2TPredictor(T2TPredictor):
@@ -400,7 +576,7 @@ class FertilityT2TPredictor(T2TPredictor):
             target = 4 + self.n_aligned_words
             if target >= self.trg_vocab_size:
                 target = utils.UNK_ID
-            self.fertility_history.append(target)
+            self.fertility_history = self.fertility_history + [target]
             self.n_aligned_words = 0
             self._update_scores()
         elif word != 6 and word != 7: 
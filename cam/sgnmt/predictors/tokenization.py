@@ -25,6 +25,15 @@ EPS_ID = 0
 """OpenFST's reserved ID for epsilon arcs. """
 
 
+def _copy_pred_state(predictor, pred_state):
+    """Returns a deep copy of ``pred_state`` unless ``predictor`` has
+    persistent states (see ``Predictor.has_persistent_state()``).
+    """
+    if predictor.has_persistent_state():
+        return pred_state
+    return copy.deepcopy(pred_state)
+
+
 class CombinedState(object):
     """Combines an FST state with predictor state. Use by the fsttok
     predictor.
@@ -34,56 +43,37 @@ class CombinedState(object):
                  fst_node, 
                  pred_state, 
                  posterior, 
-                 unconsumed = [], 
+                 unconsumed = (), 
                  pending_score = 0.0):
         self.fst_node = fst_node
         self.pred_state = pred_state
         self.posterior = posterior
-        self.unconsumed = list(unconsumed)
+        self.unconsumed = tuple(unconsumed)
         self.pending_score = pending_score
     
-    def traverse_fst(self, trans_fst, char):
+    def traverse_fst(self, closure_arcs):
         """Returns a list of ``CombinedState``s with the same predictor
         state and posterior, but an ``fst_node`` which is reachable
-        via the input label ``char``. If the output tabe contains
-        symbols, add them to ``unconsumed``.
+        via the input label of the arcs in ``closure_arcs``. The output
+        labels along the paths are added to ``unconsumed``.
         
         Args:
-            trans_fst (Fst): FST to traverse
-            char (int): Index of character
+            closure_arcs (list): List of ``(nextstate, olabels)`` tuples
+                                 from the epsilon closure of 
+                                 ``fst_node`` for a single input label
+                                 (see ``FSTTokPredictor._get_closure``)
         
         Returns:
-            list. List of combined states reachable via ``char``
-        """
-        ret = []
-        self._dfs(trans_fst, ret, self.fst_node, char, self.unconsumed)
-        return ret
-    
-    def _dfs(self, trans_fst, acc, root_node, char, cur_unconsumed):
-        """Helper method for ``traverse_fst`` for traversing the FST
-        along ``char`` and epsilon arcs with DFS.
-        
-        Args:
-            trans_fst (Fst): FST to traverse
-            acc (list): Accumulator list
-            root_node (int): State in the FST to start
-            char (int): Index of character
-            cur_unconsumed (list): Unconsumed predictor tokens so far
+            list. List of combined states reachable via the input label
         """
-        for arc in trans_fst.arcs(root_node):
-            next_unconsumed = list(cur_unconsumed)
-            if arc.olabel != EPS_ID:
-                next_unconsumed.append(arc.olabel)
-            if arc.ilabel == EPS_ID:
-                self._dfs(trans_fst, acc, arc.nextstate, char, next_unconsumed)
-            elif arc.ilabel == char:
-                acc.append(CombinedState(arc.nextstate,
-                                         self.pred_state,
-                                         self.posterior,
-                                         next_unconsumed,
-                                         self.pending_score))
+        return [CombinedState(nextstate,
+                              self.pred_state,
+                              self.posterior,
+                              self.unconsumed + olabels,
+                              self.pending_score)
+                for nextstate, olabels in closure_arcs]
     
-    def score(self, token, predictor):
+    def score(self, token, predictor, cache=None):
         """Returns a score which can be added if ``token`` is consumed
         next. This is not necessarily the full score but an upper bound
         on it: Continuations will have a score lower or equal than
@@ -91,30 +81,48 @@ class CombinedState(object):
         consume tokens with the wrapped predictor.
         """
         if token and self.unconsumed:
-            self.consume_all(predictor)
+            self.consume_all(predictor, cache)
         s = self.pending_score
         if token:
             s += self._get_token_score(token, predictor)
         return s
     
-    def consume_all(self, predictor):
+    def consume_all(self, predictor, cache=None):
         """Consume all unconsumed tokens and update pred_state, 
         pending_score, and posterior accordingly.
         
         Args:
             predictor (Predictor): Predictor instance
+            cache (dict): If not None, share the results between
+                          combined states with the same predictor
+                          state, posterior, and unconsumed tokens.
+                          Such states are created when the same
+                          output labels can be reached via different
+                          FST nodes
         """
         if not self.unconsumed:
             return
+        if cache is not None:
+            key = (id(self.pred_state), id(self.posterior), self.unconsumed)
+            cached = cache.get(key)
+            if cached is not None:
+                self.pred_state, self.posterior, score = cached
+                self.pending_score += score
+                self.unconsumed = ()
+                return
         if self.posterior is None:
             self.update_posterior(predictor)
-        predictor.set_state(copy.deepcopy(self.pred_state))
+        predictor.set_state(_copy_pred_state(predictor, self.pred_state))
+        score = 0.0
         for token in self.unconsumed:
-            self.pending_score += self._get_token_score(token, predictor)
+            score += self._get_token_score(token, predictor)
             predictor.consume(token)
             self.posterior = predictor.predict_next()
-        self.pred_state = copy.deepcopy(predictor.get_state())
-        self.unconsumed = []
+        self.pending_score += score
+        self.pred_state = _copy_pred_state(predictor, predictor.get_state())
+        self.unconsumed = ()
+        if cache is not None:
+            cache[key] = (self.pred_state, self.posterior, score)
     
     def consume_single(self, predictor):
         """Consume a single token in ``self.unconsumed``.
@@ -141,10 +149,10 @@ class CombinedState(object):
         """
         if not self.posterior is None:
             return
-        predictor.set_state(copy.deepcopy(self.pred_state))
+        predictor.set_state(_copy_pred_state(predictor, self.pred_state))
         predictor.consume(self.unconsumed[0])
         self.posterior = predictor.predict_next()
-        self.pred_state = copy.deepcopy(predictor.get_state())
+        self.pred_state = _copy_pred_state(predictor, predictor.get_state())
         self.unconsumed = self.unconsumed[1:]
         
 
@@ -160,6 +168,10 @@ class FSTTokPredictor(Predictor):
       consumed characters
     - The output labels on the path to the node are consistent with the
       predictor states
+    
+    The epsilon closure of each FST node is computed when the node is
+    visited for the first time and reused for all following sentences
+    since the FST does not change.
     """
     
     def __init__(self, path, fst_unk_id, max_pending_score, slave_predictor):
@@ -182,6 +194,69 @@ class FSTTokPredictor(Predictor):
             logging.fatal("fsttok cannot wrap an unbounded "
                           "vocabulary predictor.")
         self.trans_fst = utils.load_fst(path)
+        self.closures = {}
+        self.olabel_seqs = {}
+    
+    def _get_closure(self, node):
+        """Returns the epsilon closure of ``node``, i.e. all non-epsilon
+        arcs which can be reached from ``node`` via epsilon arcs.
+        
+        Args:
+            node (int): FST node
+        
+        Returns:
+            arcs,tokens. ``arcs`` is a dict which maps input labels to
+            lists of distinct ``(nextstate, olabels)`` tuples, where
+            ``olabels`` is the (interned) tuple of non-epsilon output
+            labels along the path. ``tokens`` is a list of distinct
+            ``(ilabel, first_olabel)`` tuples in DFS order. 
+            ``first_olabel`` is None if the path has no output label
+        """
+        closure = self.closures.get(node)
+        if closure is None:
+            arcs_by_ilabel = {}
+            tokens = []
+            seen_arcs = set()
+            seen_tokens = set()
+            for ilabel, nextstate, olabels in self._collect_closure_arcs(
+                    node, (), []):
+                arc = (ilabel, nextstate, olabels)
+                if not arc in seen_arcs:
+                    seen_arcs.add(arc)
+                    arcs_by_ilabel.setdefault(ilabel, []).append(
+                        (nextstate, olabels))
+                token = (ilabel, olabels[0] if olabels else None)
+                if not token in seen_tokens:
+                    seen_tokens.add(token)
+                    tokens.append(token)
+            closure = (arcs_by_ilabel, tokens)
+            self.closures[node] = closure
+        return closure
+    
+    def _collect_closure_arcs(self, node, olabels, acc):
+        """Helper method for ``_get_closure`` which traverses epsilon
+        arcs with DFS.
+        
+        Args:
+            node (int): Current FST node
+            olabels (tuple): Output labels on the path to ``node``
+            acc (list): Accumulator list for 
+                        ``(ilabel, nextstate, olabels)`` tuples
+        
+        Returns:
+            list. ``acc``
+        """
+        for arc in self.trans_fst.arcs(node):
+            next_olabels = olabels
+            if arc.olabel != EPS_ID:
+                next_olabels = olabels + (arc.olabel,)
+            if arc.ilabel == EPS_ID:
+                self._collect_closure_arcs(arc.nextstate, next_olabels, acc)
+            else:
+                next_olabels = self.olabel_seqs.setdefault(next_olabels,
+                                                           next_olabels)
+                acc.append((arc.ilabel, arc.nextstate, next_olabels))
+        return acc
     
     def initialize(self, src_sentence):
         """Pass through to slave predictor. The source sentence is not
@@ -203,27 +278,22 @@ class FSTTokPredictor(Predictor):
         self.slave_predictor.initialize_heuristic(src_sentence)
     
     def predict_next(self):
+        """Builds up ``last_prediction`` from the epsilon closures of
+        the FST nodes in ``states``.
+        """
         self.last_prediction = {}
+        slave_cache = {}
         for state in self.states:
-            self._collect_chars(state, state.fst_node, None)
-        return self.last_prediction
-    
-    def _collect_chars(self, state, root_node, first_olabel):
-        """Recursively builds up ``last_prediction`` by traversing
-        epsilon arcs in the FST from ``root_node``
-        """
-        for arc in self.trans_fst.arcs(root_node):
-            arc_first_olabel = first_olabel if first_olabel else arc.olabel
-            if arc.ilabel == EPS_ID:
-                self._collect_chars(state, arc.nextstate, arc_first_olabel)
-            else:
-                score = state.score(arc_first_olabel, self.slave_predictor)
-                if arc.ilabel in self.last_prediction: 
-                    self.last_prediction[arc.ilabel] = max(
-                                            self.last_prediction[arc.ilabel], 
+            _, tokens = self._get_closure(state.fst_node)
+            for ilabel, token in tokens:
+                score = state.score(token, self.slave_predictor, slave_cache)
+                if ilabel in self.last_prediction: 
+                    self.last_prediction[ilabel] = max(
+                                            self.last_prediction[ilabel], 
                                             score)
                 else:
-                    self.last_prediction[arc.ilabel] = score
+                    self.last_prediction[ilabel] = score
+        return self.last_prediction
         
     def get_unk_probability(self, posterior):
         """Always returns negative infinity. Handling UNKs needs to be 
@@ -256,7 +326,10 @@ class FSTTokPredictor(Predictor):
         """
         next_states = []
         for state in self.states:
-            next_states.extend(state.traverse_fst(self.trans_fst, word))
+            arcs_by_ilabel, _ = self._get_closure(state.fst_node)
+            closure_arcs = arcs_by_ilabel.get(word)
+            if closure_arcs:
+                next_states.extend(state.traverse_fst(closure_arcs))
         consumed_score = self.last_prediction.get(word, 0.0)
         for state in next_states:
             state.pending_score -= consumed_score
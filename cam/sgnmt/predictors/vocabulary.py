@@ -3,11 +3,17 @@ wrapped predictor. An example is the idxmap wrapper which makes it
 possible to use an alternative word map.
 """
 
+import heapq
 import logging
 import copy
 
+import numpy as np
+
 from cam.sgnmt import utils
-from cam.sgnmt.predictors.core import Predictor, UnboundedVocabularyPredictor
+from cam.sgnmt.misc.cache import LRUCache
+from cam.sgnmt.predictors.core import Predictor, \
+                                      UnboundedVocabularyPredictor, \
+                                      BatchPredictor
 
 
 class IdxmapPredictor(Predictor):
@@ -122,6 +128,10 @@ class IdxmapPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Pass through to slave predictor """
         return self.slave_predictor.is_equal(state1, state2)
+    
+    def get_recombination_key(self, state):
+        """Pass through to slave predictor """
+        return self.slave_predictor.get_recombination_key(state)
         
 
 class UnboundedIdxmapPredictor(IdxmapPredictor,UnboundedVocabularyPredictor):
@@ -217,6 +227,10 @@ class UnkvocabPredictor(Predictor):
     def is_equal(self, state1, state2):
         """Pass through to slave predictor """
         return self.slave_predictor.is_equal(state1, state2)
+    
+    def get_recombination_key(self, state):
+        """Pass through to slave predictor """
+        return self.slave_predictor.get_recombination_key(state)
 
 
 class SkipvocabInternalHypothesis(object):
@@ -235,9 +249,16 @@ class SkipvocabPredictor(Predictor):
     this wrapper. Therefore, this wrapper does not produce any word
     from the larger vocabulary, but searches internally until enough
     in-vocabulary word scores are collected from the wrapped predictor.
+
+    If the slave predictor is a ``BatchPredictor``, all hypotheses of
+    the internal beam search are scored in a single batch. Slave states
+    are only copied if the slave predictor does not have persistent
+    states. The results of the internal beam search are cached by the
+    history of consumed words, which determines the slave state.
     """
     
-    def __init__(self, max_id, stop_size, beam, slave_predictor):
+    def __init__(self, max_id, stop_size, beam, slave_predictor,
+                 cache_max_entries=0):
         """Creates a new skipvocab wrapper predictor.
         
         Args:
@@ -246,15 +267,26 @@ class SkipvocabPredictor(Predictor):
                              stop_size words are in-vocabulary
             beam (int): Beam size of internal beam search
             slave_predictor (Predictor): Wrapped predictor.
+            cache_max_entries (int): Maximum number of cached internal
+                                     search results. Set to 0 for no
+                                     limit
         """
         super(SkipvocabPredictor, self).__init__()
         self.slave_predictor = slave_predictor
         self.max_id = max_id
         self.stop_size = stop_size
         self.beam = beam
+        self.use_batch = isinstance(slave_predictor, BatchPredictor)
+        self.persistent_slave = slave_predictor.has_persistent_state()
+        self.cache = LRUCache(max_entries=cache_max_entries)
+        self.history = ()
     
     def initialize(self, src_sentence):
-        """Pass through to slave predictor """
+        """Pass through to slave predictor, resets the cache. """
+        if self.cache:
+            logging.debug("Skipvocab cache: %s" % self.cache.get_stats())
+        self.cache.clear()
+        self.history = ()
         self.slave_predictor.initialize(src_sentence)
     
     def initialize_heuristic(self, src_sentence):
@@ -265,12 +297,79 @@ class SkipvocabPredictor(Predictor):
         """Pass through to slave predictor """
         return self.slave_predictor.get_unk_probability(posterior)
 
+    def _copy_state(self, state):
+        """Copies a slave state unless it is persistent. """
+        if self.persistent_slave:
+            return state
+        return copy.deepcopy(state)
+
     def _is_stopping_posterior(self, posterior):
-        for word, _ in sorted(utils.common_iterable(posterior),
-                              key=lambda h: -h[1])[:self.stop_size]:
-            if word > self.max_id:
-                return False
-        return True
+        """Returns true if the best ``stop_size`` words in
+        ``posterior`` are in-vocabulary.
+        """
+        if isinstance(posterior, dict):
+            best_words = heapq.nlargest(self.stop_size, posterior,
+                                        key=posterior.get)
+            return all(word <= self.max_id for word in best_words)
+        posterior = np.asarray(posterior)
+        if self.stop_size >= len(posterior):
+            return len(posterior) <= self.max_id + 1
+        best_words = np.argpartition(-posterior,
+                                     self.stop_size - 1)[:self.stop_size]
+        return np.all(best_words <= self.max_id)
+
+    def _get_oov_expansions(self, posterior):
+        """Returns the best ``beam`` OOV words in ``posterior``. Only
+        those can be part of the next internal beam.
+
+        Returns:
+            list. List of (word, score) tuples
+        """
+        if isinstance(posterior, dict):
+            return heapq.nlargest(
+                self.beam,
+                [(w, s) for w, s in posterior.iteritems() if w > self.max_id],
+                key=lambda x: x[1])
+        oov_scores = np.asarray(posterior)[self.max_id+1:]
+        if len(oov_scores) > self.beam:
+            words = np.argpartition(-oov_scores, self.beam - 1)[:self.beam]
+        else:
+            words = np.arange(len(oov_scores))
+        return [(w + self.max_id + 1, oov_scores[w]) for w in words]
+
+    def _score_hypos(self, hypos):
+        """Consumes the pending words of internal hypotheses and
+        computes the slave posteriors.
+
+        Args:
+            hypos (list): List of ``SkipvocabInternalHypothesis``
+
+        Returns:
+            list. List of (slave state, posterior) tuples, one for each
+            entry in ``hypos``
+        """
+        if self.use_batch:
+            states = [hypo.predictor_state for hypo in hypos]
+            consume_idx = [idx for idx, hypo in enumerate(hypos)
+                           if hypo.word_to_consume is not None]
+            if consume_idx:
+                new_states = self.slave_predictor.consume_batch(
+                    [states[idx] for idx in consume_idx],
+                    [hypos[idx].word_to_consume for idx in consume_idx])
+                for idx, state in zip(consume_idx, new_states):
+                    states[idx] = state
+            posteriors = self.slave_predictor.predict_next_batch(states)
+            return zip(states, posteriors)
+        results = []
+        for hypo in hypos:
+            self.slave_predictor.set_state(self._copy_state(
+                hypo.predictor_state))
+            if hypo.word_to_consume is not None:
+                self.slave_predictor.consume(hypo.word_to_consume)
+            posterior = self.slave_predictor.predict_next()
+            results.append((self._copy_state(self.slave_predictor.get_state()),
+                            posterior))
+        return results
  
     def predict_next(self):
         """This method first performs beam search internally to update
@@ -279,6 +378,12 @@ class SkipvocabPredictor(Predictor):
         (bounded by max_id). Then, it returns the slave posterior in 
         that state.
         """
+        cached = self.cache.get(self.history)
+        if cached is not None:
+            best_predictor_state, best_posterior = cached
+            self.slave_predictor.set_state(self._copy_state(
+                best_predictor_state))
+            return best_posterior
         hypos = [SkipvocabInternalHypothesis(0.0, 
                                              self.slave_predictor.get_state(),
                                              None)]
@@ -287,13 +392,8 @@ class SkipvocabPredictor(Predictor):
         best_posterior = None
         while hypos and hypos[0].score > best_score:
             next_hypos = []
-            for hypo in hypos:
-                self.slave_predictor.set_state(copy.deepcopy(
-                    hypo.predictor_state))
-                if hypo.word_to_consume is not None:
-                    self.slave_predictor.consume(hypo.word_to_consume)
-                posterior = self.slave_predictor.predict_next()
-                pred_state = copy.deepcopy(self.slave_predictor.get_state())
+            for hypo, (pred_state, posterior) in zip(hypos,
+                                                     self._score_hypos(hypos)):
                 if (self._is_stopping_posterior(posterior) 
                         and hypo.score > best_score):
                     # This is the new best result of the internal beam search
@@ -302,26 +402,34 @@ class SkipvocabPredictor(Predictor):
                     best_posterior = posterior
                 else:
                     # Look for ways to expand this hypo with OOV words.
-                    for word, score in utils.common_iterable(posterior):
-                        if word > self.max_id:
-                            next_hypos.append(SkipvocabInternalHypothesis(
-                                hypo.score + score, pred_state, word))
+                    for word, score in self._get_oov_expansions(posterior):
+                        next_hypos.append(SkipvocabInternalHypothesis(
+                            hypo.score + score, pred_state, word))
             next_hypos.sort(key=lambda h: -h.score)
             hypos = next_hypos[:self.beam]
-        self.slave_predictor.set_state(copy.deepcopy(best_predictor_state))
+        self.cache.add(self.history, (best_predictor_state, best_posterior))
+        self.slave_predictor.set_state(self._copy_state(best_predictor_state))
         return best_posterior
         
     def consume(self, word):
         """Pass through to slave predictor """
+        self.history = self.history + (word,)
         self.slave_predictor.consume(word)
     
     def get_state(self):
-        """Pass through to slave predictor """
-        return self.slave_predictor.get_state()
+        """The state consists of the slave predictor state and the
+        history of consumed words which is used as cache key.
+        """
+        return self.slave_predictor.get_state(), self.history
     
     def set_state(self, state):
+        """Sets the slave predictor state and the history. """
+        slave_state, self.history = state
+        self.slave_predictor.set_state(slave_state)
+
+    def has_persistent_state(self):
         """Pass through to slave predictor """
-        self.slave_predictor.set_state(state)
+        return self.persistent_slave
 
     def estimate_future_cost(self, hypo):
         """Pass through to slave predictor """
@@ -336,5 +444,9 @@ class SkipvocabPredictor(Predictor):
     
     def is_equal(self, state1, state2):
         """Pass through to slave predictor """
-        return self.slave_predictor.is_equal(state1, state2)
+        return self.slave_predictor.is_equal(state1[0], state2[0])
+    
+    def get_recombination_key(self, state):
+        """Pass through to slave predictor """
+        return self.slave_predictor.get_recombination_key(state[0])
 
@@ -0,0 +1,180 @@
+"""This module implements the 'server' input method of SGNMT. The
+server keeps the decoder and all loaded models in memory and accepts
+translation requests over HTTP. Requests are POSTed as JSON objects of
+the form
+
+  {"sentences": ["1 123 432 2", "1 55 2"]}
+
+where each sentence is a sequence of source word IDs. The response
+contains the n-best list for each sentence:
+
+  {"results": [[{"trgt_sentence": [4, 5, 2],
+                 "text": "...",
+                 "total_score": -2.3,
+                 "score_breakdown": [[[-1.2, 1.0]], ...]}, ...], ...]}
+
+HTTP requests are handled in separate threads, but all decoding is done
+by a single thread since decoders and predictors are not thread-safe.
+Requests are decoded one after another in the order they arrive. If
+decoding a request fails, the server responds with HTTP status 500.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import Queue
+from SocketServer import ThreadingMixIn
+import threading
+
+from cam.sgnmt import decode_utils
+from cam.sgnmt import utils
+
+
+class DecodingRequest(object):
+    """A single request to the decoding server. The HTTP handler
+    thread waits on ``done`` until the decoding thread has filled in
+    either ``results`` or ``error``.
+    """
+
+    def __init__(self, src_sentences):
+        """Creates a new request.
+
+        Args:
+            src_sentences (list): List of source sentences, each of
+                                  them as list of word ID strings
+        """
+        self.src_sentences = src_sentences
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+def hypo_to_json(hypo):
+    """Converts a complete hypothesis to a JSON serializable dict.
+
+    Args:
+        hypo (Hypothesis): Complete hypothesis
+
+    Returns:
+        dict. Target sentence, string representation, total score, and
+        score breakdown of ``hypo``
+    """
+    return {"trgt_sentence": [int(w) for w in hypo.trgt_sentence],
+            "text": utils.apply_trg_wmap(
+                        hypo.trgt_sentence,
+                        {} if utils.trg_cmap else utils.trg_wmap),
+            "total_score": float(hypo.total_score),
+            "score_breakdown": [[[float(s), float(w)] for s, w in scores]
+                                for scores in hypo.score_breakdown]}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server which handles each request in a separate thread. """
+    daemon_threads = True
+
+
+class DecodingServer(object):
+    """Persistent decoding server. The HTTP server runs in a
+    background thread and puts requests to a queue. ``serve()`` runs
+    the decoding loop in the calling thread.
+    """
+
+    def __init__(self, decoder, host, port):
+        """Creates a new decoding server but does not start it yet.
+
+        Args:
+            decoder (Decoder): Decoder instance with all predictors
+                               already loaded
+            host (string): Host name to bind to
+            port (int): Port to listen on
+        """
+        self.decoder = decoder
+        self.requests = Queue.Queue()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server._handle_post(self)
+
+            def log_message(self, format, *args):
+                logging.debug("%s - %s" % (self.address_string(),
+                                           format % args))
+        self.http_server = _ThreadingHTTPServer((host, port), Handler)
+
+    def _handle_post(self, handler):
+        """Parses the request in ``handler``, waits until it is
+        decoded, and sends the JSON response.
+        """
+        try:
+            length = int(handler.headers.getheader('content-length', 0))
+            body = json.loads(handler.rfile.read(length))
+            src_sentences = [s.strip().split() for s in body["sentences"]]
+        except Exception as e:
+            logging.warn("Invalid request to decoding server: %s" % e)
+            self._send(handler, 400, {"error": "Invalid request: %s" % e})
+            return
+        request = DecodingRequest(src_sentences)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            self._send(handler, 500, {"error": request.error})
+        else:
+            self._send(handler, 200, {"results": request.results})
+
+    def _send(self, handler, code, obj):
+        """Sends ``obj`` as JSON with HTTP status ``code``. """
+        response = json.dumps(obj)
+        handler.send_response(code)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(response)))
+        handler.end_headers()
+        handler.wfile.write(response)
+
+    def _process(self, request):
+        """Decodes all sentences in ``request`` and stores the results.
+        Errors are stored in ``request.error`` such that the HTTP 
+        handler thread is always woken up and the server keeps running.
+        """
+        try:
+            all_hypos = decode_utils.decode_batch(self.decoder,
+                                                  request.src_sentences)
+            request.results = [[hypo_to_json(h) for h in hypos]
+                               for hypos in all_hypos]
+        except Exception as e:
+            logging.error("Decoding server request failed: %s" % e)
+            request.error = "Decoding failed: %s" % e
+        finally:
+            if request.results is None and request.error is None:
+                request.error = "Decoding interrupted"
+            request.done.set()
+
+    def _reject_pending(self):
+        """Wakes up the HTTP handler threads of all requests which are
+        still in the queue with an error.
+        """
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except Queue.Empty:
+                return
+            request.error = "Decoding server is shutting down"
+            request.done.set()
+
+    def serve(self):
+        """Starts the HTTP server and runs the decoding loop until the
+        process is interrupted.
+        """
+        http_thread = threading.Thread(target=self.http_server.serve_forever)
+        http_thread.daemon = True
+        http_thread.start()
+        logging.info("Decoding server listening on %s:%d"
+                     % self.http_server.server_address)
+        try:
+            while True:
+                self._process(self.requests.get())
+        except KeyboardInterrupt:
+            logging.info("Shutting down decoding server")
+        finally:
+            self._reject_pending()
+            self.http_server.shutdown()
+            self.http_server.server_close()
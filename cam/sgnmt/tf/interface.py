@@ -35,7 +35,11 @@ def tf_get_nmt_predictor(args, nmt_path, nmt_config):
   global session
   if not session:
     session = tf.Session()
-  return TensorFlowNMTPredictor(args.cache_nmt_posteriors, nmt_config, session)
+  return TensorFlowNMTPredictor(args.cache_nmt_posteriors,
+                                nmt_config,
+                                session,
+                                args.nmt_cache_max_entries,
+                                int(args.nmt_cache_max_mb * 1024 * 1024))
 
 def tf_get_default_nmt_config():
     """Get default NMT configuration. """
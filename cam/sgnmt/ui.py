@@ -104,6 +104,37 @@ def get_parser():
                         "points to a file, we grap sentence IDs to translate "
                         "from that file and delete the decoded IDs. This can "
                         "be used for distributed decoding.")
+    group.add_argument("--num_workers", default=1, type=int,
+                        help="Number of decoding processes. If this is "
+                        "greater than 1, SGNMT forks worker processes after "
+                        "loading the models, which then decode different "
+                        "sentences in parallel. Model weights are shared "
+                        "between workers copy-on-write. Output files are "
+                        "written in the original sentence order. Note that "
+                        "this does not work with backends which do not "
+                        "support forking after initialization (e.g. "
+                        "TensorFlow sessions using the GPU).")
+    group.add_argument("--profile_startup", default=False, type='bool',
+                        help="Log a report after initialization which "
+                        "breaks down the startup time into the time for "
+                        "importing backend modules and the time for loading "
+                        "each predictor and the decoder. Backend modules "
+                        "(Theano, TensorFlow, SRILM, ...) are only imported "
+                        "if they are required by --predictors or --decoder.")
+    group.add_argument("--profile_decoder", default=False, type='bool',
+                        help="Instrument the decoder and log a report at the "
+                        "end which breaks down the decoding time into the "
+                        "time spent in each predictor method (predict_next, "
+                        "consume, get_state, set_state, get_unk_probability, "
+                        "is_equal) and in the decoder helpers for finding "
+                        "possible words, combination, interpolation, and "
+                        "copying predictor states. Instrumentation is also "
+                        "enabled by the profilecsv and profilejson outputs "
+                        "and --profile_prometheus_file.")
+    group.add_argument("--profile_prometheus_file", default="",
+                        help="If set, the aggregated decoder instrumentation "
+                        "statistics are written to this file in the "
+                        "Prometheus text format after each sentence.")
     group.add_argument("--src_test", default="",
                         help="Path to source test set. This is expected to be "
                         "a plain text file with one source sentence in each "
@@ -123,14 +154,18 @@ def get_parser():
                        help="SGNMT terminates when a sanity check fails by "
                        "default. Set this to true to ignore sanity checks.")
     group.add_argument("--input_method", default="file",
-                        choices=['dummy', 'file', 'shell', 'stdin'],
+                        choices=['dummy', 'file', 'shell', 'stdin',
+                                 'server'],
                         help="This parameter controls how the input to SGNMT "
-                        "is provided. SGNMT supports three modes:\n\n"
+                        "is provided. SGNMT supports these modes:\n\n"
                         "* 'dummy': Use dummy source sentences.\n"
                         "* 'file': Read test sentences from a plain text file"
                             "specified by --src_test.\n"
                         "* 'shell': Start SGNMT in an interactive shell.\n"
-                        "* 'stdin': Test sentences are read from stdin\n\n"
+                        "* 'stdin': Test sentences are read from stdin\n"
+                        "* 'server': Start an HTTP server which accepts "
+                        "JSON requests and returns n-best lists as JSON. See "
+                        "--server_* parameters and the server module.\n\n"
                         "In shell and stdin mode you can change SGNMT options "
                         "on the fly: Beginning a line with the string '!sgnmt '"
                         " signals SGNMT directives instead of sentences to "
@@ -141,6 +176,12 @@ def get_parser():
                         " with MERT to avoid start up times between "
                         "evaluations. Note that input sentences still have to "
                         "be written using word ids in all cases.")
+    group.add_argument("--server_host", default="localhost",
+                        help="Host name the decoding server binds to if "
+                        "--input_method is 'server'.")
+    group.add_argument("--server_port", default=5555, type=int,
+                        help="Port of the decoding server if --input_method "
+                        "is 'server'.")
     group.add_argument("--log_sum",  default="log",
                         choices=['tropical', 'log'],
                         help="Controls how to compute the sum in the log "
@@ -308,6 +349,12 @@ def get_parser():
                         help="Whether to cache heuristic future cost "
                         "estimates. This is especially useful with the greedy "
                         "heuristic.")
+    group.add_argument("--heuristic_cache_max_entries", default=100000,
+                        type=int,
+                        help="Maximum number of cached heuristic estimates "
+                        "per sentence if --cache_heuristic_estimates is "
+                        "enabled. Least recently used estimates are evicted "
+                        "first. Set to 0 for no limit.")
     group.add_argument("--pure_heuristic_scores", default=False, type='bool',
                         help="If this is set to false, heuristic decoders as "
                         "A* score hypotheses with the sum of the partial hypo "
@@ -457,19 +504,49 @@ def get_parser():
     group.add_argument("--output_path", default="sgnmt-out.%s",
                         help="Path to the output files generated by SGNMT. You "
                         "can use the placeholder %%s for the format specifier")
+    group.add_argument("--output_sync", default="flush",
+                        choices=['none', 'flush', 'fsync'],
+                        help="Output files are written incrementally after "
+                        "each sentence. This option controls how writes are "
+                        "synchronized with the file system:\n\n"
+                        "* 'none': Rely on the buffering of the file "
+                        "objects.\n"
+                        "* 'flush': Flush Python buffers after each sentence."
+                        "\n"
+                        "* 'fsync': Flush and force the OS to write to disk "
+                        "after each sentence. Slower, but survives machine "
+                        "crashes.\n")
+    group.add_argument("--resume", default=False, type='bool',
+                        help="Resume an aborted run: Sentences which are "
+                        "already present in all output files are skipped, "
+                        "and new results are appended. Partially written "
+                        "outputs from the aborted run are removed. The "
+                        "sentence IDs of the text and n-best outputs are "
+                        "stored in separate files with the suffix '.ids'. "
+                        "This option "
+                        "cannot be used with a file-based --range as it needs "
+                        "to know all sentence IDs in advance.")
     group.add_argument("--outputs", default="",
                         help="Comma separated list of output formats: \n\n"
                         "* 'text': First best translations in plain text "
-                        "format\n"
+                        "format. Sentence IDs are written to a '.ids' file "
+                        "next to it\n"
                         "* 'nbest': Moses' n-best format with separate "
-                        "scores for each predictor.\n"
+                        "scores for each predictor. Sentence IDs are written "
+                        "to a '.ids' file next to it\n"
                         "* 'fst': Translation lattices in OpenFST "
                         "format with sparse tuple arcs.\n"
                         "* 'sfst': Translation lattices in OpenFST "
                         "format with standard arcs (i.e. combined scores).\n"
                         "* 'timecsv': Generate CSV files with separate "
                         "predictor scores for each time step.\n"
-                        "* 'ngram': MBR-style n-gram posteriors.\n\n"
+                        "* 'ngram': MBR-style n-gram posteriors.\n"
+                        "* 'profilecsv': CSV file with the number of calls "
+                        "and the time spent in each predictor method and "
+                        "decoder component for each sentence (see "
+                        "--profile_decoder).\n"
+                        "* 'profilejson': Like 'profilecsv', but with one "
+                        "JSON object per sentence.\n\n"
                         "For extract_scores_along_reference.py, select "
                         "one of the following output formats:\n"
                         "* 'json': Dump data in pretty JSON format.\n"
@@ -746,6 +823,15 @@ def get_parser():
                         "which are outside the NMT vocabulary. If this "
                         "parameter is set to true, we cache posteriors with "
                         "histories containing UNK and reload them when needed")
+    group.add_argument("--nmt_cache_max_entries", default=10000, type=int,
+                        help="Maximum number of entries in the NMT posterior "
+                        "and state caches enabled by --cache_nmt_posteriors. "
+                        "Least recently used entries are evicted first. Set "
+                        "to 0 for no limit.")
+    group.add_argument("--nmt_cache_max_mb", default=1024.0, type=float,
+                        help="Memory cap in MB for each of the NMT posterior "
+                        "and state caches enabled by --cache_nmt_posteriors. "
+                        "Set to 0 for no limit.")
     group.add_argument("--gnmt_beta", default=0.0, type=float,
                        help="If this is greater than zero, add a coverage "
                        "penalization term following Google's NMT (Wu et al., "
@@ -796,6 +882,16 @@ def get_parser():
                        help="Available for the t2t predictor. Path to the "
                        "tensor2tensor checkpoint directory. Same as "
                        "--output_dir in t2t_trainer.")
+    group.add_argument("--t2t_incremental", default=False, type='bool',
+                       help="Available for the t2t predictor. If true, the "
+                       "source sentence is encoded only once, and per-layer "
+                       "attention keys and values of the decoder are cached "
+                       "in the predictor state such that each consumed word "
+                       "requires only one decoder step instead of a forward "
+                       "pass over the full history. This requires models "
+                       "which implement T2T's fast decoding interface "
+                       "(encode() and decode() with cache) like the "
+                       "transformer.")
     group.add_argument("--t2t_src_vocab_size", default=0, type=int,
                         help="DEPRECATED! Use --pred_src_vocab_size")
     group.add_argument("--t2t_trg_vocab_size", default=0, type=int,
@@ -909,6 +1005,12 @@ def get_parser():
                         "predictor wrapper stops if the best stop_size "
                          "scores are for in-vocabulary words (ie. with index "
                          "lower or equal skipvocab_max_id")
+    group.add_argument("--skipvocab_cache_max_entries", default=10000,
+                        type=int,
+                        help="Maximum number of internal beam search results "
+                        "cached by the skipvocab predictor wrapper. Results "
+                        "are reused when the same history is expanded again. "
+                        "Set to 0 for no limit.")
 
     # Forced predictors
     group = parser.add_argument_group('Forced decoding predictor options')
@@ -998,7 +1100,10 @@ def get_parser():
     group = parser.add_argument_group('Hiero predictor options')
     group.add_argument("--rules_path", default="rules/rules",
                         help="Only required for predictor lrhiero. Path to "
-                        "the ruleXtract rules file.")
+                        "the ruleXtract rules file, or to a directory with a "
+                        "binary grammar created with compile_grammar.py. "
+                        "Compiled grammars are memory-mapped and load much "
+                        "faster.")
     group.add_argument("--use_grammar_weights", default=False, type='bool',
                         help="Whether to use weights in the synchronous "
                         "grammar for the lrhiero predictor. If set to false, "
@@ -1041,6 +1146,12 @@ def get_parser():
                         help="Only required for fst and nfst predictor. Sets "
                         "the path to the OpenFST translation lattices. You "
                         "can use the placeholder %%d for the sentence index.")
+    group.add_argument("--fst_prefetch", default=False, type='bool',
+                        help="If true, the fst and nfst predictors read the "
+                        "lattice for the next sentence into memory in a "
+                        "background thread while the current sentence is "
+                        "decoded. This is most useful when sentences are "
+                        "decoded in order.")
     group.add_argument("--rtn_path", default="rtn/",
                         help="Only required for rtn predictor. Sets "
                         "the path to the RTN directory as created by HiFST")
@@ -5,16 +5,17 @@ quirks Python sometimes has.
 """
 
 from abc import abstractmethod
+from collections import OrderedDict
 import numpy
 import operator
 from scipy.misc import logsumexp
 import codecs
-from subprocess import call
-from shutil import copyfile
+import gzip
 import logging
 import os
 import pywrapfst as fst
 import sys
+import threading
 
 # Reserved IDs
 GO_ID = 1
@@ -100,6 +101,8 @@ def log_sum_log_semiring(vals):
     Args:
         vals  (set): List or set of numerical values
     """
+    if isinstance(vals, numpy.ndarray):
+        return logsumexp(vals)
     return logsumexp(numpy.asarray([val for val in vals]))
 
 
@@ -333,8 +336,17 @@ def apply_trg_wmap(seq, inv_wmap = None):
 # FST utilities
 
 
-TMP_FILENAME = '/tmp/sgnmt.%s.fst' % os.getpid()
-"""Temporary file name to use if an FST file is zipped. """
+fst_prefetching = False
+"""If true, ``load_fst`` reads the FST given by its ``prefetch_path``
+argument into memory in a background thread. """
+
+
+MAX_PREFETCHED_FSTS = 4
+"""Maximum number of prefetched FSTs which are kept in memory. """
+
+
+_prefetched_fsts = OrderedDict()
+"""Maps paths to ``[thread, data]`` lists of prefetched FSTs. """
 
 
 def split_comma(s):
@@ -348,30 +360,91 @@ def w2f(fstweight):
     return float(str(fstweight))
 
 
-def load_fst(path):
+def _read_fst_data(path):
+    """Reads the binary content of an FST file. GZipped files are 
+    decompressed in memory.
+    
+    Args:
+        path (string):  Path to the FST file to read
+    
+    Returns:
+        string. Uncompressed FST in binary OpenFST format
+    """
+    if path[-3:].lower() == ".gz":
+        with gzip.open(path, 'rb') as f:
+            return f.read()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _prefetch_fst_data(path, holder):
+    """Target of prefetcher threads. Stores the content of ``path`` in
+    ``holder[1]``, or leaves it None if the file cannot be read.
+    """
+    try:
+        holder[1] = _read_fst_data(path)
+    except Exception as e:
+        logging.debug("Could not prefetch fst from %s: %s" % (path, e))
+
+
+def prefetch_fst(path):
+    """Starts reading the FST file at ``path`` into memory in a 
+    background thread. The next call of ``load_fst`` with the same 
+    path uses the prefetched data instead of accessing the disk. At 
+    most ``MAX_PREFETCHED_FSTS`` FSTs are held in memory. If more are
+    prefetched, the oldest ones are discarded.
+    
+    Args:
+        path (string):  Path to the FST file to prefetch
+    """
+    if path in _prefetched_fsts or not os.path.isfile(path):
+        return
+    while len(_prefetched_fsts) >= MAX_PREFETCHED_FSTS:
+        _prefetched_fsts.popitem(last=False)
+    holder = [None, None]
+    holder[0] = threading.Thread(target=_prefetch_fst_data,
+                                 args=(path, holder))
+    holder[0].daemon = True
+    _prefetched_fsts[path] = holder
+    holder[0].start()
+
+
+def load_fst(path, prefetch_path=None):
     """Loads a FST from the file system using PyFSTs ``read()`` method.
-    GZipped format is also supported. The arc type must be standard
-    or log, otherwise PyFST cannot load them.
+    GZipped format is also supported and is decompressed in memory. 
+    The arc type must be standard or log, otherwise PyFST cannot load
+    them. If ``fst_prefetching`` is enabled, the FST at 
+    ``prefetch_path`` is read in the background such that it is 
+    already in memory when it is loaded (e.g. the lattice for the next
+    sentence).
     
     Args:
         path (string):  Path to the FST file to load
+        prefetch_path (string): Path to the FST file which is likely 
+                                to be loaded next, or None
     Returns:
         fst. PyFST FST object or ``None`` if FST could not be read
     """
+    ret = None
     try:
-        if path[-3:].lower() == ".gz":
-            copyfile(path, "%s.gz" % TMP_FILENAME)
-            call(["gunzip", "%s.gz" % TMP_FILENAME])
-            ret = fst.Fst.read(TMP_FILENAME)
-            os.remove(TMP_FILENAME)
-        else: # Fst not zipped
+        data = None
+        holder = _prefetched_fsts.pop(path, None)
+        if holder is not None:
+            holder[0].join()
+            data = holder[1]
+        if data is None and path[-3:].lower() == ".gz":
+            data = _read_fst_data(path)
+        if data is None: # Fst not zipped and not prefetched
             ret = fst.Fst.read(path)
+        else:
+            ret = fst.Fst.read_from_string(data)
         logging.debug("Read fst from %s" % path)
-        return ret
     except Exception as e:
         logging.error("%s error reading fst from %s: %s" %
             (sys.exc_info()[1], path, e))
-    return None
+    if fst_prefetching and prefetch_path:
+        prefetch_fst(prefetch_path)
+    return ret
 
 
 # Miscellaneous
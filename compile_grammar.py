@@ -0,0 +1,2 @@
+"""Redirect to ``cam.sgnmt.compile_grammar`` """
+import cam.sgnmt.compile_grammar